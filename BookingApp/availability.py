@@ -0,0 +1,231 @@
+from datetime import datetime, timedelta
+from itertools import islice
+from django.db.models import Q
+from .models import FixedOperatingHours, UnFixedOperatingHours, GeneratedTimeSlots, bulk_insert_time_slots, time_slots_on_demand
+from .instrumentation import span
+from .pagination import RowComparison
+
+## ------------------------------------------------------->
+## Salon-day bitmask
+##
+## One salon-day is the opening time, the slot length and an int bitmask where
+## bit i is set when slot i (open_time + i * slot_length) is booked. Free runs,
+## booked intervals and slot listings are all computed from these two ints.
+
+def _minutes(value):
+    return value.hour * 60 + value.minute
+
+
+class SalonDayAvailability:
+    __slots__ = ('salon_id', 'date', 'open_time', 'slot_length', 'slot_count', 'booked')
+
+    def __init__(self, salon_id, date, open_time, close_time, slot_length):
+        self.salon_id = salon_id
+        self.date = date
+        self.open_time = open_time
+        self.slot_length = slot_length
+        if slot_length > 0:
+            self.slot_count = max(0, (_minutes(close_time) - _minutes(open_time)) // slot_length)
+        else:
+            self.slot_count = 0
+        self.booked = 0
+
+    @property
+    def all_slots(self):
+        return (1 << self.slot_count) - 1
+
+    @property
+    def free(self):
+        return self.all_slots & ~self.booked
+
+    def slot_index(self, time_from):
+        offset = _minutes(time_from) - _minutes(self.open_time)
+        if offset < 0 or offset % self.slot_length:
+            return None
+        index = offset // self.slot_length
+        return index if index < self.slot_count else None
+
+    def slot_times(self, index):
+        time_from = datetime.combine(self.date, self.open_time) + timedelta(minutes=index * self.slot_length)
+        return time_from.time(), (time_from + timedelta(minutes=self.slot_length)).time()
+
+    def mark_booked(self, time_from, time_to):
+        # Every slot overlapping [time_from, time_to) becomes unavailable
+        if not self.slot_count:
+            return
+        start = max(0, (_minutes(time_from) - _minutes(self.open_time)) // self.slot_length)
+        end = min(self.slot_count, -(-(_minutes(time_to) - _minutes(self.open_time)) // self.slot_length))
+        if end > start:
+            self.booked |= ((1 << (end - start)) - 1) << start
+
+    def is_free(self, time_from, count=1):
+        index = self.slot_index(time_from)
+        if index is None or index + count > self.slot_count:
+            return False
+        run = ((1 << count) - 1) << index
+        return self.free & run == run
+
+    def free_runs(self, count):
+        # Bit i of the result is set when slots i .. i + count - 1 are all free
+        mask = self.free
+        for _ in range(count - 1):
+            mask &= mask >> 1
+        return mask
+
+    def first_free_run(self, count):
+        mask = self.free_runs(count) if count > 0 else 0
+        if not mask:
+            return None
+        return (mask & -mask).bit_length() - 1
+
+    def iter_slots(self):
+        for index in range(self.slot_count):
+            time_from, time_to = self.slot_times(index)
+            yield GeneratedTimeSlots(
+                salon_id=self.salon_id,
+                date=self.date,
+                time_from=time_from,
+                time_to=time_to,
+                is_available=not (self.booked >> index) & 1,
+            )
+
+## Salon-day bitmask
+## ------------------------------------------------------->
+
+## ------------------------------------------------------->
+## Availability for many salons
+##
+## Three queries whatever the number of salons or days: fixed hours, unfixed
+## hours and booked slots (claimed, or linked to an appointment that is not
+## cancelled). UnFixedOperatingHours replace the fixed hours of their date.
+
+@span('availability')
+def get_availability(salon_ids, start_date, end_date):
+    fixed_hours = FixedOperatingHours.objects.all()
+    unfixed_hours = UnFixedOperatingHours.objects.filter(date__range=(start_date, end_date))
+    booked_slots = GeneratedTimeSlots.objects.filter(date__range=(start_date, end_date)).filter(
+        Q(appointment__status__in=('P', 'C', 'F')) | Q(is_available=False)
+    )
+    if salon_ids is not None:
+        fixed_hours = fixed_hours.filter(salon_id__in=salon_ids)
+        unfixed_hours = unfixed_hours.filter(salon_id__in=salon_ids)
+        booked_slots = booked_slots.filter(salon_id__in=salon_ids)
+
+    hours_by_weekday = {}
+    for salon_id, day_of_week, open_time, close_time, slot_length in fixed_hours.values_list(
+            'salon_id', 'day_of_week', 'open_time', 'close_time', 'time_slot_length'):
+        hours_by_weekday.setdefault(day_of_week, []).append((salon_id, open_time, close_time, slot_length))
+
+    days = {}
+    current_date = start_date
+    while current_date <= end_date:
+        for salon_id, open_time, close_time, slot_length in hours_by_weekday.get(current_date.weekday(), []):
+            days[(salon_id, current_date)] = SalonDayAvailability(salon_id, current_date, open_time, close_time, slot_length)
+        current_date += timedelta(days=1)
+
+    for salon_id, date, open_time, close_time, slot_length in unfixed_hours.values_list(
+            'salon_id', 'date', 'open_time', 'close_time', 'time_slot_length'):
+        days[(salon_id, date)] = SalonDayAvailability(salon_id, date, open_time, close_time, slot_length)
+
+    for salon_id, date, time_from, time_to in booked_slots.values_list('salon_id', 'date', 'time_from', 'time_to').distinct():
+        day = days.get((salon_id, date))
+        if day is not None:
+            day.mark_booked(time_from, time_to)
+
+    return days
+
+
+def iter_available_slots(salon_ids, start_date, end_date):
+    # Unsaved GeneratedTimeSlots ordered like GeneratedTimeSlotsViewSet (salon, date, time_from)
+    days = get_availability(salon_ids, start_date, end_date)
+    for key in sorted(days):
+        yield from days[key].iter_slots()
+
+
+class AvailableSlots:
+    # The computed slots of salon_ids over [start_date, end_date] as a KeysetPagination source:
+    # a page expands salon-days into slots from its cursor on and stops once it is full
+    model = GeneratedTimeSlots
+
+    def __init__(self, salon_ids, start_date, end_date):
+        self.salon_ids = salon_ids
+        self.start_date = start_date
+        self.end_date = end_date
+
+    def iter_from(self, values, reverse=False):
+        # values: the cursor's (salon_id, date, time_from, id) or None
+        days = get_availability(self.salon_ids, self.start_date, self.end_date)
+        keys = sorted(days, reverse=reverse)
+        if values is not None:
+            start = (values[0], values[1])
+            keys = [key for key in keys if (key <= start if reverse else key >= start)]
+        for key in keys:
+            slots = days[key].iter_slots()
+            yield from reversed(list(slots)) if reverse else slots
+
+
+def materialize_day(salon_id, date):
+    # Stores the slots of one salon-day so they can be booked by primary key;
+    # slots that already exist (booked ones included) are left untouched
+    day = get_availability([salon_id], date, date).get((salon_id, date))
+    if day is not None:
+        bulk_insert_time_slots(day.iter_slots())
+    return GeneratedTimeSlots.objects.filter(salon_id=salon_id, date=date).order_by('time_from')
+
+
+def day_time_slots(salon_id, date, time_from, count):
+    # The stored slots of one salon-day from time_from on, at most `count` of them; in
+    # on-demand mode the day is materialized first so the slots can be claimed
+    if time_slots_on_demand():
+        slots = materialize_day(salon_id, date)
+    else:
+        slots = GeneratedTimeSlots.objects.filter(salon_id=salon_id, date=date).order_by('time_from')
+    return list(slots.filter(time_from__gte=time_from)[:count])
+
+## Availability for many salons
+## ------------------------------------------------------->
+
+## ------------------------------------------------------->
+## Free slots of one salon
+##
+## Next free slots and free slots per day, read from slot_free_idx: partial on
+## is_available, keyed (salon, date, time_from) and covering id and time_to,
+## so both lookups are index-only range scans that stop after the rows they
+## return. In on-demand mode the slots are computed from the bitmasks instead
+## (their id is None until the salon-day is materialized).
+
+FREE_SLOT_FIELDS = ('id', 'date', 'time_from', 'time_to')
+
+
+def _free_slot_rows(slots):
+    return [{'id': slot.pk, 'date': slot.date, 'time_from': slot.time_from, 'time_to': slot.time_to}
+            for slot in slots if slot.is_available]
+
+
+def free_slots(salon_id):
+    return GeneratedTimeSlots.objects.filter(salon_id=salon_id, is_available=True).order_by('date', 'time_from')
+
+
+def next_free_slots(salon_id, after, limit, end_date):
+    # The first `limit` free slots starting at or after `after` (a local datetime), up to end_date
+    if time_slots_on_demand():
+        slots = iter_available_slots([salon_id], after.date(), end_date)
+        upcoming = (slot for slot in slots if slot.is_available and (slot.date, slot.time_from) >= (after.date(), after.time()))
+        return _free_slot_rows(islice(upcoming, limit))
+    return list(free_slots(salon_id).filter(date__lte=end_date).filter(
+        RowComparison(('date', 'time_from'), (after.date(), after.time()), '>=')).values(*FREE_SLOT_FIELDS)[:limit])
+
+
+def free_slots_by_day(salon_id, start_date, end_date):
+    # {date: [free slots]} with every day of the range, days without free slots included
+    if time_slots_on_demand():
+        rows = _free_slot_rows(iter_available_slots([salon_id], start_date, end_date))
+    else:
+        rows = free_slots(salon_id).filter(date__range=(start_date, end_date)).values(*FREE_SLOT_FIELDS)
+    days = {start_date + timedelta(days=offset): [] for offset in range((end_date - start_date).days + 1)}
+    for row in rows:
+        days[row['date']].append(row)
+    return days
+
+## Free slots of one salon
+## ------------------------------------------------------->
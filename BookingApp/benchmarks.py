@@ -0,0 +1,617 @@
+import asyncio
+import json
+import math
+import random
+import statistics
+import threading
+import time
+from datetime import time as dtime, timedelta
+from django.contrib.postgres.search import TrigramSimilarity
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import connection, transaction
+from django.db.models import Count, Q, TextField
+from django.db.models.functions import Cast
+from asgiref.sync import ThreadSensitiveContext, sync_to_async
+from django.test import AsyncClient, Client
+from django.test.utils import CaptureQueriesContext, override_settings
+from django.urls import reverse
+from django.utils import timezone
+from rest_framework.exceptions import ValidationError
+from rest_framework.renderers import JSONRenderer
+from .booking import SlotConflict
+from .geocoding import normalize_address
+from .models import Salon, Category, Service, FixedOperatingHours, GeneratedTimeSlots, Appointment, GeocodeCacheEntry, bulk_insert_time_slots, iter_time_slots
+from .serializers import AppointmentSerializer, GeneratedTimeSlotsSerializer, ReadOnlySalonSerializer
+from .fast_render import mappers_for, map_rows, values_lookups, render_drf_json, render_django_json, salon_rows
+from .search import keyword_search
+from .search_index import rebuild_all_search_documents
+from .partitioning import CREATE_TABLE_SQL, INDEXES_SQL, drop_partitions_before, ensure_partitions
+from .synthetic import SYNTHETIC_ADDRESS, SYNTHETIC_PREFIX, CENTER, generate_synthetic_data
+
+## ------------------------------------------------------->
+## Registry
+##
+## Benchmarks run against the configured database through
+## `python manage.py benchmark <name>`. Unless registered with rollback=False,
+## everything a benchmark writes is rolled back when it finishes.
+
+BENCHMARKS = {}
+
+def benchmark(name, rollback=True):
+    def register(func):
+        BENCHMARKS[name] = (func, rollback)
+        return func
+    return register
+
+
+class _Rollback(Exception):
+    pass
+
+
+def run_benchmark(name, **options):
+    func, rollback = BENCHMARKS[name]
+    if not rollback:
+        return func(**options)
+
+    results = {}
+    try:
+        with transaction.atomic():
+            results = func(**options)
+            raise _Rollback
+    except _Rollback:
+        pass
+    return results
+
+
+def create_bench_salons(count, prefix='Bench salon', names=None):
+    # bulk_create bypasses Salon.save(), so no geocoding happens here
+    return Salon.objects.bulk_create([
+        Salon(
+            name=names[i] if names else f'{prefix} {i}',
+            address_city='Warszawa',
+            address_postal_code='00-001',
+            address_street='Marszałkowska',
+            address_number=str(i),
+            about='Benchmark salon',
+            distance_from_query=None,
+        )
+        for i in range(count)
+    ], batch_size=5000)
+
+
+def percentile(samples, percent):
+    # Nearest-rank percentile
+    ordered = sorted(samples)
+    return ordered[max(0, math.ceil(percent / 100 * len(ordered)) - 1)]
+
+
+def compare_with_baseline(results, baseline, tolerance=0.2):
+    # Metrics that got worse by more than `tolerance`: *_ms and *_queries must
+    # not grow, *_per_second must not shrink. Other keys are informational.
+    regressions = []
+    for key, value in results.items():
+        before = baseline.get(key)
+        if not isinstance(value, (int, float)) or not isinstance(before, (int, float)) or isinstance(value, bool):
+            continue
+        if key.endswith(('_ms', '_queries')) and value > before * (1 + tolerance):
+            regressions.append(f'{key}: {before} -> {value}')
+        elif key.endswith('_per_second') and value < before * (1 - tolerance):
+            regressions.append(f'{key}: {before} -> {value}')
+    return regressions
+
+
+def timed(func, repeat=5):
+    # Median wall time of func() in milliseconds
+    samples = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        samples.append((time.perf_counter() - start) * 1000)
+    return round(statistics.median(samples), 2)
+
+## Registry
+## ------------------------------------------------------->
+
+## ------------------------------------------------------->
+## Slot generation
+
+@benchmark('slot_generation')
+def bench_slot_generation(scale=500, **options):
+    # Onboarding batch: every salon open Mon-Sat 9:00-17:00 with 20 minute slots
+    salons = create_bench_salons(scale)
+    hours = FixedOperatingHours.objects.bulk_create([
+        FixedOperatingHours(salon=salon, day_of_week=day, open_time=dtime(9), close_time=dtime(17), time_slot_length=20)
+        for salon in salons for day in range(6)
+    ])
+
+    start = time.perf_counter()
+    rows = bulk_insert_time_slots(slot for hour in hours for slot in hour.build_time_slots())
+    bulk_seconds = time.perf_counter() - start
+
+    # Per-row INSERTs (previous behaviour) measured on a small sample
+    sample = hours[:max(1, len(hours) // 50)]
+    GeneratedTimeSlots.objects.filter(salon__in={hour.salon_id for hour in sample}).delete()
+    start = time.perf_counter()
+    legacy_rows = 0
+    for hour in sample:
+        for slot in hour.build_time_slots():
+            slot.save()
+            legacy_rows += 1
+    legacy_seconds = time.perf_counter() - start
+
+    return {
+        'salons': scale,
+        'rows': rows,
+        'bulk_seconds': round(bulk_seconds, 3),
+        'bulk_inserts_per_second': round(rows / bulk_seconds) if bulk_seconds else None,
+        'legacy_rows': legacy_rows,
+        'legacy_inserts_per_second': round(legacy_rows / legacy_seconds) if legacy_seconds else None,
+    }
+
+## Slot generation
+## ------------------------------------------------------->
+
+## ------------------------------------------------------->
+## Keyword search
+
+NAME_WORDS = ['Studio', 'Salon', 'Fryzjer', 'Barber', 'Beauty', 'Nails', 'Spa', 'Look', 'Style', 'Glamour', 'Hair', 'Relax']
+SERVICE_WORDS = ['strzyżenie', 'koloryzacja', 'manicure', 'pedicure', 'masaż', 'broda', 'makijaż', 'henna']
+
+def _legacy_keyword_search(keywords):
+    # search_by_keywords before search documents: five trigram expressions per joined row
+    return Salon.objects.annotate(
+        similarity_name=TrigramSimilarity('name', keywords),
+        similarity_address_city=TrigramSimilarity('address_city', keywords),
+        similarity_about=TrigramSimilarity('about', keywords),
+        similarity_categories=TrigramSimilarity(Cast('categories', TextField()), keywords),
+        similarity_salon_categories=TrigramSimilarity(Cast('salon_categories', TextField()), keywords)
+    ).filter(
+        Q(similarity_name__gte=0.1) |
+        Q(similarity_address_city__gte=0.1) |
+        Q(similarity_about__gte=0.1) |
+        Q(similarity_categories__gte=0.1) |
+        Q(similarity_salon_categories__gte=0.1)
+    ).distinct()
+
+@benchmark('keyword_search')
+def bench_keyword_search(scale=100000, **options):
+    rng = random.Random(8)
+    names = [f'{rng.choice(NAME_WORDS)} {rng.choice(NAME_WORDS)} {i}' for i in range(scale)]
+    salons = create_bench_salons(scale, names=names)
+    categories = Category.objects.bulk_create(
+        [Category(salon=salon, name=rng.choice(SERVICE_WORDS).capitalize()) for salon in salons], batch_size=5000)
+    Service.objects.bulk_create([
+        Service(salon_id=category.salon_id, category=category, title=rng.choice(SERVICE_WORDS),
+                description='', price=50, duration_minutes=30)
+        for category in categories for _ in range(2)
+    ], batch_size=5000)
+
+    start = time.perf_counter()
+    rebuild_all_search_documents()
+    build_seconds = time.perf_counter() - start
+    with connection.cursor() as cursor:
+        cursor.execute('ANALYZE')
+
+    results = {'salons': scale, 'document_build_seconds': round(build_seconds, 2)}
+    for keywords in ['barber', 'koloryzacja', 'studio nails']:
+        results[f'legacy_ms[{keywords}]'] = timed(lambda: list(_legacy_keyword_search(keywords).values_list('id', flat=True)), repeat=3)
+        results[f'document_ms[{keywords}]'] = timed(lambda: list(keyword_search(Salon.objects.all(), keywords).values_list('id', flat=True)), repeat=3)
+    return results
+
+## Keyword search
+## ------------------------------------------------------->
+
+## ------------------------------------------------------->
+## Booking concurrency
+##
+## N threads book random single slots of one salon-day at the same time.
+## Data is committed (other connections must see it) and deleted afterwards.
+
+@benchmark('booking_concurrency', rollback=False)
+def bench_booking_concurrency(scale=16, attempts_per_thread=50, **options):
+    day = timezone.now().date() + timedelta(days=1)
+    salon = create_bench_salons(1, prefix='Bench hot salon')[0]
+    try:
+        FixedOperatingHours.objects.bulk_create([FixedOperatingHours(
+            salon=salon, day_of_week=day.weekday(), open_time=dtime(8), close_time=dtime(20), time_slot_length=20)])
+        bulk_insert_time_slots(iter_time_slots(salon.pk, day, dtime(8), dtime(20), 20))
+        service = Service.objects.create(salon=salon, title='Bench', description='', price=50,
+                                         duration_minutes=20, duration_temp=timedelta(minutes=20))
+        slot_ids = list(GeneratedTimeSlots.objects.filter(salon=salon).values_list('pk', flat=True))
+
+        outcomes = {'booked': 0, 'conflicts': 0, 'errors': 0}
+        lock = threading.Lock()
+
+        def worker(seed):
+            rng = random.Random(seed)
+            try:
+                for _ in range(attempts_per_thread):
+                    serializer = AppointmentSerializer(data={
+                        'salon': salon.pk, 'customer': f'bench-{seed}', 'services': [service.pk],
+                        'timeslots': [rng.choice(slot_ids)],
+                    })
+                    try:
+                        serializer.is_valid(raise_exception=True)
+                        serializer.save()
+                        outcome = 'booked'
+                    except (SlotConflict, ValidationError):
+                        outcome = 'conflicts'
+                    except Exception:
+                        outcome = 'errors'
+                    with lock:
+                        outcomes[outcome] += 1
+            finally:
+                connection.close()
+
+        threads = [threading.Thread(target=worker, args=(seed,)) for seed in range(scale)]
+        start = time.perf_counter()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        elapsed = time.perf_counter() - start
+
+        through = Appointment.timeslots.through
+        double_booked = through.objects.filter(generatedtimeslots__salon=salon).values('generatedtimeslots').annotate(
+            bookings=Count('id')).filter(bookings__gt=1).count()
+        claimed = GeneratedTimeSlots.objects.filter(salon=salon, is_available=False).count()
+
+        return dict(outcomes, **{
+            'threads': scale,
+            'slots': len(slot_ids),
+            'claimed_slots': claimed,
+            'double_booked_slots': double_booked,
+            'bookings_per_second': round(outcomes['booked'] / elapsed, 1) if elapsed else None,
+            'attempts_per_second': round(scale * attempts_per_thread / elapsed, 1) if elapsed else None,
+        })
+    finally:
+        salon.delete()
+
+## Booking concurrency
+## ------------------------------------------------------->
+
+## ------------------------------------------------------->
+## Fast serialization
+##
+## DRF serializers + stdlib JSON against fast_render (values() rows, compiled
+## mappers, orjson when installed) on the slot and salon listings. Both must
+## produce the same bytes.
+
+@benchmark('fast_serialization')
+def bench_fast_serialization(scale=2000, **options):
+    day = timezone.now().date() + timedelta(days=1)
+    salons = create_bench_salons(scale)
+    categories = Category.objects.bulk_create(
+        [Category(salon=salon, name=name) for salon in salons for name in ('Hair', 'Nails')], batch_size=5000)
+    Service.objects.bulk_create([
+        Service(salon_id=category.salon_id, category=category, title=f'{category.name} {i}',
+                description='Opis usługi', price=50, duration_minutes=30)
+        for category in categories for i in range(2)
+    ], batch_size=5000)
+    bulk_insert_time_slots(slot for salon in salons for slot in iter_time_slots(salon.pk, day, dtime(8), dtime(20), 20))
+
+    slots = GeneratedTimeSlots.objects.filter(salon__in=salons).order_by('salon', 'date', 'time_from')
+    salon_list = Salon.objects.filter(pk__in=[salon.pk for salon in salons]).order_by('id')
+    slot_mappers = mappers_for(GeneratedTimeSlotsSerializer)
+
+    def drf_slots():
+        return JSONRenderer().render(GeneratedTimeSlotsSerializer(slots, many=True).data)
+
+    def fast_slots():
+        return render_drf_json(map_rows(slot_mappers, slots.values(*values_lookups(slot_mappers))))
+
+    def drf_salons():
+        data = ReadOnlySalonSerializer(ReadOnlySalonSerializer.setup_eager_loading(salon_list), many=True).data
+        return json.dumps(data, cls=DjangoJSONEncoder).encode('utf-8')
+
+    def fast_salons():
+        return render_django_json(salon_rows(salon_list))
+
+    slot_rows = slots.count()
+    results = {'salons': scale, 'slots': slot_rows}
+    for name, rows, regular, fast in [('slots', slot_rows, drf_slots, fast_slots), ('salons', scale, drf_salons, fast_salons)]:
+        regular_ms = timed(regular, repeat=3)
+        fast_ms = timed(fast, repeat=3)
+        results[f'{name}_identical'] = regular() == fast()
+        results[f'{name}_serializer_rows_per_second'] = round(rows / regular_ms * 1000) if regular_ms else None
+        results[f'{name}_fast_rows_per_second'] = round(rows / fast_ms * 1000) if fast_ms else None
+    return results
+
+## Fast serialization
+## ------------------------------------------------------->
+
+## ------------------------------------------------------->
+## Endpoints
+##
+## Synthetic data (see synthetic.py) served through the real URLs with the
+## test client: latency percentiles, queries per request and throughput per
+## endpoint. The search cache is disabled so every /search/ hits the database;
+## geocoding is stubbed. Compare runs with `benchmark endpoints --baseline`.
+
+@benchmark('endpoints')
+def bench_endpoints(scale=1000, requests=50, **options):
+    geocoder = {
+        'UPSTREAM': 'BookingApp.geocoding.StubUpstream',
+        'UPSTREAM_OPTIONS': {'results': {SYNTHETIC_ADDRESS: CENTER}},
+    }
+    with override_settings(ALLOWED_HOSTS=['testserver'], BOOKING_GEOCODER=geocoder, BOOKING_SEARCH_CACHE={'TIMEOUT': 0}):
+        results = dict(generate_synthetic_data(salons=scale))
+        rng = random.Random(18)
+        day = timezone.now().date() + timedelta(days=1)
+        salon_ids = list(Salon.objects.filter(name__startswith='Synthetic ').values_list('pk', flat=True))
+        free_slots = list(GeneratedTimeSlots.objects.filter(
+            salon__in=salon_ids, date__gte=day, is_available=True,
+        ).values_list('pk', 'salon_id')[:requests * 4])
+        rng.shuffle(free_slots)
+        single_slot_services = {}
+        for salon_id, service_id, duration, slot_length in Service.objects.filter(
+                salon__in={salon_id for _, salon_id in free_slots},
+                salon__fixedoperatinghours__day_of_week=day.weekday(),
+        ).values_list('salon_id', 'pk', 'duration_minutes', 'salon__fixedoperatinghours__time_slot_length'):
+            if duration == slot_length:
+                single_slot_services.setdefault(salon_id, service_id)
+        bookings = iter([(slot_id, salon_id) for slot_id, salon_id in free_slots if salon_id in single_slot_services])
+
+        def book(i):
+            slot_id, salon_id = next(bookings)
+            return client.post(reverse('appointment-list'), {
+                'salon': salon_id, 'customer': f'bench-{i}', 'services': [single_slot_services[salon_id]], 'timeslots': [slot_id],
+            }, content_type='application/json')
+
+        keywords = ['studio', 'barber nails', 'koloryzacja', 'manicure', 'masaż', 'spa relax']
+        scenarios = [
+            ('search_keywords', lambda i: client.get(reverse('salon-search'), {'keywords': keywords[i % len(keywords)]})),
+            ('search_radius', lambda i: client.get(reverse('salon-search'), {'address': SYNTHETIC_ADDRESS, 'radius': 2000 + i * 100})),
+            ('salons_list', lambda i: client.get(reverse('salons-list'), {'page_size': 100})),
+            ('salons_detail', lambda i: client.get(reverse('salons-detail', args=[rng.choice(salon_ids)]))),
+            ('timeslots_list', lambda i: client.get(reverse('generatedtimeslots-list'), {'salon': rng.choice(salon_ids), 'date': day})),
+            ('appointments_list', lambda i: client.get(reverse('appointment-list'), {'page_size': 100})),
+            ('appointments_create', book),
+        ]
+
+        client = Client()
+        for name, request in scenarios:
+            latencies, queries, errors = [], [], 0
+            start = time.perf_counter()
+            for i in range(requests):
+                try:
+                    with CaptureQueriesContext(connection) as captured:
+                        request_start = time.perf_counter()
+                        response = request(i)
+                        latencies.append((time.perf_counter() - request_start) * 1000)
+                except StopIteration:
+                    break
+                queries.append(len(captured))
+                errors += response.status_code >= 400
+            elapsed = time.perf_counter() - start
+            if not latencies:
+                continue
+            results.update({
+                f'{name}_p50_ms': round(percentile(latencies, 50), 2),
+                f'{name}_p95_ms': round(percentile(latencies, 95), 2),
+                f'{name}_p99_ms': round(percentile(latencies, 99), 2),
+                f'{name}_queries': round(statistics.mean(queries), 1),
+                f'{name}_per_second': round(len(latencies) / elapsed, 1) if elapsed else None,
+                f'{name}_errors': errors,
+            })
+        return results
+
+## Endpoints
+## ------------------------------------------------------->
+
+## ------------------------------------------------------->
+## Async search
+##
+## Concurrent radius searches against a slow geocoder (every request a new
+## address, GEOCODER_DELAY seconds upstream): SalonSearchAPIView on a pool of
+## WSGI_WORKERS threads against AsyncSalonSearchView through the ASGI handler
+## with CONCURRENCY requests in flight, each in its own thread sensitive
+## context like under an ASGI server. Data is committed (the worker threads use
+## their own connections) and deleted afterwards.
+
+WSGI_WORKERS = 8
+CONCURRENCY = 32
+GEOCODER_DELAY = 0.1
+
+@benchmark('async_search', rollback=False)
+def bench_async_search(scale=500, requests=256, **options):
+    addresses = [f'Marszałkowska {i}, 00-001 Warszawa' for i in range(requests * 2)]
+    geocoder = {
+        'UPSTREAM': 'BookingApp.geocoding.StubUpstream',
+        'UPSTREAM_OPTIONS': {'results': dict.fromkeys(addresses, CENTER), 'delay': GEOCODER_DELAY},
+    }
+    overrides = override_settings(ALLOWED_HOSTS=['testserver'], BOOKING_GEOCODER=geocoder, BOOKING_SEARCH_CACHE={'TIMEOUT': 0})
+    results = {'salons': scale, 'requests': requests, 'wsgi_workers': WSGI_WORKERS, 'asgi_concurrency': CONCURRENCY,
+               'geocoder_delay_ms': GEOCODER_DELAY * 1000}
+    synthetic = Salon.objects.filter(name__startswith=f'{SYNTHETIC_PREFIX} ')
+    existing = list(synthetic.values_list('pk', flat=True))
+    try:
+        with overrides:
+            generate_synthetic_data(salons=scale, days=1, reviews=1, appointments=0)
+            results.update(_wsgi_search(addresses[:requests]))
+            results.update(_asgi_search(addresses[requests:]))
+    finally:
+        synthetic.exclude(pk__in=existing).delete()
+        GeocodeCacheEntry.objects.filter(key__in=[normalize_address(address) for address in addresses]).delete()
+    if results.get('wsgi_per_second') and results.get('asgi_per_second'):
+        results['asgi_speedup'] = round(results['asgi_per_second'] / results['wsgi_per_second'], 2)
+    return results
+
+
+def _search_results(mode, latencies, errors, elapsed):
+    return {
+        f'{mode}_p50_ms': round(percentile(latencies, 50), 2),
+        f'{mode}_p95_ms': round(percentile(latencies, 95), 2),
+        f'{mode}_per_second': round(len(latencies) / elapsed, 1) if elapsed else None,
+        f'{mode}_errors': errors,
+    }
+
+
+def _wsgi_search(addresses):
+    url = reverse('salon-search')
+    pending = iter(addresses)
+    latencies, errors = [], []
+    lock = threading.Lock()
+
+    def worker():
+        client = Client()
+        try:
+            while True:
+                with lock:
+                    address = next(pending, None)
+                if address is None:
+                    return
+                start = time.perf_counter()
+                response = client.get(url, {'address': address, 'radius': 3000})
+                with lock:
+                    latencies.append((time.perf_counter() - start) * 1000)
+                    errors.append(response.status_code >= 400)
+        finally:
+            connection.close()
+
+    threads = [threading.Thread(target=worker) for _ in range(WSGI_WORKERS)]
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return _search_results('wsgi', latencies, sum(errors), time.perf_counter() - start)
+
+
+def _asgi_search(addresses):
+    url = reverse('salon-search-async')
+    latencies, errors = [], []
+
+    async def run():
+        client = AsyncClient()
+        in_flight = asyncio.Semaphore(CONCURRENCY)
+
+        async def search(address):
+            async with in_flight, ThreadSensitiveContext():
+                start = time.perf_counter()
+                response = await client.get(url, {'address': address, 'radius': 3000})
+                latencies.append((time.perf_counter() - start) * 1000)
+                errors.append(response.status_code >= 400)
+                # The test client does not close connections at the end of a request
+                await sync_to_async(connection.close)()
+
+        await asyncio.gather(*(search(address) for address in addresses))
+
+    start = time.perf_counter()
+    asyncio.run(run())
+    return _search_results('asgi', latencies, sum(errors), time.perf_counter() - start)
+
+## Async search
+## ------------------------------------------------------->
+
+## ------------------------------------------------------->
+## Slot partitions
+##
+## The same `scale` slots (24 a day per salon over 31 days, 10% booked) in a
+## plain table and in a daily partitioned one, both shaped like
+## GeneratedTimeSlots with its indexes and booking links: (salon, date)
+## lookups, then the nightly retention of the oldest day, batch deletes
+## against a partition drop.
+
+PARTITION_BENCH_DAYS = 31
+PARTITION_BENCH_SLOTS_PER_DAY = 24
+
+PLAIN_SLOTS_SQL = '''
+    CREATE TABLE {table} (
+        id bigserial PRIMARY KEY,
+        salon_id bigint NOT NULL REFERENCES {salons} (id) DEFERRABLE INITIALLY DEFERRED,
+        date date NOT NULL,
+        time_from time NOT NULL,
+        time_to time NOT NULL,
+        is_available boolean NOT NULL,
+        updated_at timestamp with time zone NOT NULL,
+        UNIQUE (salon_id, date, time_from, time_to)
+    )
+'''
+
+FILL_SLOTS_SQL = '''
+    INSERT INTO {table} (salon_id, date, time_from, time_to, is_available, updated_at)
+    SELECT s.id, d.day::date, t.slot::time, (t.slot + interval '20 minutes')::time, random() >= 0.1, now()
+    FROM unnest(%s::bigint[]) AS s(id)
+    CROSS JOIN generate_series(%s::timestamp, %s::timestamp, interval '1 day') AS d(day)
+    CROSS JOIN generate_series(timestamp '2000-01-01 09:00', timestamp '2000-01-01 16:40', interval '20 minutes') AS t(slot)
+'''
+
+LOOKUP_SQL = 'SELECT id, time_from, time_to, is_available FROM {table} WHERE salon_id = %s AND date = %s ORDER BY time_from'
+
+@benchmark('slot_partitions')
+def bench_slot_partitions(scale=10_000_000, requests=500, **options):
+    first_day = timezone.now().date() - timedelta(days=1)
+    last_day = first_day + timedelta(days=PARTITION_BENCH_DAYS - 1)
+    salons = create_bench_salons(max(1, scale // (PARTITION_BENCH_DAYS * PARTITION_BENCH_SLOTS_PER_DAY)))
+    salon_ids = [salon.pk for salon in salons]
+    salon_table = connection.ops.quote_name(Salon._meta.db_table)
+    tables = {'plain': 'bench_slots_plain', 'partitioned': 'bench_slots_partitioned'}
+
+    with connection.cursor() as cursor:
+        cursor.execute(PLAIN_SLOTS_SQL.format(table=tables['plain'], salons=salon_table))
+        cursor.execute('CREATE SEQUENCE bench_slots_partitioned_seq')
+        cursor.execute(CREATE_TABLE_SQL.format(table=tables['partitioned'], sequence='bench_slots_partitioned_seq', salons=salon_table))
+        cursor.execute(f'CREATE TABLE {tables["partitioned"]}_default PARTITION OF {tables["partitioned"]} DEFAULT')
+    ensure_partitions(first_day, last_day, table=tables['partitioned'])
+
+    results = {'salons': len(salon_ids)}
+    with connection.cursor() as cursor:
+        for name, table in tables.items():
+            start = time.perf_counter()
+            cursor.execute(FILL_SLOTS_SQL.format(table=table), [salon_ids, first_day, last_day])
+            results['rows'] = cursor.rowcount
+            for sql in INDEXES_SQL:
+                cursor.execute(sql.format(prefix=f'{table}_', table=table))
+            cursor.execute(f'CREATE TABLE {table}_bookings (id bigserial PRIMARY KEY, appointment_id bigint NOT NULL, slot_id bigint NOT NULL)')
+            cursor.execute(f'CREATE INDEX {table}_bookings_slot_idx ON {table}_bookings (slot_id)')
+            cursor.execute(f'INSERT INTO {table}_bookings (appointment_id, slot_id) SELECT id, id FROM {table} WHERE NOT is_available')
+            cursor.execute(f'ANALYZE {table}')
+            cursor.execute(f'ANALYZE {table}_bookings')
+            results[f'{name}_load_seconds'] = round(time.perf_counter() - start, 1)
+
+        rng = random.Random(24)
+        lookups = [(rng.choice(salon_ids), first_day + timedelta(days=rng.randrange(PARTITION_BENCH_DAYS))) for _ in range(requests)]
+        for name, table in tables.items():
+            latencies = []
+            for salon_id, day in lookups:
+                start = time.perf_counter()
+                cursor.execute(LOOKUP_SQL.format(table=table), [salon_id, day])
+                cursor.fetchall()
+                latencies.append((time.perf_counter() - start) * 1000)
+            results[f'{name}_lookup_p50_ms'] = round(percentile(latencies, 50), 3)
+            results[f'{name}_lookup_p95_ms'] = round(percentile(latencies, 95), 3)
+
+        cursor.execute('EXPLAIN (FORMAT JSON) ' + LOOKUP_SQL.format(table=tables['partitioned']), lookups[0])
+        plan = cursor.fetchone()[0]
+        results['partitioned_lookup_relations'] = json.dumps(plan).count('"Relation Name"')
+
+        # Nightly retention of the oldest day: maintenance._purge_batches' statements...
+        start = time.perf_counter()
+        removed = 0
+        while True:
+            cursor.execute(f'SELECT id FROM {tables["plain"]} WHERE date < %s LIMIT 5000', [first_day + timedelta(days=1)])
+            ids = [row[0] for row in cursor.fetchall()]
+            if not ids:
+                break
+            cursor.execute(f'DELETE FROM {tables["plain"]}_bookings WHERE slot_id = ANY(%s)', [ids])
+            cursor.execute(f'DELETE FROM {tables["plain"]} WHERE id = ANY(%s)', [ids])
+            removed += len(ids)
+        results['plain_retention_ms'] = round((time.perf_counter() - start) * 1000, 2)
+        results['retention_rows'] = removed
+
+    # ...against dropping the partition
+    start = time.perf_counter()
+    drop_partitions_before(first_day + timedelta(days=1), table=tables['partitioned'],
+                           through=(f'{tables["partitioned"]}_bookings', 'slot_id'))
+    results['partitioned_retention_ms'] = round((time.perf_counter() - start) * 1000, 2)
+
+    with connection.cursor() as cursor:
+        cursor.execute('SELECT pg_total_relation_size(%s)', [tables['plain']])
+        results['plain_size_after_retention_mb'] = round(cursor.fetchone()[0] / 2 ** 20, 1)
+        cursor.execute('SELECT sum(pg_total_relation_size(inhrelid)) FROM pg_inherits WHERE inhparent = %s::regclass', [tables['partitioned']])
+        results['partitioned_size_after_retention_mb'] = round(cursor.fetchone()[0] / 2 ** 20, 1)
+    return results
+
+## Slot partitions
+## ------------------------------------------------------->
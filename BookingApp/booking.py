@@ -0,0 +1,250 @@
+import time
+from django.db import OperationalError, connection, transaction
+from django.utils import timezone
+from rest_framework import status
+from rest_framework.exceptions import APIException
+from .models import GeneratedTimeSlots, Appointment
+from .versioning import schedule_salon_version_bump
+
+## ------------------------------------------------------->
+## Slot reservation
+##
+## Slots are claimed with one conditional UPDATE ... WHERE is_available
+## RETURNING id. Its row locks serialize concurrent claims of the same slot,
+## and a claim that does not get every requested slot raises SlotConflict so
+## the surrounding transaction rolls back and nothing is half booked.
+##
+## Every slot UPDATE first locks its rows with SELECT ... ORDER BY id FOR
+## UPDATE, so two statements over overlapping slots take their locks in the
+## same order and wait for each other instead of deadlocking.
+
+# Attempts for a booking transaction hitting a deadlock / serialization failure
+RESERVATION_ATTEMPTS = 3
+RESERVATION_RETRY_DELAY = 0.05
+
+
+class SlotConflict(APIException):
+    status_code = status.HTTP_409_CONFLICT
+    default_detail = 'One or more of the specified timeslots are not available.'
+    default_code = 'slot_conflict'
+
+    def __init__(self, unavailable_ids=()):
+        super().__init__({
+            'detail': self.default_detail,
+            'unavailable_timeslots': sorted(unavailable_ids),
+        })
+
+
+CLAIM_SQL = '''
+    WITH locked AS (
+        SELECT id FROM {slots}
+        WHERE id = ANY(%s) AND salon_id = %s AND is_available
+        ORDER BY id
+        FOR UPDATE
+    )
+    UPDATE {slots} t SET is_available = false, updated_at = now()
+    FROM locked
+    WHERE t.id = locked.id
+    RETURNING t.id
+'''
+
+def claim_time_slots(salon_id, slot_ids):
+    slot_ids = set(slot_ids)
+    with connection.cursor() as cursor:
+        cursor.execute(CLAIM_SQL.format(slots=GeneratedTimeSlots._meta.db_table), [list(slot_ids), salon_id])
+        claimed = {row[0] for row in cursor.fetchall()}
+    if claimed != slot_ids:
+        raise SlotConflict(slot_ids - claimed)
+    schedule_salon_version_bump(salon_id)
+    return claimed
+
+
+RELEASE_SQL = '''
+    WITH locked AS (
+        SELECT id FROM {slots}
+        WHERE id = ANY(%s)
+        ORDER BY id
+        FOR UPDATE
+    )
+    UPDATE {slots} t SET is_available = true, updated_at = now()
+    FROM locked
+    WHERE t.id = locked.id
+    RETURNING t.salon_id
+'''
+
+def release_time_slots(slot_ids):
+    slot_ids = list(set(slot_ids))
+    if not slot_ids:
+        return 0
+    with connection.cursor() as cursor:
+        cursor.execute(RELEASE_SQL.format(slots=GeneratedTimeSlots._meta.db_table), [slot_ids])
+        salon_ids = [row[0] for row in cursor.fetchall()]
+    schedule_salon_version_bump(*salon_ids)
+    return len(salon_ids)
+
+
+def run_reservation(func):
+    # Runs func() in its own transaction, retrying transient lock failures.
+    # Inside an outer transaction there is nothing to retry safely, so it runs once.
+    if connection.in_atomic_block:
+        with transaction.atomic():
+            return func()
+
+    for attempt in range(RESERVATION_ATTEMPTS):
+        try:
+            with transaction.atomic():
+                return func()
+        except OperationalError:
+            if attempt == RESERVATION_ATTEMPTS - 1:
+                raise
+            time.sleep(RESERVATION_RETRY_DELAY * 2 ** attempt)
+
+## Slot reservation
+## ------------------------------------------------------->
+
+## ------------------------------------------------------->
+## Bulk appointment operations
+##
+## A batch of cancel / status / reschedule operations runs in one transaction
+## with a fixed number of statements whatever its size: appointments and their
+## slots are loaded once and every operation is checked in memory, then
+## statuses change with one UPDATE per target status and slots are released
+## and claimed with set-based UPDATEs. A failed item is reported next to the
+## others and does not roll the batch back.
+##
+## Cancelled appointments keep their timeslots for history; the slots are
+## released and availability ignores the link.
+
+BULK_CLAIM_SQL = '''
+    WITH locked AS (
+        SELECT id FROM {slots}
+        WHERE id = ANY(%s) AND is_available
+        ORDER BY id
+        FOR UPDATE
+    )
+    UPDATE {slots} t SET is_available = false, updated_at = now()
+    FROM locked
+    WHERE t.id = locked.id
+    RETURNING t.id, t.salon_id
+'''
+
+def _claim_any_time_slots(slot_ids):
+    # Claims whatever it can and returns the ids it got
+    if not slot_ids:
+        return set()
+    with connection.cursor() as cursor:
+        cursor.execute(BULK_CLAIM_SQL.format(slots=GeneratedTimeSlots._meta.db_table), [list(slot_ids)])
+        rows = cursor.fetchall()
+    schedule_salon_version_bump(*{salon_id for _, salon_id in rows})
+    return {slot_id for slot_id, _ in rows}
+
+
+def _check_operation(operation, appointment, slot_ids, slots):
+    if appointment is None:
+        return 'Appointment does not exist.'
+
+    if operation['action'] == 'reschedule':
+        if appointment.status not in ('P', 'C'):
+            return f'Appointment with status {appointment.status} cannot be rescheduled.'
+        new_ids = set(operation['timeslots'])
+        if not new_ids <= slots.keys():
+            return 'One or more of the specified timeslots do not exist.'
+        timeslots = [slots[pk] for pk in new_ids]
+        if any(timeslot.salon_id != appointment.salon_id for timeslot in timeslots):
+            return 'Timeslots must belong to the salon of the appointment.'
+        if len({timeslot.date for timeslot in timeslots}) > 1:
+            return 'All timeslots must be on the same day.'
+        if len(new_ids) != len(slot_ids):
+            return f'The appointment needs {len(slot_ids)} timeslots.'
+        return None
+
+    target = 'X' if operation['action'] == 'cancel' else operation['status']
+    if target not in Appointment.STATUS_TRANSITIONS.get(appointment.status, ()):
+        return f'Cannot change status from {appointment.status} to {target}.'
+    return None
+
+
+def apply_appointment_operations(operations):
+    # operations: [{'id', 'action', 'status'?, 'timeslots'?}], results come back in the same order
+    return run_reservation(lambda: _apply_appointment_operations(operations))
+
+
+def _apply_appointment_operations(operations):
+    through = Appointment.timeslots.through
+    appointment_ids = {operation['id'] for operation in operations}
+    appointments = {
+        appointment.pk: appointment
+        for appointment in Appointment.objects.select_for_update().filter(pk__in=appointment_ids).order_by('pk')
+    }
+    current_slots = {}
+    for appointment_id, slot_id in through.objects.filter(appointment_id__in=appointment_ids).values_list(
+            'appointment_id', 'generatedtimeslots_id'):
+        current_slots.setdefault(appointment_id, set()).add(slot_id)
+    slots = GeneratedTimeSlots.objects.in_bulk({
+        slot_id for operation in operations if operation['action'] == 'reschedule' for slot_id in operation['timeslots']
+    })
+
+    errors = {}
+    seen, requested = set(), set()
+    for index, operation in enumerate(operations):
+        if operation['id'] in seen:
+            errors[index] = 'Appointment appears more than once in the batch.'
+            continue
+        seen.add(operation['id'])
+        error = _check_operation(operation, appointments.get(operation['id']), current_slots.get(operation['id'], set()), slots)
+        if error is None and operation['action'] == 'reschedule':
+            if requested & set(operation['timeslots']):
+                error = 'One or more of the specified timeslots are requested by another operation.'
+            else:
+                requested |= set(operation['timeslots'])
+        if error is not None:
+            errors[index] = error
+
+    valid = [index for index in range(len(operations)) if index not in errors]
+
+    # Status changes, one UPDATE per target status; cancellations free their slots
+    by_status = {}
+    for index in valid:
+        operation = operations[index]
+        if operation['action'] != 'reschedule':
+            target = 'X' if operation['action'] == 'cancel' else operation['status']
+            by_status.setdefault(target, []).append(operation['id'])
+    for target, ids in by_status.items():
+        Appointment.objects.filter(pk__in=ids).update(status=target, updated_at=timezone.now())
+    release_time_slots({slot_id for pk in by_status.get('X', ()) for slot_id in current_slots.get(pk, ())})
+
+    # Reschedules claim the slots they do not hold yet in one statement
+    moves = {index: operations[index] for index in valid if operations[index]['action'] == 'reschedule'}
+    wanted = {index: set(operation['timeslots']) - current_slots.get(operation['id'], set()) for index, operation in moves.items()}
+    claimed = _claim_any_time_slots(set().union(*wanted.values()))
+    failed = {index for index, slot_ids in wanted.items() if not slot_ids <= claimed}
+    for index in failed:
+        errors[index] = SlotConflict.default_detail
+    release_time_slots({slot_id for index in failed for slot_id in wanted[index]} & claimed)
+
+    moved = {operations[index]['id']: set(operations[index]['timeslots']) for index in moves if index not in failed}
+    if moved:
+        Appointment.objects.filter(pk__in=moved).update(updated_at=timezone.now())
+        through.objects.filter(appointment_id__in=moved).delete()
+        through.objects.bulk_create([
+            through(appointment_id=pk, generatedtimeslots_id=slot_id) for pk, slot_ids in moved.items() for slot_id in slot_ids
+        ])
+        release_time_slots({slot_id for pk, slot_ids in moved.items() for slot_id in current_slots.get(pk, set()) - slot_ids})
+
+    results = []
+    for index, operation in enumerate(operations):
+        result = {'id': operation['id'], 'action': operation['action'], 'success': index not in errors}
+        if index in errors:
+            result['error'] = errors[index]
+        else:
+            appointment = appointments[operation['id']]
+            if operation['action'] == 'reschedule':
+                result['status'] = appointment.status
+                result['timeslots'] = sorted(moved[operation['id']])
+            else:
+                result['status'] = 'X' if operation['action'] == 'cancel' else operation['status']
+        results.append(result)
+    return results
+
+## Bulk appointment operations
+## ------------------------------------------------------->
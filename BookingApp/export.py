@@ -0,0 +1,123 @@
+from datetime import date
+from itertools import islice
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+from rest_framework.renderers import JSONRenderer
+from .fast_render import mappers_for, map_rows, values_lookups
+from .models import Salon, GeneratedTimeSlots, Appointment
+from .serializers import GeneratedTimeSlotsExportSerializer, AppointmentExportSerializer, SalonExportSerializer
+
+## ------------------------------------------------------->
+## NDJSON export
+##
+## Full-table exports for partner syncs. Rows are read in id order one chunk
+## per query (`id > last ORDER BY id LIMIT n`), serialized one chunk at a time
+## and written as one JSON object per line, so memory stays flat whatever the
+## table size. No server-side cursor stays open between chunks, which
+## PgBouncer in transaction mode would break. Deleted rows are not exported.
+
+EXPORT_CHUNK_SIZE = 2000
+
+
+class ExportFilterError(ValueError):
+    pass
+
+
+def parse_export_filters(params):
+    # ?salon=<id>&date_from=YYYY-MM-DD&date_to=YYYY-MM-DD&updated_since=<ISO datetime>
+    filters = {}
+    try:
+        if params.get('salon'):
+            filters['salon'] = int(params['salon'])
+        if params.get('date_from'):
+            filters['date_from'] = date.fromisoformat(params['date_from'])
+        if params.get('date_to'):
+            filters['date_to'] = date.fromisoformat(params['date_to'])
+    except ValueError:
+        raise ExportFilterError('salon must be an id, date_from and date_to YYYY-MM-DD dates.')
+    if params.get('updated_since'):
+        updated_since = parse_datetime(params['updated_since'])
+        if updated_since is None:
+            raise ExportFilterError('updated_since must be an ISO 8601 datetime.')
+        if timezone.is_naive(updated_since):
+            updated_since = timezone.make_aware(updated_since)
+        filters['updated_since'] = updated_since
+    return filters
+
+
+def _chunks(iterator, size):
+    while True:
+        chunk = list(islice(iterator, size))
+        if not chunk:
+            return
+        yield chunk
+
+
+def _id_chunks(queryset, chunk_size):
+    # queryset: ordered by id; model instances or values() rows including 'id'
+    last_id = None
+    while True:
+        chunk = list((queryset if last_id is None else queryset.filter(pk__gt=last_id))[:chunk_size])
+        if not chunk:
+            return
+        yield chunk
+        if len(chunk) < chunk_size:
+            return
+        last_id = chunk[-1]['id'] if isinstance(chunk[-1], dict) else chunk[-1].pk
+
+
+def _ndjson(data):
+    renderer = JSONRenderer()
+    return b''.join(renderer.render(item) + b'\n' for item in data)
+
+
+def export_time_slots(filters, chunk_size=EXPORT_CHUNK_SIZE):
+    slots = GeneratedTimeSlots.objects.order_by('id')
+    if 'salon' in filters:
+        slots = slots.filter(salon_id=filters['salon'])
+    if 'date_from' in filters:
+        slots = slots.filter(date__gte=filters['date_from'])
+    if 'date_to' in filters:
+        slots = slots.filter(date__lte=filters['date_to'])
+    if 'updated_since' in filters:
+        slots = slots.filter(updated_at__gte=filters['updated_since'])
+
+    # The biggest table: plain values() rows and compiled field mappers
+    mappers = mappers_for(GeneratedTimeSlotsExportSerializer)
+    for chunk in _id_chunks(slots.values(*values_lookups(mappers)), chunk_size):
+        yield _ndjson(map_rows(mappers, chunk))
+
+
+def export_appointments(filters, chunk_size=EXPORT_CHUNK_SIZE):
+    appointments = Appointment.objects.order_by('id')
+    if 'salon' in filters:
+        appointments = appointments.filter(salon_id=filters['salon'])
+    if 'date_from' in filters or 'date_to' in filters:
+        # The day of an appointment is the day of its timeslots
+        slots = Appointment.timeslots.through.objects.all()
+        if 'date_from' in filters:
+            slots = slots.filter(generatedtimeslots__date__gte=filters['date_from'])
+        if 'date_to' in filters:
+            slots = slots.filter(generatedtimeslots__date__lte=filters['date_to'])
+        appointments = appointments.filter(pk__in=slots.values('appointment_id'))
+    if 'updated_since' in filters:
+        appointments = appointments.filter(updated_at__gte=filters['updated_since'])
+
+    # prefetch_related runs once per chunk
+    for chunk in _id_chunks(appointments.prefetch_related('services', 'timeslots'), chunk_size):
+        yield _ndjson(AppointmentExportSerializer(chunk, many=True).data)
+
+
+def export_salons(filters, chunk_size=EXPORT_CHUNK_SIZE):
+    # date_from / date_to do not apply to salons
+    salons = Salon.objects.order_by('id')
+    if 'salon' in filters:
+        salons = salons.filter(pk=filters['salon'])
+    if 'updated_since' in filters:
+        salons = salons.filter(modified_at__gte=filters['updated_since'])
+
+    for chunk in _id_chunks(SalonExportSerializer.setup_eager_loading(salons), chunk_size):
+        yield _ndjson(SalonExportSerializer(chunk, many=True).data)
+
+## NDJSON export
+## ------------------------------------------------------->
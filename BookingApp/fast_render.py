@@ -0,0 +1,216 @@
+import json
+from django.conf import settings
+from django.db import models
+from django.utils.encoding import is_protected_type
+from rest_framework import serializers
+from rest_framework.renderers import JSONRenderer
+from rest_framework.settings import api_settings
+from .models import Category, Service
+from .instrumentation import span
+from .serializers import ReadOnlySalonSerializer, CategorySerializer, ServiceSerializer, SalonRatingSummarySerializer
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+## ------------------------------------------------------->
+## Field mappers
+##
+## Opt-in (settings.BOOKING_FAST_SERIALIZATION) rendering of the big read-only
+## lists. Rows come straight from .values() (or plain attributes) and are
+## turned into dicts by mappers compiled once from the DRF serializer fields,
+## skipping the per-instance Field.get_attribute / to_representation machinery.
+## Each mapper returns exactly what its field's to_representation would.
+
+def fast_serialization_enabled(request=None):
+    if not getattr(settings, 'BOOKING_FAST_SERIALIZATION', False):
+        return False
+    # The browsable API and other renderers keep the regular path
+    renderer = getattr(request, 'accepted_renderer', None)
+    return renderer is None or isinstance(renderer, JSONRenderer)
+
+
+def _identity(value):
+    return value
+
+
+def _isoformat(value):
+    return value if isinstance(value, str) else value.isoformat()
+
+
+def _field_representation(field, model_field=None):
+    if isinstance(field, serializers.ChoiceField):
+        return field.to_representation
+    if isinstance(field, (serializers.PrimaryKeyRelatedField, serializers.IntegerField,
+                          serializers.CharField, serializers.BooleanField)):
+        # Already the right type when read from the database
+        return _identity
+    if isinstance(field, serializers.FloatField):
+        return float
+    if isinstance(field, (serializers.DateField, serializers.TimeField)) and not isinstance(field, serializers.DateTimeField):
+        default = api_settings.DATE_FORMAT if isinstance(field, serializers.DateField) else api_settings.TIME_FORMAT
+        if str(getattr(field, 'format', default)).lower() == 'iso-8601':
+            return _isoformat
+    if isinstance(field, serializers.ModelField):
+        # ModelField renders model_field.value_to_string(), str() of the value unless overridden
+        if type(model_field).value_to_string is models.Field.value_to_string:
+            return lambda value: value if is_protected_type(value) else str(value)
+        raise ValueError(f'{field.field_name}: no fast mapper for {type(model_field).__name__}')
+    return field.to_representation
+
+
+def compile_mappers(serializer, names=None):
+    # [(field name, attname / values() key, representation)] for flat serializer fields
+    model = serializer.Meta.model
+    mappers = []
+    for name, field in serializer.fields.items():
+        if names is not None and name not in names:
+            continue
+        model_field = model._meta.get_field(field.source)
+        mappers.append((name, model_field.attname, _field_representation(field, model_field)))
+    return mappers
+
+
+_mappers = {}
+
+def mappers_for(serializer_class):
+    # Compiled once per serializer class
+    if serializer_class not in _mappers:
+        _mappers[serializer_class] = compile_mappers(serializer_class())
+    return _mappers[serializer_class]
+
+
+def map_rows(mappers, rows):
+    # rows are .values() dicts keyed by attname or model instances
+    data = []
+    for row in rows:
+        get = row.get if isinstance(row, dict) else row.__dict__.get
+        item = {}
+        for name, attname, representation in mappers:
+            value = get(attname)
+            item[name] = None if value is None else representation(value)
+        data.append(item)
+    return data
+
+
+def values_lookups(mappers):
+    return [attname for _, attname, _ in mappers]
+
+## Field mappers
+## ------------------------------------------------------->
+
+## ------------------------------------------------------->
+## Encoding
+
+def render_drf_json(data):
+    # Same bytes as rest_framework's JSONRenderer with its default (compact,
+    # unicode, strict) settings. The payloads rendered here carry no floats,
+    # the one type orjson and json format differently (1e16 vs 1e+16).
+    if orjson is not None:
+        content = orjson.dumps(data)
+    else:
+        content = json.dumps(data, ensure_ascii=False, allow_nan=False, separators=(',', ':')).encode('utf-8')
+    return content.replace('\u2028'.encode(), b'\\u2028').replace('\u2029'.encode(), b'\\u2029')
+
+
+def render_django_json(data):
+    # Same bytes as JsonResponse / json.dumps(cls=DjangoJSONEncoder) for mapped rows
+    return json.dumps(data).encode('utf-8')
+
+## Encoding
+## ------------------------------------------------------->
+
+## ------------------------------------------------------->
+## Salon listings
+##
+## ReadOnlySalonSerializer in the same three queries as setup_eager_loading:
+## salons (with the rating summary joined), their categories, their services.
+## asalon_rows() runs them through the async ORM.
+
+RATING_LOOKUPS = ['rating_summary__review_count', 'rating_summary__rating_average', 'rating_summary__last_review_at'] + [
+    f'rating_summary__rating_{rating}' for rating in range(1, 6)]
+
+_salon_mappers = None
+
+def _get_salon_mappers():
+    global _salon_mappers
+    if _salon_mappers is None:
+        salon = ReadOnlySalonSerializer()
+        flat = [name for name, field in salon.fields.items()
+                if not isinstance(field, (serializers.BaseSerializer, serializers.SerializerMethodField))]
+        rating = SalonRatingSummarySerializer()
+        _salon_mappers = {
+            'salon_fields': list(salon.fields),
+            'salon': compile_mappers(salon, flat),
+            'category': compile_mappers(CategorySerializer(), ['id', 'salon', 'name']),
+            'service': compile_mappers(ServiceSerializer()),
+            'last_review_at': rating.fields['last_review_at'].to_representation,
+        }
+    return _salon_mappers
+
+
+def _salon_lookups(mappers, salons):
+    with_distance = 'distance' in salons.query.annotations
+    return values_lookups(mappers['salon']) + RATING_LOOKUPS + (['distance'] if with_distance else [])
+
+
+def salon_rows(salons):
+    # salons: a filtered / ordered / sliced Salon queryset without prefetches
+    mappers = _get_salon_mappers()
+    with span('search_sql'):
+        rows = list(salons.values(*_salon_lookups(mappers, salons)))
+        salon_ids = [row['id'] for row in rows]
+        category_rows = list(Category.objects.filter(salon__in=salon_ids).values(*values_lookups(mappers['category']))) if salon_ids else []
+        service_rows = list(Service.objects.filter(category__in=[row['id'] for row in category_rows]).values(
+            *values_lookups(mappers['service']))) if category_rows else []
+
+    with span('serialize'):
+        return _nest_salon_rows(mappers, rows, category_rows, service_rows)
+
+
+async def asalon_rows(salons):
+    mappers = _get_salon_mappers()
+    with span('search_sql'):
+        rows = [row async for row in salons.values(*_salon_lookups(mappers, salons))]
+        salon_ids = [row['id'] for row in rows]
+        category_rows = [row async for row in Category.objects.filter(salon__in=salon_ids).values(
+            *values_lookups(mappers['category']))] if salon_ids else []
+        service_rows = [row async for row in Service.objects.filter(category__in=[row['id'] for row in category_rows]).values(
+            *values_lookups(mappers['service']))] if category_rows else []
+
+    with span('serialize'):
+        return _nest_salon_rows(mappers, rows, category_rows, service_rows)
+
+
+def _nest_salon_rows(mappers, rows, category_rows, service_rows):
+    services = {}
+    for service in map_rows(mappers['service'], service_rows):
+        services.setdefault(service['category'], []).append(service)
+    categories = {}
+    for category in map_rows(mappers['category'], category_rows):
+        category['services'] = services.get(category['id'], [])
+        categories.setdefault(category['salon'], []).append(category)
+
+    data = []
+    for row, salon in zip(rows, map_rows(mappers['salon'], rows)):
+        distance = row.get('distance')
+        salon['distance_from_query'] = distance.m if distance is not None else None
+        salon['categories'] = categories.get(salon['id'], [])
+        if row['rating_summary__review_count'] is None:
+            salon['rating'] = None
+        else:
+            # Both are NULL again once the last review of the salon is deleted
+            rating_average = row['rating_summary__rating_average']
+            last_review_at = row['rating_summary__last_review_at']
+            salon['rating'] = {
+                'review_count': row['rating_summary__review_count'],
+                'rating_average': None if rating_average is None else float(rating_average),
+                'histogram': [row[f'rating_summary__rating_{rating}'] for rating in range(1, 6)],
+                'last_review_at': None if last_review_at is None else mappers['last_review_at'](last_review_at),
+            }
+        data.append({name: salon[name] for name in mappers['salon_fields']})
+    return data
+
+## Salon listings
+## ------------------------------------------------------->
@@ -0,0 +1,416 @@
+import asyncio
+import re
+import threading
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+from asgiref.sync import sync_to_async
+from datetime import timedelta
+from django.conf import settings
+from django.core.signals import setting_changed
+from django.db import connection, transaction
+from django.db.models import Q
+from django.dispatch import receiver
+from django.utils import timezone
+from django.utils.module_loading import import_string
+from geopy.geocoders import Nominatim
+try:
+    from geopy.adapters import AioHTTPAdapter
+    import aiohttp  # noqa: F401  (AioHTTPAdapter needs it)
+except ImportError:
+    AioHTTPAdapter = None
+from .models import GeocodeCacheEntry, Salon
+from .search_cache import invalidate_search_cache, schedule_search_cache_invalidation
+from .instrumentation import span
+from .versioning import bump_salon_versions
+
+## ------------------------------------------------------->
+## Upstreams
+##
+## An upstream has geocode(address) returning (latitude, longitude) or None
+## and raises geopy exceptions on failures. Failures are never cached.
+## Upstreams may add a native `async def ageocode(address)`; without one the
+## async path runs geocode() in a worker thread.
+
+class NominatimUpstream:
+    def __init__(self, user_agent='BookingApp', timeout=5):
+        self.user_agent = user_agent
+        self.timeout = timeout
+        self.client = Nominatim(user_agent=user_agent, timeout=timeout)
+
+    def geocode(self, address):
+        location = self.client.geocode(address)
+        if location:
+            return float(location.latitude), float(location.longitude)
+        return None
+
+    async def ageocode(self, address):
+        if AioHTTPAdapter is None:
+            # aiohttp is optional
+            return await sync_to_async(self.geocode, thread_sensitive=False)(address)
+        # The aiohttp session belongs to the running event loop, so it is opened per lookup
+        async with Nominatim(user_agent=self.user_agent, timeout=self.timeout, adapter_factory=AioHTTPAdapter) as client:
+            location = await client.geocode(address)
+        if location:
+            return float(location.latitude), float(location.longitude)
+        return None
+
+
+class StubUpstream:
+    # Local geocoder for tests: {address: (latitude, longitude)}
+    def __init__(self, results=None, delay=0):
+        self.results = {normalize_address(address): point for address, point in (results or {}).items()}
+        self.delay = delay
+        self.calls = 0
+
+    def geocode(self, address):
+        self.calls += 1
+        if self.delay:
+            time.sleep(self.delay)
+        return self.results.get(normalize_address(address))
+
+    async def ageocode(self, address):
+        self.calls += 1
+        if self.delay:
+            await asyncio.sleep(self.delay)
+        return self.results.get(normalize_address(address))
+
+## Upstreams
+## ------------------------------------------------------->
+
+## ------------------------------------------------------->
+## Cache
+##
+## Lookups go through an in-process LRU, then the GeocodeCacheEntry table,
+## then the upstream. Misses (address not found) are cached with a shorter TTL.
+## Concurrent lookups of the same address wait for one upstream call.
+##
+## ageocode() is the same lookup for async views: the cache table is read and
+## written with the async ORM and the upstream call is awaited, so a slow
+## upstream holds no thread. Async lookups are coalesced per event loop.
+##
+## Inside `with geocoder.throttled(limiter)` the calling thread waits for the
+## RateLimiter before each upstream call; cache hits are never delayed.
+
+def normalize_address(address):
+    address = re.sub(r'[^\w\s]', ' ', (address or '').lower())
+    return ' '.join(address.split())
+
+
+class RateLimiter:
+    # At most `rate` calls per second (no limit when 0) for the thread using it
+    def __init__(self, rate):
+        self.interval = 1.0 / rate if rate else 0
+        self.last_call = None
+
+    def wait(self):
+        if self.last_call is not None:
+            delay = self.last_call + self.interval - time.monotonic()
+            if delay > 0:
+                time.sleep(delay)
+        self.last_call = time.monotonic()
+
+
+class _PendingLookup:
+    def __init__(self):
+        self.event = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class Geocoder:
+    def __init__(self, upstream, lru_size=1024, ttl=timedelta(days=30), negative_ttl=timedelta(hours=1)):
+        self.upstream = upstream
+        self.lru_size = lru_size
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self._lru = OrderedDict()
+        self._pending = {}
+        self._async_pending = {}
+        self._lock = threading.Lock()
+        self._throttle = threading.local()
+        self._counters = dict.fromkeys(('memory_hits', 'db_hits', 'misses', 'coalesced', 'errors'), 0)
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._counters)
+            stats['memory_entries'] = len(self._lru)
+        lookups = stats['memory_hits'] + stats['db_hits'] + stats['misses']
+        stats['hit_ratio'] = (stats['memory_hits'] + stats['db_hits']) / lookups if lookups else None
+        return stats
+
+    @contextmanager
+    def throttled(self, limiter):
+        previous = getattr(self._throttle, 'limiter', None)
+        self._throttle.limiter = limiter
+        try:
+            yield self
+        finally:
+            self._throttle.limiter = previous
+
+    @span('geocode')
+    def geocode(self, address):
+        key = normalize_address(address)
+        if not key:
+            return None
+
+        with self._lock:
+            cached = self._lru.get(key)
+            if cached is not None and cached[1] > time.monotonic():
+                self._lru.move_to_end(key)
+                self._counters['memory_hits'] += 1
+                return cached[0]
+
+            pending = self._pending.get(key)
+            leader = pending is None
+            if leader:
+                pending = self._pending[key] = _PendingLookup()
+            else:
+                self._counters['coalesced'] += 1
+
+        if not leader:
+            pending.event.wait()
+            if pending.error is not None:
+                raise pending.error
+            return pending.result
+
+        try:
+            pending.result = self._lookup(key, address)
+            return pending.result
+        except Exception as error:
+            pending.error = error
+            self._count('errors')
+            raise
+        finally:
+            with self._lock:
+                del self._pending[key]
+            pending.event.set()
+
+    async def ageocode(self, address):
+        key = normalize_address(address)
+        if not key:
+            return None
+
+        with span('geocode'):
+            cached = self._cached(key)
+            if cached is not None:
+                return cached[0]
+
+            loop = asyncio.get_running_loop()
+            pending = self._async_pending.get(key)
+            if pending is not None and pending.get_loop() is loop:
+                self._count('coalesced')
+                return await asyncio.shield(pending)
+
+            pending = self._async_pending[key] = loop.create_future()
+            try:
+                result = await self._alookup(key, address)
+                pending.set_result(result)
+                return result
+            except Exception as error:
+                pending.set_exception(error)
+                pending.exception()  # retrieved, waiters (if any) re-raise it
+                self._count('errors')
+                raise
+            finally:
+                if self._async_pending.get(key) is pending:
+                    del self._async_pending[key]
+
+    def _cached(self, key):
+        # (result,) from the LRU, None when absent or expired
+        with self._lock:
+            cached = self._lru.get(key)
+            if cached is not None and cached[1] > time.monotonic():
+                self._lru.move_to_end(key)
+                self._counters['memory_hits'] += 1
+                return (cached[0],)
+        return None
+
+    async def _alookup(self, key, address):
+        entry = await GeocodeCacheEntry.objects.filter(key=key, expires_at__gt=timezone.now()).afirst()
+        if entry is not None:
+            self._count('db_hits')
+            result = entry.point
+            self._remember(key, result, entry.expires_at - timezone.now())
+            return result
+
+        self._count('misses')
+        ageocode = getattr(self.upstream, 'ageocode', None)
+        if ageocode is not None:
+            result = await ageocode(address)
+        else:
+            result = await sync_to_async(self.upstream.geocode, thread_sensitive=False)(address)
+        ttl = self.ttl if result is not None else self.negative_ttl
+        latitude, longitude = result if result is not None else (None, None)
+        await GeocodeCacheEntry.objects.aupdate_or_create(
+            key=key,
+            defaults={'latitude': latitude, 'longitude': longitude, 'expires_at': timezone.now() + ttl},
+        )
+        self._remember(key, result, ttl)
+        return result
+
+    def _lookup(self, key, address):
+        entry = GeocodeCacheEntry.objects.filter(key=key, expires_at__gt=timezone.now()).first()
+        if entry is not None:
+            self._count('db_hits')
+            result = entry.point
+            self._remember(key, result, entry.expires_at - timezone.now())
+            return result
+
+        self._count('misses')
+        limiter = getattr(self._throttle, 'limiter', None)
+        if limiter is not None:
+            limiter.wait()
+        result = self.upstream.geocode(address)
+        ttl = self.ttl if result is not None else self.negative_ttl
+        latitude, longitude = result if result is not None else (None, None)
+        GeocodeCacheEntry.objects.update_or_create(
+            key=key,
+            defaults={'latitude': latitude, 'longitude': longitude, 'expires_at': timezone.now() + ttl},
+        )
+        self._remember(key, result, ttl)
+        return result
+
+    def _remember(self, key, result, ttl):
+        with self._lock:
+            self._lru[key] = (result, time.monotonic() + ttl.total_seconds())
+            self._lru.move_to_end(key)
+            while len(self._lru) > self.lru_size:
+                self._lru.popitem(last=False)
+
+    def _count(self, name):
+        with self._lock:
+            self._counters[name] += 1
+
+## Cache
+## ------------------------------------------------------->
+
+## ------------------------------------------------------->
+## Configured geocoder
+##
+## settings.BOOKING_GEOCODER = {
+##     'UPSTREAM': 'BookingApp.geocoding.NominatimUpstream',
+##     'UPSTREAM_OPTIONS': {'user_agent': 'BookingApp'},
+##     'LRU_SIZE': 1024, 'TTL': timedelta(days=30), 'NEGATIVE_TTL': timedelta(hours=1),
+## }
+
+_geocoder = None
+_geocoder_lock = threading.Lock()
+
+def get_geocoder():
+    global _geocoder
+    with _geocoder_lock:
+        if _geocoder is None:
+            config = getattr(settings, 'BOOKING_GEOCODER', {})
+            upstream = import_string(config.get('UPSTREAM', 'BookingApp.geocoding.NominatimUpstream'))
+            _geocoder = Geocoder(
+                upstream(**config.get('UPSTREAM_OPTIONS', {})),
+                lru_size=config.get('LRU_SIZE', 1024),
+                ttl=config.get('TTL', timedelta(days=30)),
+                negative_ttl=config.get('NEGATIVE_TTL', timedelta(hours=1)),
+            )
+        return _geocoder
+
+
+@receiver(setting_changed)
+def reset_geocoder(setting, **kwargs):
+    global _geocoder
+    if setting == 'BOOKING_GEOCODER':
+        with _geocoder_lock:
+            _geocoder = None
+
+## Configured geocoder
+## ------------------------------------------------------->
+
+## ------------------------------------------------------->
+## Salon geocoding queue
+##
+## New salons are saved with error_code 5 (pending) and geocoded here in
+## batches: a short transaction leases a batch (SKIP LOCKED, so several workers
+## can run), upstream calls are rate limited (lookups answered by the cache
+## are not), results are written with bulk_update.
+## Timeouts / unavailable / service errors (2, 3, 4) are retried with
+## exponential backoff up to GEOCODE_MAX_ATTEMPTS.
+
+GEOCODE_PENDING = 5
+GEOCODE_RETRYABLE = (2, 3, 4)
+GEOCODE_MAX_ATTEMPTS = 8
+GEOCODE_BACKOFF = timedelta(minutes=1)
+GEOCODE_MAX_BACKOFF = timedelta(hours=12)
+# A leased batch becomes due again if its worker dies
+GEOCODE_LEASE = timedelta(minutes=15)
+
+def _lease_salons(batch_size, salon_ids):
+    now = timezone.now()
+    if salon_ids is not None:
+        due = Salon.objects.filter(pk__in=salon_ids)
+    else:
+        due = Salon.objects.filter(
+            Q(error_code=GEOCODE_PENDING) |
+            Q(error_code__in=GEOCODE_RETRYABLE, geocode_attempts__lt=GEOCODE_MAX_ATTEMPTS)
+        ).filter(Q(geocode_retry_at__isnull=True) | Q(geocode_retry_at__lte=now))
+
+    with transaction.atomic():
+        salons = list(due.order_by('geocode_retry_at', 'id').select_for_update(skip_locked=True)[:batch_size])
+        Salon.objects.filter(pk__in=[salon.pk for salon in salons]).update(geocode_retry_at=now + GEOCODE_LEASE)
+    return salons
+
+
+def geocode_pending_salons(batch_size=50, rate=1.0, salon_ids=None):
+    # Geocodes one batch of due salons (or of salon_ids, due or not), returns {error_code: count}
+    salons = _lease_salons(batch_size, salon_ids)
+    results = {}
+
+    with get_geocoder().throttled(RateLimiter(rate)):
+        for salon in salons:
+            latitude, longitude, error_code = salon.geocode_address(salon.geocoding_address)
+            salon.apply_geocoding(latitude, longitude, error_code)
+            if error_code == 0:
+                salon.geocode_attempts = 0
+                salon.geocode_retry_at = None
+            else:
+                salon.geocode_attempts += 1
+                backoff = min(GEOCODE_BACKOFF * 2 ** (salon.geocode_attempts - 1), GEOCODE_MAX_BACKOFF)
+                salon.geocode_retry_at = timezone.now() + backoff if error_code in GEOCODE_RETRYABLE else None
+            results[error_code] = results.get(error_code, 0) + 1
+
+    Salon.objects.bulk_update(salons, ['location', 'error_code', 'geocode_attempts', 'geocode_retry_at'])
+    bump_salon_versions(salon.pk for salon in salons)
+    if results.get(0):
+        # Newly placed salons show up in radius searches
+        schedule_search_cache_invalidation()
+    return results
+
+## Salon geocoding queue
+## ------------------------------------------------------->
+
+## ------------------------------------------------------->
+## Axis order
+##
+## Salon.location is (longitude, latitude): the x axis is what PostGIS reads
+## as the longitude when radius searches cast it to geography. Salons placed
+## before that were stored (latitude, longitude); `manage.py
+## swap_salon_coordinates` flips them once. Run it before the geography index
+## is built, which fails on any stored |latitude| > 90.
+
+FLIP_SALON_LOCATIONS_SQL = 'UPDATE {salons} SET location = ST_FlipCoordinates(location) WHERE NOT ST_IsEmpty(location)'
+# Latitudes stay within ±90: an x beyond that is a longitude, the table is converted already
+LONGITUDE_FIRST_SQL = 'SELECT EXISTS (SELECT 1 FROM {salons} WHERE abs(ST_X(location)) > 90)'
+
+def swap_salon_coordinates(force=False):
+    # Returns the number of salons flipped, None when the table looks converted already
+    salons = connection.ops.quote_name(Salon._meta.db_table)
+    with transaction.atomic(), connection.cursor() as cursor:
+        cursor.execute(f'LOCK TABLE {salons} IN SHARE ROW EXCLUSIVE MODE')
+        cursor.execute(LONGITUDE_FIRST_SQL.format(salons=salons))
+        if cursor.fetchone()[0] and not force:
+            return None
+        cursor.execute(FLIP_SALON_LOCATIONS_SQL.format(salons=salons))
+        flipped = cursor.rowcount
+    # Every representation with a location changed
+    bump_salon_versions()
+    invalidate_search_cache()
+    return flipped
+
+## Axis order
+## ------------------------------------------------------->
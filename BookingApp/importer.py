@@ -0,0 +1,139 @@
+import csv
+import json
+from datetime import timedelta
+from django.db import DatabaseError, transaction
+from django.utils import timezone
+from .export import _chunks
+from .models import Salon, Category, Service, FixedOperatingHours, bulk_insert_time_slots, time_slots_on_demand
+from .search_cache import schedule_search_cache_invalidation
+from .search_index import rebuild_search_documents
+from .serializers import SalonImportSerializer
+from .versioning import schedule_salon_version_bump, schedule_catalog_version_bump
+
+## ------------------------------------------------------->
+## Bulk salon import
+##
+## Partner onboarding: salon records with their categories, services and
+## weekly operating hours, read from NDJSON (one object per line) or CSV (one
+## salon per row, `categories` and `operating_hours` as JSON cells). Records
+## are validated one by one and written chunk by chunk, each chunk in one
+## transaction with bulk inserts. Salons are stored as 'Geocoding Pending' and
+## placed later by `manage.py geocode_salons`, like salons created by the API.
+##
+## The report lists every rejected record by its line number:
+##     {"imported": 998, "failed": 2, "errors": [{"line": 17, "errors": {...}}, ...]}
+
+IMPORT_CHUNK_SIZE = 500
+IMPORT_FORMATS = ('ndjson', 'csv')
+CSV_JSON_COLUMNS = ('categories', 'operating_hours')
+
+
+class ImportFormatError(ValueError):
+    pass
+
+
+def read_ndjson(lines):
+    # (line number, record, errors) for every non blank line
+    for number, line in enumerate(lines, 1):
+        if not line.strip():
+            continue
+        try:
+            record = json.loads(line)
+        except ValueError as error:
+            yield number, None, {'non_field_errors': [f'Invalid JSON: {error}']}
+            continue
+        if not isinstance(record, dict):
+            yield number, None, {'non_field_errors': ['Expected a JSON object.']}
+            continue
+        yield number, record, None
+
+
+def read_csv(lines):
+    reader = csv.DictReader(lines)
+    for record in reader:
+        errors = {}
+        for column in CSV_JSON_COLUMNS:
+            value = record.pop(column, None)
+            if not value:
+                continue
+            try:
+                record[column] = json.loads(value)
+            except ValueError as error:
+                errors[column] = [f'Invalid JSON: {error}']
+        # Blank cells are left to the field defaults
+        record = {key: value for key, value in record.items() if value not in ('', None)}
+        yield reader.line_num, (None if errors else record), (errors or None)
+
+
+READERS = {'ndjson': read_ndjson, 'csv': read_csv}
+
+
+def _insert_salons(records):
+    now = timezone.now()
+    with transaction.atomic():
+        # bulk_create skips Salon.save(): queue the salons for geocoding here
+        salons = Salon.objects.bulk_create([
+            Salon(error_code=5, geocode_retry_at=now, distance_from_query=None,
+                  **{key: value for key, value in record.items() if key not in ('categories', 'operating_hours')})
+            for record in records
+        ])
+
+        categories = Category.objects.bulk_create([
+            Category(salon=salon, name=category['name'])
+            for salon, record in zip(salons, records) for category in record.get('categories', [])
+        ])
+        category_data = [category for record in records for category in record.get('categories', [])]
+        Service.objects.bulk_create([
+            Service(salon_id=category.salon_id, category=category, duration_temp=timedelta(minutes=service['duration_minutes']),
+                    **service)
+            for category, data in zip(categories, category_data) for service in data.get('services', [])
+        ])
+
+        hours = FixedOperatingHours.objects.bulk_create([
+            FixedOperatingHours(salon=salon, **day)
+            for salon, record in zip(salons, records) for day in record.get('operating_hours', [])
+        ])
+        if not time_slots_on_demand():
+            bulk_insert_time_slots(slot for day in hours for slot in day.build_time_slots())
+
+        # bulk_create sends no signals: do here what the receivers in signals.py would, once per chunk
+        salon_ids = [salon.pk for salon in salons]
+        rebuild_search_documents(salon_ids)
+        schedule_search_cache_invalidation()
+        schedule_salon_version_bump(*salon_ids)
+        schedule_catalog_version_bump()
+    return salons
+
+
+def import_salons(lines, format='ndjson', chunk_size=IMPORT_CHUNK_SIZE):
+    # lines: an iterable of text lines (a file, a decoded request body)
+    if format not in READERS:
+        raise ImportFormatError(f'format must be one of {", ".join(IMPORT_FORMATS)}.')
+
+    report = {'imported': 0, 'failed': 0, 'errors': []}
+    for chunk in _chunks(READERS[format](lines), chunk_size):
+        valid = []
+        for number, record, errors in chunk:
+            if errors is None:
+                serializer = SalonImportSerializer(data=record)
+                if serializer.is_valid():
+                    valid.append((number, serializer.validated_data))
+                    continue
+                errors = serializer.errors
+            report['failed'] += 1
+            report['errors'].append({'line': number, 'errors': errors})
+        if not valid:
+            continue
+
+        try:
+            _insert_salons([data for _, data in valid])
+        except DatabaseError as error:
+            # The chunk was rolled back as a whole
+            report['failed'] += len(valid)
+            report['errors'].extend({'line': number, 'errors': {'non_field_errors': [str(error)]}} for number, _ in valid)
+        else:
+            report['imported'] += len(valid)
+    return report
+
+## Bulk salon import
+## ------------------------------------------------------->
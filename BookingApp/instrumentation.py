@@ -0,0 +1,225 @@
+import contextvars
+import heapq
+import json
+import logging
+import time
+from functools import wraps
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.db.backends.signals import connection_created
+from django.dispatch import receiver
+
+## ------------------------------------------------------->
+## Request profile
+##
+## Each request gets a RequestProfile holding its named span times, query
+## count, SQL time and its slowest queries. Outside a request (commands,
+## tests without the middleware) spans and the query timer do nothing, so the
+## instrumented code paths cost two perf_counter() calls at most.
+##
+## The query timer is installed on every database connection when it opens,
+## so queries run by sync_to_async threads of async views (which inherit the
+## request's context) are counted too.
+
+request_logger = logging.getLogger('BookingApp.requests')
+slow_request_logger = logging.getLogger('BookingApp.slow_requests')
+
+_profile = contextvars.ContextVar('booking_request_profile', default=None)
+_END = object()
+
+
+class RequestProfile:
+    def __init__(self, top_queries=5):
+        self.start = time.perf_counter()
+        self.spans = {}
+        self.query_count = 0
+        self.sql_seconds = 0.0
+        self.top_queries = top_queries
+        self._slowest = []
+
+    def add_span(self, name, seconds):
+        self.spans[name] = self.spans.get(name, 0.0) + seconds
+
+    def add_query(self, sql, seconds):
+        self.query_count += 1
+        self.sql_seconds += seconds
+        # Min-heap of the N slowest (seconds, sequence, sql)
+        entry = (seconds, self.query_count, sql)
+        if len(self._slowest) < self.top_queries:
+            heapq.heappush(self._slowest, entry)
+        elif seconds > self._slowest[0][0]:
+            heapq.heapreplace(self._slowest, entry)
+
+    def slowest_queries(self):
+        return [{'ms': round(seconds * 1000, 2), 'sql': sql} for seconds, _, sql in sorted(self._slowest, reverse=True)]
+
+    def record(self, request, response, total_ms):
+        return {
+            'method': request.method,
+            'path': request.path,
+            'status': response.status_code,
+            'total_ms': round(total_ms, 2),
+            'queries': self.query_count,
+            'sql_ms': round(self.sql_seconds * 1000, 2),
+            'spans': {name: round(seconds * 1000, 2) for name, seconds in self.spans.items()},
+        }
+
+    def server_timing(self, total_ms):
+        metrics = [f'db;dur={self.sql_seconds * 1000:.2f};desc="{self.query_count} queries"']
+        metrics += [f'{name};dur={seconds * 1000:.2f}' for name, seconds in self.spans.items()]
+        metrics.append(f'total;dur={total_ms:.2f}')
+        return ', '.join(metrics)
+
+
+class span:
+    # Times a block (`with span('geocode'):`) or a function (`@span('geocode')`)
+    # into the current request profile
+    def __init__(self, name):
+        self.name = name
+
+    def __enter__(self):
+        self.profile = _profile.get()
+        if self.profile is not None:
+            self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        if self.profile is not None:
+            self.profile.add_span(self.name, time.perf_counter() - self.start)
+
+    def __call__(self, func):
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            with span(self.name):
+                return func(*args, **kwargs)
+        return wrapper
+
+
+def _time_query(execute, sql, params, many, context):
+    profile = _profile.get()
+    if profile is None:
+        return execute(sql, params, many, context)
+    start = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        profile.add_query(sql, time.perf_counter() - start)
+
+
+@receiver(connection_created)
+def install_query_timer(sender, connection, **kwargs):
+    # connection_created fires again on reconnects of the same wrapper
+    if _time_query not in connection.execute_wrappers:
+        connection.execute_wrappers.append(_time_query)
+
+## Request profile
+## ------------------------------------------------------->
+
+## ------------------------------------------------------->
+## Middleware
+##
+## settings.BOOKING_INSTRUMENTATION = {
+##     'SERVER_TIMING': True,      # add the Server-Timing header
+##     'SLOW_REQUEST_MS': 500,     # log to BookingApp.slow_requests above this
+##     'TOP_QUERIES': 5,           # slowest queries kept for the slow log
+## }
+##
+## Every request is logged as one JSON record to BookingApp.requests at DEBUG,
+## off unless that logger is set to DEBUG; slow requests always reach
+## BookingApp.slow_requests (WARNING).
+##
+## Streaming bodies (the NDJSON exports) are produced after the middleware
+## returns. Each chunk is generated inside the request's profile and the record
+## is logged once the body has been sent, so it counts the export's queries;
+## the Server-Timing header goes out first and only covers the view.
+
+class RequestInstrumentationMiddleware:
+    # Sync and async capable, so async views keep running on the event loop
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        config = getattr(settings, 'BOOKING_INSTRUMENTATION', {})
+        self.server_timing = config.get('SERVER_TIMING', True)
+        self.slow_request_ms = config.get('SLOW_REQUEST_MS', 500)
+        self.top_queries = config.get('TOP_QUERIES', 5)
+        if iscoroutinefunction(self.get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        profile = RequestProfile(self.top_queries)
+        token = _profile.set(profile)
+        try:
+            response = self.get_response(request)
+        finally:
+            _profile.reset(token)
+        return self.finish(request, response, profile)
+
+    async def __acall__(self, request):
+        profile = RequestProfile(self.top_queries)
+        token = _profile.set(profile)
+        try:
+            response = await self.get_response(request)
+        finally:
+            _profile.reset(token)
+        return self.finish(request, response, profile)
+
+    def finish(self, request, response, profile):
+        if self.server_timing:
+            response['Server-Timing'] = profile.server_timing((time.perf_counter() - profile.start) * 1000)
+        if not response.streaming:
+            self.log(request, response, profile)
+        elif response.is_async:
+            response.streaming_content = self.aprofiled(request, response, profile, response.streaming_content)
+        else:
+            response.streaming_content = self.profiled(request, response, profile, response.streaming_content)
+        return response
+
+    def profiled(self, request, response, profile, content):
+        # The profile is set around each chunk only, the server's context stays clean between them
+        content = iter(content)
+        try:
+            while True:
+                token = _profile.set(profile)
+                try:
+                    chunk = next(content, _END)
+                finally:
+                    _profile.reset(token)
+                if chunk is _END:
+                    break
+                yield chunk
+        finally:
+            self.log(request, response, profile)
+
+    async def aprofiled(self, request, response, profile, content):
+        content = content.__aiter__()
+        try:
+            while True:
+                token = _profile.set(profile)
+                try:
+                    chunk = await content.__anext__()
+                except StopAsyncIteration:
+                    break
+                finally:
+                    _profile.reset(token)
+                yield chunk
+        finally:
+            self.log(request, response, profile)
+
+    def log(self, request, response, profile):
+        total_ms = (time.perf_counter() - profile.start) * 1000
+        is_slow = total_ms >= self.slow_request_ms
+        log_request = request_logger.isEnabledFor(logging.DEBUG)
+        if is_slow or log_request:
+            record = profile.record(request, response, total_ms)
+            if log_request:
+                request_logger.debug(json.dumps(record))
+            if is_slow:
+                record['top_queries'] = profile.slowest_queries()
+                slow_request_logger.warning(json.dumps(record))
+
+## Middleware
+## ------------------------------------------------------->
@@ -0,0 +1,152 @@
+from datetime import timedelta
+from django.db import connection, transaction
+from django.utils import timezone
+from .models import FixedOperatingHours, UnFixedOperatingHours, GeneratedTimeSlots, time_slots_on_demand
+from .versioning import bump_salon_versions
+from .instrumentation import span
+from .partitioning import PARTITION_AHEAD_DAYS, delete_orphaned_slot_links, drop_partitions_before, ensure_partitions, is_partitioned
+
+# Days ahead of today that always have materialized time slots
+SLOT_HORIZON_DAYS = 30
+# Past slots deleted per transaction, keeps row locks short
+PURGE_BATCH_SIZE = 5000
+
+## ------------------------------------------------------->
+## Purge
+##
+## A partitioned slot table (see partitioning.py) loses its past days by
+## dropping their partitions; only stray rows of the default partition are
+## deleted, then Appointment.timeslots links to slots that are gone (it has no
+## foreign key there). A plain table is deleted from in batches.
+
+def purge_past_time_slots(today, batch_size=PURGE_BATCH_SIZE, detach=False):
+    deleted = 0
+    partitioned = is_partitioned()
+    if partitioned:
+        removed = drop_partitions_before(today, detach=detach)
+        bump_salon_versions(removed)
+        deleted = sum(removed.values())
+    deleted += _purge_batches(GeneratedTimeSlots.objects.filter(date__lt=today), batch_size)
+    if partitioned:
+        delete_orphaned_slot_links()
+    return deleted
+
+
+def _purge_batches(slots, batch_size):
+    deleted = 0
+    while True:
+        rows = list(slots.values_list('pk', 'salon_id')[:batch_size])
+        if not rows:
+            break
+        # Each batch commits on its own (also clears Appointment.timeslots links)
+        with transaction.atomic():
+            GeneratedTimeSlots.objects.filter(pk__in=[pk for pk, _ in rows]).delete()
+            bump_salon_versions({salon_id for _, salon_id in rows})
+        deleted += len(rows)
+    return deleted
+
+## Purge
+## ------------------------------------------------------->
+
+## ------------------------------------------------------->
+## Materialize
+##
+## One INSERT ... SELECT expands operating hours of every salon into slots
+## for [start_date, end_date]. Existing slots are skipped by the unique
+## (salon, date, time_from, time_to) constraint, so reruns are harmless.
+## Only salons that got new slots have their version bumped.
+
+MATERIALIZE_SQL = '''
+    WITH inserted AS (
+        INSERT INTO {slots} (salon_id, date, time_from, time_to, is_available, updated_at)
+        SELECT h.salon_id, d.day::date, s.slot::time, (s.slot + make_interval(mins => h.time_slot_length))::time, TRUE, now()
+        FROM {fixed} h
+        CROSS JOIN generate_series(%s::timestamp, %s::timestamp, interval '1 day') AS d(day)
+        CROSS JOIN LATERAL generate_series(
+            d.day + h.open_time,
+            d.day + h.close_time - make_interval(mins => h.time_slot_length),
+            make_interval(mins => h.time_slot_length)
+        ) AS s(slot)
+        WHERE h.time_slot_length > 0 AND EXTRACT(ISODOW FROM d.day) - 1 = h.day_of_week
+        UNION ALL
+        SELECT h.salon_id, h.date, s.slot::time, (s.slot + make_interval(mins => h.time_slot_length))::time, TRUE, now()
+        FROM {unfixed} h
+        CROSS JOIN LATERAL generate_series(
+            h.date + h.open_time,
+            h.date + h.close_time - make_interval(mins => h.time_slot_length),
+            make_interval(mins => h.time_slot_length)
+        ) AS s(slot)
+        WHERE h.time_slot_length > 0 AND h.date BETWEEN %s AND %s
+        ON CONFLICT DO NOTHING
+        RETURNING salon_id
+    )
+    SELECT salon_id, count(*) FROM inserted GROUP BY salon_id
+'''
+
+@span('slot_generation')
+def materialize_time_slots(start_date, end_date):
+    if start_date > end_date:
+        return 0
+    sql = MATERIALIZE_SQL.format(
+        slots=GeneratedTimeSlots._meta.db_table,
+        fixed=FixedOperatingHours._meta.db_table,
+        unfixed=UnFixedOperatingHours._meta.db_table,
+    )
+    with connection.cursor() as cursor:
+        cursor.execute(sql, [start_date, end_date, start_date, end_date])
+        inserted = dict(cursor.fetchall())
+    bump_salon_versions(inserted)
+    return sum(inserted.values())
+
+## Materialize
+## ------------------------------------------------------->
+
+## ------------------------------------------------------->
+## Daily job
+##
+## Normally only the day that entered the horizon is materialized. A missed
+## run is caught up from the first day of the horizon where some salon has
+## weekly hours but no slots; slots of single days stored ahead of the
+## horizon (UnFixedOperatingHours.save) do not hide such a gap.
+
+FIRST_MISSING_DAY_SQL = '''
+    SELECT min(d.day)::date
+    FROM generate_series(%s::timestamp, %s::timestamp, interval '1 day') AS d(day)
+    JOIN {fixed} h ON EXTRACT(ISODOW FROM d.day) - 1 = h.day_of_week
+    WHERE h.time_slot_length > 0 AND h.close_time - h.open_time >= make_interval(mins => h.time_slot_length)
+      AND NOT EXISTS (SELECT 1 FROM {slots} s WHERE s.salon_id = h.salon_id AND s.date = d.day::date)
+'''
+
+def first_missing_day(start_date, end_date):
+    sql = FIRST_MISSING_DAY_SQL.format(slots=GeneratedTimeSlots._meta.db_table, fixed=FixedOperatingHours._meta.db_table)
+    with connection.cursor() as cursor:
+        cursor.execute(sql, [start_date, end_date])
+        return cursor.fetchone()[0]
+
+
+def run_daily_maintenance(today=None, horizon_days=SLOT_HORIZON_DAYS, full=False, batch_size=PURGE_BATCH_SIZE, detach=False):
+    today = today or timezone.now().date()
+    end_date = today + timedelta(days=horizon_days)
+
+    if full:
+        start_date = today
+    else:
+        # Without a gap only the last day, which entered the horizon today
+        start_date = first_missing_day(today, end_date) or end_date
+
+    # Partitions first, so new days are never written to the default partition
+    partitions = ensure_partitions(today, end_date + timedelta(days=PARTITION_AHEAD_DAYS)) if is_partitioned() else 0
+    deleted = purge_past_time_slots(today, batch_size=batch_size, detach=detach)
+    # In on-demand mode slots are materialized per salon-day when they are browsed
+    inserted = 0 if time_slots_on_demand() else materialize_time_slots(start_date, end_date)
+
+    return {
+        'deleted': deleted,
+        'inserted': inserted,
+        'partitions_created': partitions,
+        'start_date': start_date,
+        'end_date': end_date,
+    }
+
+## Daily job
+## ------------------------------------------------------->
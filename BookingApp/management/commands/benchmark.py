@@ -0,0 +1,40 @@
+import json
+from django.core.management.base import BaseCommand, CommandError
+from BookingApp.benchmarks import BENCHMARKS, run_benchmark, compare_with_baseline
+
+
+class Command(BaseCommand):
+    help = 'Run a registered benchmark against the configured database'
+
+    def add_arguments(self, parser):
+        parser.add_argument('name', choices=sorted(BENCHMARKS))
+        parser.add_argument('--scale', type=int, default=None, help='Benchmark specific size (salons, rows, threads...)')
+        parser.add_argument('--requests', type=int, default=None, help='Requests per endpoint (endpoints benchmark)')
+        parser.add_argument('--baseline', default=None, help='JSON results of an earlier run to compare against')
+        parser.add_argument('--tolerance', type=float, default=0.2, help='Allowed relative regression against --baseline')
+        parser.add_argument('--save-baseline', default=None, help='Write the results to this JSON file')
+
+    def handle(self, *args, **options):
+        kwargs = {}
+        for option in ('scale', 'requests'):
+            if options[option] is not None:
+                if options[option] <= 0:
+                    raise CommandError(f'--{option} must be positive')
+                kwargs[option] = options[option]
+
+        results = run_benchmark(options['name'], **kwargs)
+        for key, value in results.items():
+            self.stdout.write(f'{key}: {value}')
+
+        if options['save_baseline']:
+            with open(options['save_baseline'], 'w') as baseline_file:
+                json.dump(results, baseline_file, indent=2, sort_keys=True, default=str)
+            self.stdout.write(f'Saved baseline to {options["save_baseline"]}')
+
+        if options['baseline']:
+            with open(options['baseline']) as baseline_file:
+                baseline = json.load(baseline_file)
+            regressions = compare_with_baseline(results, baseline, options['tolerance'])
+            if regressions:
+                raise CommandError('Regressions against the baseline:\n' + '\n'.join(regressions))
+            self.stdout.write(self.style.SUCCESS('No regressions against the baseline'))
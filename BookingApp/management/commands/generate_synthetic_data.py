@@ -0,0 +1,36 @@
+import time
+from django.core.management.base import BaseCommand, CommandError
+from BookingApp.synthetic import generate_synthetic_data, delete_synthetic_data
+
+
+class Command(BaseCommand):
+    help = 'Generate reproducible synthetic salons, catalog, hours, slots, reviews and appointments'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--salons', type=int, default=1000)
+        parser.add_argument('--days', type=int, default=30, help='Days of materialized slots from today')
+        parser.add_argument('--reviews', type=int, default=5, help='Average reviews per salon')
+        parser.add_argument('--appointments', type=int, default=10, help='Booked slots per salon')
+        parser.add_argument('--seed', type=int, default=1)
+        parser.add_argument('--spread-km', type=float, default=15, help='Radius around the city centre')
+        parser.add_argument('--flush', action='store_true', help='Delete previously generated synthetic salons first')
+
+    def handle(self, *args, **options):
+        if options['salons'] <= 0 or options['days'] <= 0:
+            raise CommandError('--salons and --days must be positive')
+
+        if options['flush']:
+            self.stdout.write(f'Deleted {delete_synthetic_data()} synthetic rows')
+
+        start = time.perf_counter()
+        counts = generate_synthetic_data(
+            salons=options['salons'],
+            days=options['days'],
+            reviews=options['reviews'],
+            appointments=options['appointments'],
+            seed=options['seed'],
+            spread_km=options['spread_km'],
+        )
+        for key, value in counts.items():
+            self.stdout.write(f'{key}: {value}')
+        self.stdout.write(f'Generated in {time.perf_counter() - start:.2f}s')
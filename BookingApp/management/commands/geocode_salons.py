@@ -0,0 +1,44 @@
+import time
+from django.core.management.base import BaseCommand, CommandError
+from BookingApp.geocoding import geocode_pending_salons
+from BookingApp.models import Salon
+
+
+class Command(BaseCommand):
+    help = 'Geocode pending salons in rate limited batches, retrying failed lookups with backoff'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--all', action='store_true', help='Re-geocode every salon whose error_code != 0, once')
+        parser.add_argument('--batch-size', type=int, default=50)
+        parser.add_argument('--rate', type=float, default=1.0, help='Geocoding requests per second')
+        parser.add_argument('--loop', action='store_true', help='Keep running as a background worker')
+        parser.add_argument('--interval', type=float, default=30.0, help='Seconds to sleep when nothing is due (--loop)')
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+        if batch_size <= 0 or options['rate'] < 0:
+            raise CommandError('--batch-size must be positive and --rate not negative')
+
+        totals = {}
+        if options['all']:
+            salon_ids = list(Salon.objects.exclude(error_code=0).order_by('id').values_list('id', flat=True))
+            for start in range(0, len(salon_ids), batch_size):
+                self._add(totals, geocode_pending_salons(batch_size, options['rate'], salon_ids[start:start + batch_size]))
+        else:
+            while True:
+                results = geocode_pending_salons(batch_size, options['rate'])
+                self._add(totals, results)
+                if results:
+                    continue
+                if not options['loop']:
+                    break
+                time.sleep(options['interval'])
+
+        labels = dict(Salon.ERROR_CODES)
+        for error_code, count in sorted(totals.items()):
+            self.stdout.write(f'{labels.get(error_code, error_code)}: {count}')
+        self.stdout.write(f'Geocoded {sum(totals.values())} salons')
+
+    def _add(self, totals, results):
+        for error_code, count in results.items():
+            totals[error_code] = totals.get(error_code, 0) + count
@@ -0,0 +1,40 @@
+import json
+import sys
+import time
+from django.core.management import call_command
+from django.core.management.base import BaseCommand, CommandError
+from BookingApp.importer import IMPORT_CHUNK_SIZE, IMPORT_FORMATS, import_salons
+
+
+class Command(BaseCommand):
+    help = 'Bulk import salons with their categories, services and operating hours from NDJSON or CSV'
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help="File to import, '-' for stdin")
+        parser.add_argument('--format', choices=IMPORT_FORMATS, default=None, help='Defaults to the file extension (.csv or NDJSON)')
+        parser.add_argument('--chunk-size', type=int, default=IMPORT_CHUNK_SIZE, help='Records per transaction')
+        parser.add_argument('--geocode', action='store_true', help='Run geocode_salons for the pending salons afterwards')
+
+    def handle(self, *args, **options):
+        if options['chunk_size'] <= 0:
+            raise CommandError('--chunk-size must be positive')
+        path = options['path']
+        format = options['format'] or ('csv' if path.lower().endswith('.csv') else 'ndjson')
+
+        start = time.perf_counter()
+        try:
+            if path == '-':
+                report = import_salons(sys.stdin, format, options['chunk_size'])
+            else:
+                with open(path, encoding='utf-8-sig', newline='') as records:
+                    report = import_salons(records, format, options['chunk_size'])
+        except OSError as error:
+            raise CommandError(str(error))
+        elapsed = time.perf_counter() - start
+
+        for error in report['errors']:
+            self.stderr.write(json.dumps(error, ensure_ascii=False))
+        self.stdout.write(f'Imported {report["imported"]} salons in {elapsed:.2f}s, {report["failed"]} failed')
+
+        if options['geocode'] and report['imported']:
+            call_command('geocode_salons', stdout=self.stdout, stderr=self.stderr)
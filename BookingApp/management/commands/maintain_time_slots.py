@@ -0,0 +1,41 @@
+import time
+from datetime import date
+from django.core.management.base import BaseCommand, CommandError
+from BookingApp.maintenance import SLOT_HORIZON_DAYS, PURGE_BATCH_SIZE, run_daily_maintenance
+
+
+class Command(BaseCommand):
+    help = 'Delete past time slots and materialize new days of the booking horizon'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--date', default=None, help='Run as if today was this ISO date')
+        parser.add_argument('--horizon', type=int, default=SLOT_HORIZON_DAYS, help='Days ahead to keep materialized')
+        parser.add_argument('--batch-size', type=int, default=PURGE_BATCH_SIZE, help='Past slots deleted per transaction')
+        parser.add_argument('--full', action='store_true', help='Re-materialize the whole horizon, not only new days')
+        parser.add_argument('--detach', action='store_true', help='Keep past partitions as standalone tables instead of dropping them')
+
+    def handle(self, *args, **options):
+        today = None
+        if options['date']:
+            try:
+                today = date.fromisoformat(options['date'])
+            except ValueError:
+                raise CommandError('--date must be an ISO date (YYYY-MM-DD)')
+        if options['batch_size'] <= 0:
+            raise CommandError('--batch-size must be positive')
+
+        start = time.perf_counter()
+        result = run_daily_maintenance(
+            today=today,
+            horizon_days=options['horizon'],
+            full=options['full'],
+            batch_size=options['batch_size'],
+            detach=options['detach'],
+        )
+        elapsed = time.perf_counter() - start
+
+        self.stdout.write(
+            f"Materialized {result['start_date']}..{result['end_date']}: "
+            f"{result['inserted']} inserted, {result['deleted']} deleted, "
+            f"{result['partitions_created']} partitions created in {elapsed:.2f}s"
+        )
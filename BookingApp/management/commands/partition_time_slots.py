@@ -0,0 +1,33 @@
+from datetime import timedelta
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+from BookingApp.maintenance import SLOT_HORIZON_DAYS
+from BookingApp.partitioning import PARTITION_AHEAD_DAYS, convert_to_partitioned, ensure_partitions, is_partitioned, list_partitions
+
+
+class Command(BaseCommand):
+    help = 'Convert GeneratedTimeSlots to daily range partitions, or create the partitions ahead of the horizon'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--convert', action='store_true',
+                            help='Move the existing table to a partitioned one (locks the slot table while copying)')
+        parser.add_argument('--ahead', type=int, default=SLOT_HORIZON_DAYS + PARTITION_AHEAD_DAYS,
+                            help='Days from today that must have a partition')
+
+    def handle(self, *args, **options):
+        if options['ahead'] < 0:
+            raise CommandError('--ahead must not be negative')
+        end_date = timezone.now().date() + timedelta(days=options['ahead'])
+
+        if not is_partitioned():
+            if not options['convert']:
+                raise CommandError('The slot table is not partitioned, run with --convert to migrate it')
+            result = convert_to_partitioned(end_date)
+            self.stdout.write(f"Copied {result['rows']} slots into {result['partitions']} partitions")
+        else:
+            created = ensure_partitions(timezone.now().date(), end_date)
+            self.stdout.write(f'Created {created} partitions')
+
+        partitions = sorted(list_partitions())
+        if partitions:
+            self.stdout.write(f'Daily partitions from {partitions[0]} to {partitions[-1]}')
@@ -0,0 +1,15 @@
+from django.core.management.base import BaseCommand
+from BookingApp.models import SalonRatingSummary
+from BookingApp.search_cache import invalidate_search_cache
+from BookingApp.versioning import bump_salon_versions
+
+
+class Command(BaseCommand):
+    help = 'Recompute the review rating summary of every salon from the reviews table'
+
+    def handle(self, *args, **options):
+        rebuilt = SalonRatingSummary.rebuild()
+        # Summaries are part of the salon payload, cached copies are stale now
+        bump_salon_versions()
+        invalidate_search_cache()
+        self.stdout.write(f'Rebuilt rating summaries of {rebuilt} salons')
@@ -0,0 +1,18 @@
+import time
+from django.core.management.base import BaseCommand, CommandError
+from BookingApp.search_index import SEARCH_DOCUMENT_BATCH_SIZE, rebuild_all_search_documents
+
+
+class Command(BaseCommand):
+    help = 'Rebuild the keyword search document of every salon'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=SEARCH_DOCUMENT_BATCH_SIZE)
+
+    def handle(self, *args, **options):
+        if options['batch_size'] <= 0:
+            raise CommandError('--batch-size must be positive')
+
+        start = time.perf_counter()
+        rebuilt = rebuild_all_search_documents(options['batch_size'])
+        self.stdout.write(f'Rebuilt {rebuilt} search documents in {time.perf_counter() - start:.2f}s')
@@ -0,0 +1,16 @@
+from django.core.management.base import BaseCommand, CommandError
+from BookingApp.geocoding import swap_salon_coordinates
+
+
+class Command(BaseCommand):
+    help = 'Flip stored salon locations from (latitude, longitude) to (longitude, latitude), once'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--force', action='store_true',
+                            help='Flip even if some salon already has a longitude beyond ±90 as its x')
+
+    def handle(self, *args, **options):
+        flipped = swap_salon_coordinates(force=options['force'])
+        if flipped is None:
+            raise CommandError('Some salons already store the longitude first; run with --force to flip them anyway')
+        self.stdout.write(self.style.SUCCESS(f'Flipped the location of {flipped} salons'))
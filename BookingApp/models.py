@@ -1,10 +1,16 @@
+from django.conf import settings
 from django.utils import timezone
 from datetime import datetime, timedelta
 from django.contrib.gis.db import models
 from django.contrib.gis.geos import Point
-from geopy.geocoders import Nominatim
+from django.contrib.postgres.indexes import GinIndex, GistIndex
+from django.contrib.postgres.search import SearchVectorField
+from django.db import transaction
+from django.db.models import Count, F, FloatField, Max, OuterRef, Q, Subquery, Sum
+from django.db.models.functions import Cast, Greatest, NullIf
 from geopy.exc import GeocoderTimedOut, GeocoderUnavailable, GeocoderServiceError
 from django.core.validators import MinValueValidator, MaxValueValidator
+from .instrumentation import span
 
 
 
@@ -15,6 +21,7 @@ class Salon(models.Model):
         (2, 'Geocoding Error - Timeout'),
         (3, 'Geocoding Error - Service Unavailable'),
         (4, 'Other Geocoding Error'),
+        (5, 'Geocoding Pending'),
         (6, 'other'),
     )
     FLUTTER_CATEGORY_CHOICES = (
@@ -39,13 +46,25 @@ class Salon(models.Model):
     distance_from_query = models.FloatField(null=True, blank=True, default='')
     error_code = models.PositiveSmallIntegerField(choices=ERROR_CODES, default=0, blank=True)
     flutter_category = models.CharField(max_length=30, choices=FLUTTER_CATEGORY_CHOICES, default='hairdresser')
+    geocode_attempts = models.PositiveSmallIntegerField(default=0)
+    geocode_retry_at = models.DateTimeField(null=True, blank=True, db_index=True)
+    # Bumped on every change to the salon or what hangs off it, see versioning.py
+    version = models.PositiveIntegerField(default=1)
+    modified_at = models.DateTimeField(default=timezone.now)
+    VERSION_FIELDS = ('version', 'modified_at')
+
+    class Meta:
+        indexes = [
+            # Radius searches work on location::geography(POINT,4326), meters instead of degrees
+            GistIndex(Cast('location', models.PointField(geography=True, srid=4326)), name='salon_location_geog_idx'),
+        ]
 
     def geocode_address(self, address):
-        geolocator = Nominatim(user_agent="BookingApp")
+        from .geocoding import get_geocoder  # geocoding imports GeocodeCacheEntry from this module
         try:
-            location = geolocator.geocode(address)
+            location = get_geocoder().geocode(address)
             if location:
-                return location.latitude, location.longitude, 0  # Error Code 0 - Success
+                return location[0], location[1], 0  # Error Code 0 - Success
         except GeocoderTimedOut:
             return None, None, 2  # Error Code 2 - Geocoding Error - Timeout
         except GeocoderUnavailable:
@@ -54,17 +73,26 @@ class Salon(models.Model):
             return None, None, 4  # Error Code 4 - Other Geocoding Error
         return None, None, 1  # Error Code 1 - Geocoding Error
 
-    def save(self, *args, **kwargs):
-        if not self.pk:
-            address = f"{self.address_street} {self.address_number}, {self.address_postal_code} {self.address_city}"
-            longitude, latitude, error_code = self.geocode_address(address)
+    @property
+    def geocoding_address(self):
+        return f"{self.address_street} {self.address_number}, {self.address_postal_code} {self.address_city}"
 
-            if latitude is not None and longitude is not None:
-                self.location = Point(longitude, latitude, srid=4326)
-            else:
-                error_code = 6  # Error Code 1 - Geocoding Error
+    def apply_geocoding(self, latitude, longitude, error_code):
+        # x is the longitude, as PostGIS geography expects (see search.within_radius)
+        if error_code == 0:
+            self.location = Point(longitude, latitude, srid=4326)
+        self.error_code = error_code
 
-            self.error_code = error_code
+    def save(self, *args, **kwargs):
+        if not self.pk:
+            # Geocoded later in batches by `manage.py geocode_salons` (see geocoding.geocode_pending_salons)
+            self.error_code = 5
+            self.geocode_retry_at = timezone.now()
+        elif not self._state.adding and kwargs.get('update_fields') is None:
+            # version / modified_at are only changed by versioning.bump_salon_versions; writing back the
+            # values loaded with the instance would undo bumps committed since
+            kwargs['update_fields'] = [field.name for field in self._meta.concrete_fields
+                                       if not field.primary_key and field.name not in self.VERSION_FIELDS]
 
         super().save(*args, **kwargs)
 
@@ -81,6 +109,25 @@ class Service(models.Model):
     duration_minutes = models.PositiveIntegerField(default='')
     duration_temp = models.DurationField(default=timedelta(minutes=30))
 
+class CatalogVersion(models.Model):
+    # A single row bumped after every change to a category or service, salon-less ones
+    # included: the /categories/ ETag (see versioning.py)
+    version = models.PositiveBigIntegerField(default=0)
+    modified_at = models.DateTimeField(default=timezone.now)
+
+class SalonSearchDocument(models.Model):
+    # Denormalized keyword search text of a salon, rebuilt by search_index.py when the salon,
+    # its categories or its services change
+    salon = models.OneToOneField(Salon, on_delete=models.CASCADE, primary_key=True, related_name='search_document')
+    document = models.TextField(default='')
+    search_vector = SearchVectorField(null=True)
+
+    class Meta:
+        indexes = [
+            GinIndex(fields=['document'], opclasses=['gin_trgm_ops'], name='salon_document_trgm_idx'),
+            GinIndex(fields=['search_vector'], name='salon_document_fts_idx'),
+        ]
+
 class Review(models.Model):
     salon = models.ForeignKey(Salon, on_delete=models.CASCADE, related_name='reviews')
     user_id = models.CharField(max_length=100)
@@ -90,9 +137,140 @@ class Review(models.Model):
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
 
+    class Meta:
+        indexes = [
+            models.Index(fields=['salon', 'created_at', 'id'], name='review_keyset_idx'),
+        ]
+
+    def save(self, *args, **kwargs):
+        with transaction.atomic():
+            previous = None
+            if self.pk:
+                previous = Review.objects.select_for_update().filter(pk=self.pk).values_list('salon_id', 'rating').first()
+            super().save(*args, **kwargs)
+
+            if previous is None:
+                SalonRatingSummary.apply_review_change(self.salon_id, added=self.rating, reviewed_at=self.created_at)
+            elif previous[0] != self.salon_id:
+                SalonRatingSummary.apply_review_change(previous[0], removed=previous[1])
+                SalonRatingSummary.apply_review_change(self.salon_id, added=self.rating, reviewed_at=self.created_at)
+            elif previous[1] != self.rating:
+                SalonRatingSummary.apply_review_change(self.salon_id, removed=previous[1], added=self.rating)
+
+    def delete(self, *args, **kwargs):
+        with transaction.atomic():
+            result = super().delete(*args, **kwargs)
+            SalonRatingSummary.apply_review_change(self.salon_id, removed=self.rating)
+        return result
+
+class SalonRatingSummary(models.Model):
+    # Review aggregates of a salon, updated in the same transaction as Review.save()/delete()
+    # (QuerySet.update()/delete() on reviews bypass it, run `manage.py rebuild_rating_summaries` after those)
+    salon = models.OneToOneField(Salon, on_delete=models.CASCADE, primary_key=True, related_name='rating_summary')
+    review_count = models.PositiveIntegerField(default=0)
+    rating_sum = models.PositiveIntegerField(default=0)
+    rating_average = models.FloatField(null=True, blank=True)
+    rating_1 = models.PositiveIntegerField(default=0)
+    rating_2 = models.PositiveIntegerField(default=0)
+    rating_3 = models.PositiveIntegerField(default=0)
+    rating_4 = models.PositiveIntegerField(default=0)
+    rating_5 = models.PositiveIntegerField(default=0)
+    last_review_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['rating_average'], name='salon_rating_average_idx'),
+        ]
+
+    @property
+    def histogram(self):
+        return [self.rating_1, self.rating_2, self.rating_3, self.rating_4, self.rating_5]
+
+    @classmethod
+    def apply_review_change(cls, salon_id, removed=None, added=None, reviewed_at=None):
+        # removed / added: rating leaving / entering the aggregate
+        count_delta = (added is not None) - (removed is not None)
+        sum_delta = (added or 0) - (removed or 0)
+
+        cls.objects.bulk_create([cls(salon_id=salon_id)], ignore_conflicts=True)
+        updates = {
+            'review_count': F('review_count') + count_delta,
+            'rating_sum': F('rating_sum') + sum_delta,
+            # SET expressions see the old row, so the average is computed from the new values explicitly
+            'rating_average': Cast(F('rating_sum') + sum_delta, FloatField()) / NullIf(F('review_count') + count_delta, 0),
+        }
+        if removed is not None:
+            updates[f'rating_{removed}'] = F(f'rating_{removed}') - 1
+        if added is not None:
+            updates[f'rating_{added}'] = updates.get(f'rating_{added}', F(f'rating_{added}')) + 1
+        if reviewed_at is not None:
+            updates['last_review_at'] = Greatest(F('last_review_at'), reviewed_at)
+        elif removed is not None and added is None:
+            updates['last_review_at'] = Subquery(
+                Review.objects.filter(salon_id=OuterRef('salon_id')).order_by('-created_at').values('created_at')[:1]
+            )
+        cls.objects.filter(salon_id=salon_id).update(**updates)
+
+    @classmethod
+    def rebuild(cls):
+        # Recomputes every summary from the reviews table in one pass
+        totals = Review.objects.values('salon_id').annotate(
+            review_count=Count('id'),
+            rating_sum=Sum('rating'),
+            last_review_at=Max('created_at'),
+            **{f'rating_{rating}': Count('id', filter=Q(rating=rating)) for rating in range(1, 6)},
+        )
+        summaries = [
+            cls(rating_average=row['rating_sum'] / row['review_count'], **row)
+            for row in totals
+        ]
+        with transaction.atomic():
+            cls.objects.exclude(salon_id__in=[summary.salon_id for summary in summaries]).delete()
+            cls.objects.bulk_create(
+                summaries,
+                batch_size=1000,
+                update_conflicts=True,
+                unique_fields=['salon'],
+                update_fields=['review_count', 'rating_sum', 'rating_average', 'last_review_at'] + [f'rating_{rating}' for rating in range(1, 6)],
+            )
+        return len(summaries)
+
 def get_default_date():
     return timezone.now().date()
 
+# Rows per INSERT statement when materializing time slots
+SLOT_BATCH_SIZE = 1000
+
+def time_slots_on_demand():
+    # BOOKING_SLOT_MODE = 'on_demand': availability is computed from operating hours
+    # (see availability.py) and slot rows are only stored for days that get booked
+    return getattr(settings, 'BOOKING_SLOT_MODE', 'materialized') == 'on_demand'
+
+def iter_time_slots(salon_id, date, open_time, close_time, time_slot_length):
+    delta = timedelta(minutes=time_slot_length)
+    if delta <= timedelta():
+        return
+
+    # Combine date and time to create datetime objects
+    time_from = datetime.combine(date, open_time)
+    time_to = datetime.combine(date, close_time)
+
+    while time_from + delta <= time_to:
+        yield GeneratedTimeSlots(
+            salon_id=salon_id,
+            date=date,
+            time_from=time_from.time(),
+            time_to=(time_from + delta).time(),
+        )
+        time_from += delta
+
+@span('slot_generation')
+def bulk_insert_time_slots(slots):
+    # Slots that already exist are skipped (ON CONFLICT DO NOTHING on unique_together)
+    slots = list(slots)
+    GeneratedTimeSlots.objects.bulk_create(slots, batch_size=SLOT_BATCH_SIZE, ignore_conflicts=True)
+    return len(slots)
+
 class FixedOperatingHours(models.Model):
     salon = models.ForeignKey(Salon, on_delete=models.CASCADE)
     day_of_week = models.IntegerField()  # 0: Monday, 1: Tuesday, ..., 6: Sunday
@@ -103,37 +281,27 @@ class FixedOperatingHours(models.Model):
     class Meta:
         unique_together = ("salon", "day_of_week")
 
-    def generate_time_slots(self):
-        delta = timedelta(minutes=self.time_slot_length)
-        
-        start_date = timezone.now().date()
-        end_date = start_date + timedelta(days=30)
-        
-        current_date = start_date
-        
+    def build_time_slots(self, start_date=None, end_date=None):
+        # Unsaved slot rows for every matching weekday in [start_date, end_date]
+        start_date = start_date or timezone.now().date()
+        end_date = end_date or start_date + timedelta(days=30)
+
+        current_date = start_date + timedelta(days=(self.day_of_week - start_date.weekday()) % 7)
+        slots = []
         while current_date <= end_date:
-            if current_date.weekday() == self.day_of_week:
-                # Combine date and time to create datetime objects
-                time_from = datetime.combine(current_date, self.open_time)
-                time_to = datetime.combine(current_date, self.close_time)
-
-                while time_from + delta <= time_to:
-                    GeneratedTimeSlots.objects.create(
-                        salon=self.salon,
-                        date=current_date,
-                        time_from=time_from.time(),
-                        time_to=(time_from + delta).time(),
-                    )
-                    time_from += delta
-
-            current_date += timedelta(days=1)
+            slots.extend(iter_time_slots(self.salon_id, current_date, self.open_time, self.close_time, self.time_slot_length))
+            current_date += timedelta(days=7)
+        return slots
 
+    def generate_time_slots(self, start_date=None, end_date=None):
+        bulk_insert_time_slots(self.build_time_slots(start_date, end_date))
         return GeneratedTimeSlots.objects.filter(salon=self.salon).order_by('date', 'time_from')
 
     
     def save(self, *args, **kwargs):
         super().save(*args, **kwargs)  # Call the "real" save() method.
-        self.generate_time_slots()
+        if not time_slots_on_demand():
+            self.generate_time_slots()
 
 class UnFixedOperatingHours(models.Model):
     salon = models.ForeignKey(Salon, on_delete=models.CASCADE)
@@ -145,27 +313,17 @@ class UnFixedOperatingHours(models.Model):
     class Meta:
         unique_together = ("salon", "date")
     
-    def generate_time_slots(self):
-        delta = timedelta(minutes=self.time_slot_length)
-        
-        # Combine date and time to create datetime objects
-        time_from = datetime.combine(self.date, self.open_time)
-        time_to = datetime.combine(self.date, self.close_time)
-
-        while time_from + delta <= time_to:
-            GeneratedTimeSlots.objects.create(
-                salon=self.salon,
-                date=self.date,
-                time_from=time_from.time(),
-                time_to=(time_from + delta).time(),
-            )
-            time_from += delta
+    def build_time_slots(self):
+        return list(iter_time_slots(self.salon_id, self.date, self.open_time, self.close_time, self.time_slot_length))
 
+    def generate_time_slots(self):
+        bulk_insert_time_slots(self.build_time_slots())
         return GeneratedTimeSlots.objects.filter(salon=self.salon, date=self.date).order_by('time_from')
     
     def save(self, *args, **kwargs):
         super().save(*args, **kwargs)  # Call the "real" save() method.
-        self.generate_time_slots()
+        if not time_slots_on_demand():
+            self.generate_time_slots()
 
 class GeneratedTimeSlots(models.Model):
     salon = models.ForeignKey(Salon, on_delete=models.CASCADE)
@@ -173,11 +331,17 @@ class GeneratedTimeSlots(models.Model):
     time_from = models.TimeField()
     time_to = models.TimeField()
     is_available = models.BooleanField(default=True)
+    # Set by save()/bulk_create; raw SQL and QuerySet.update() writers set it themselves
+    updated_at = models.DateTimeField(auto_now=True, db_index=True)
 
     class Meta:
         unique_together = ("salon", "date", "time_from", "time_to")
         indexes = [
             models.Index(fields=['salon'], name='salon_idx'),
+            models.Index(fields=['salon', 'date', 'time_from', 'id'], name='slot_keyset_idx'),
+            # Covering: next free slots / free slots per day are index-only scans (availability.py)
+            models.Index(fields=['salon', 'date', 'time_from'], include=['id', 'time_to'], condition=Q(is_available=True),
+                         name='slot_free_idx'),
         ]
 
 class TempTimeSlots(models.Model):
@@ -205,8 +369,15 @@ class Appointment(models.Model):
     total_amount = models.DecimalField(max_digits=6, decimal_places=2)
     status = models.CharField(choices=STATUS_CHOICES, default='P', max_length=20)
     created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True, db_index=True)
     timeslots = models.ManyToManyField(GeneratedTimeSlots)
 
+    # Allowed status changes, X (cancelled) frees the timeslots
+    STATUS_TRANSITIONS = {
+        'P': ('C', 'X'),
+        'C': ('F', 'X'),
+    }
+
 class Booking(models.Model):
     appointment = models.ForeignKey(Appointment, related_name='bookings', on_delete=models.CASCADE)
     service = models.ForeignKey(Service, on_delete=models.CASCADE)
@@ -214,4 +385,15 @@ class Booking(models.Model):
     class Meta:
         unique_together = ("appointment", "service")
 
-
+class GeocodeCacheEntry(models.Model):
+    # Persistent tier of geocoding.Geocoder; latitude/longitude are null for addresses that were not found
+    key = models.TextField(unique=True)  # normalized address
+    latitude = models.FloatField(null=True, blank=True)
+    longitude = models.FloatField(null=True, blank=True)
+    expires_at = models.DateTimeField(db_index=True)
+
+    @property
+    def point(self):
+        if self.latitude is None or self.longitude is None:
+            return None
+        return self.latitude, self.longitude
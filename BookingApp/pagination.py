@@ -0,0 +1,172 @@
+import base64
+import json
+from itertools import islice
+from django.conf import settings
+from django.core.exceptions import ValidationError
+from django.db.models import BooleanField, Expression, F, QuerySet, Value
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import BasePagination
+from rest_framework.response import Response
+from rest_framework.utils.urls import replace_query_param
+
+## ------------------------------------------------------->
+## Keyset pagination
+##
+## Pages are read with `WHERE (a, b, id) > (%s, %s, %s) ORDER BY a, b, id
+## LIMIT n` on the view's `keyset_ordering`, so with a matching composite
+## index page 1000 costs the same as page 1. The ordering must end with a
+## unique field. Cursors are opaque base64 of the boundary row values.
+
+class RowComparison(Expression):
+    # (field, ...) <operator> (value, ...) as a boolean filter expression
+    output_field = BooleanField()
+
+    def __init__(self, fields, values, operator):
+        super().__init__()
+        self.fields = [F(name) for name in fields]
+        self.values = [Value(value) for value in values]
+        self.operator = operator
+
+    def get_source_expressions(self):
+        return self.fields + self.values
+
+    def set_source_expressions(self, exprs):
+        self.fields = exprs[:len(self.fields)]
+        self.values = exprs[len(self.fields):]
+
+    def resolve_expression(self, query=None, allow_joins=True, reuse=None, summarize=False, for_save=False):
+        clone = self.copy()
+        clone.is_summary = summarize
+        clone.set_source_expressions([
+            expr.resolve_expression(query, allow_joins, reuse, summarize, for_save)
+            for expr in self.get_source_expressions()
+        ])
+        return clone
+
+    def as_sql(self, compiler, connection):
+        lhs, rhs, params = [], [], []
+        for expr in self.fields:
+            sql, expr_params = compiler.compile(expr)
+            lhs.append(sql)
+            params.extend(expr_params)
+        for expr in self.values:
+            sql, expr_params = compiler.compile(expr)
+            rhs.append(sql)
+            params.extend(expr_params)
+        return '(%s) %s (%s)' % (', '.join(lhs), self.operator, ', '.join(rhs)), params
+
+
+class KeysetPagination(BasePagination):
+    cursor_query_param = 'cursor'
+    page_size_query_param = 'page_size'
+    invalid_cursor_message = 'Invalid cursor'
+
+    def __init__(self):
+        self.default_page_size = getattr(settings, 'BOOKING_PAGE_SIZE', 100)
+        self.max_page_size = getattr(settings, 'BOOKING_MAX_PAGE_SIZE', 1000)
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.request = request
+        self.ordering = list(getattr(view, 'keyset_ordering', ('id',)))
+        self.page_size = self.get_page_size(request)
+        values, reverse = self.decode_cursor(request)
+
+        if isinstance(queryset, QuerySet) or hasattr(queryset, 'iter_from'):
+            model = queryset.model
+        else:
+            # Already materialized model instances, e.g. computed on-demand time slots
+            model = type(queryset[0]) if queryset else None
+        if model is None:
+            self.has_next = self.has_previous = False
+            self.page = []
+            return []
+
+        fields = [model._meta.get_field(name) for name in self.ordering]
+        self.attnames = [field.attname for field in fields]
+        if values is not None:
+            try:
+                values = tuple(field.to_python(value) for field, value in zip(fields, values))
+            except ValidationError:
+                raise NotFound(self.invalid_cursor_message)
+
+        if isinstance(queryset, QuerySet):
+            queryset = queryset.order_by(*('-' + name if reverse else name for name in self.ordering))
+            if values is not None:
+                queryset = queryset.filter(RowComparison(self.ordering, values, '<' if reverse else '>'))
+            rows = list(queryset[:self.page_size + 1])
+        elif hasattr(queryset, 'iter_from'):
+            # Rows computed in keyset order (see availability.AvailableSlots), only up to the end of the page
+            rows = queryset.iter_from(values, reverse)
+            if values is not None:
+                rows = (row for row in rows if (self.row_key(row) < values if reverse else self.row_key(row) > values))
+            rows = list(islice(rows, self.page_size + 1))
+        else:
+            rows = sorted(queryset, key=self.row_key, reverse=reverse)
+            if values is not None:
+                rows = [row for row in rows if (self.row_key(row) < values if reverse else self.row_key(row) > values)]
+            rows = rows[:self.page_size + 1]
+
+        has_more = len(rows) > self.page_size
+        rows = rows[:self.page_size]
+        if reverse:
+            rows.reverse()
+            self.has_next, self.has_previous = values is not None, has_more
+        else:
+            self.has_next, self.has_previous = has_more, values is not None
+        self.page = rows
+        return rows
+
+    def get_paginated_response(self, data):
+        return Response(self.get_paginated_data(data))
+
+    def get_paginated_data(self, data):
+        return {
+            'next': self.get_next_link(),
+            'previous': self.get_previous_link(),
+            'results': data,
+        }
+
+    def get_page_size(self, request):
+        try:
+            page_size = int(request.query_params[self.page_size_query_param])
+        except (KeyError, ValueError):
+            return self.default_page_size
+        return max(1, min(page_size, self.max_page_size))
+
+    def get_next_link(self):
+        if not self.has_next or not self.page:
+            return None
+        return self.encode_cursor(self.page[-1], reverse=False)
+
+    def get_previous_link(self):
+        if not self.has_previous or not self.page:
+            return None
+        return self.encode_cursor(self.page[0], reverse=True)
+
+    def row_key(self, row):
+        # Model instances, or .values() dicts that include the ordering attnames
+        if isinstance(row, dict):
+            return tuple(row[attname] for attname in self.attnames)
+        return tuple(getattr(row, attname) for attname in self.attnames)
+
+    def encode_cursor(self, row, reverse):
+        values = [None if value is None else str(value) for value in self.row_key(row)]
+        token = base64.urlsafe_b64encode(json.dumps({'v': values, 'r': int(reverse)}).encode()).decode()
+        url = self.request.build_absolute_uri()
+        return replace_query_param(url, self.cursor_query_param, token)
+
+    def decode_cursor(self, request):
+        token = request.query_params.get(self.cursor_query_param)
+        if not token:
+            return None, False
+        try:
+            cursor = json.loads(base64.urlsafe_b64decode(token.encode()).decode())
+            values, reverse = cursor['v'], bool(cursor['r'])
+        except (ValueError, TypeError, KeyError):
+            raise NotFound(self.invalid_cursor_message)
+        if not isinstance(values, list) or len(values) != len(self.ordering):
+            raise NotFound(self.invalid_cursor_message)
+        return values, reverse
+
+## Keyset pagination
+## ------------------------------------------------------->
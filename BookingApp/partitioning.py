@@ -0,0 +1,240 @@
+import re
+from datetime import date, timedelta
+from django.db import connection, transaction
+from .models import Salon, GeneratedTimeSlots, Appointment
+
+## ------------------------------------------------------->
+## Time slot partitions
+##
+## GeneratedTimeSlots can be range partitioned by date, one partition per day
+## (<table>_pYYYYMMDD) plus a default partition for days without one (far
+## future exceptions). Lookups by (salon, date) prune to a single partition
+## and retention detaches and drops whole days instead of deleting rows.
+##
+## PostgreSQL needs the partition key in every unique constraint, so the
+## primary key becomes (id, date); ids still come from one sequence and stay
+## unique, but a lookup by id alone (claims, bulk appointment operations)
+## probes the primary key index of every partition; add the date wherever it
+## is known. For the same reason Appointment.timeslots rows cannot reference
+## the slot table with a foreign key. A deferred constraint trigger takes over
+## its insert side, Django deletes the links with the slots it deletes,
+## dropped partitions clear theirs explicitly and delete_orphaned_slot_links()
+## (run by the daily maintenance) removes what raw SQL deletes left behind.
+##
+## `manage.py partition_time_slots --convert` moves an existing table over;
+## `manage.py maintain_time_slots` then creates partitions ahead of the
+## horizon and drops the past ones (see maintenance.py).
+
+# Days past the materialized horizon that get their partition in advance
+PARTITION_AHEAD_DAYS = 7
+
+PARTITION_NAME = re.compile(r'_p(\d{8})$')
+
+PARTITIONED_SQL = 'SELECT EXISTS (SELECT 1 FROM pg_partitioned_table WHERE partrelid = %s::regclass)'
+
+PARTITIONS_SQL = '''
+    SELECT c.relname FROM pg_inherits i JOIN pg_class c ON c.oid = i.inhrelid
+    WHERE i.inhparent = %s::regclass
+'''
+
+CREATE_TABLE_SQL = '''
+    CREATE TABLE {table} (
+        id bigint NOT NULL DEFAULT nextval('{sequence}'),
+        salon_id bigint NOT NULL REFERENCES {salons} (id) DEFERRABLE INITIALLY DEFERRED,
+        date date NOT NULL,
+        time_from time NOT NULL,
+        time_to time NOT NULL,
+        is_available boolean NOT NULL,
+        updated_at timestamp with time zone NOT NULL,
+        PRIMARY KEY (id, date),
+        UNIQUE (salon_id, date, time_from, time_to)
+    ) PARTITION BY RANGE (date)
+'''
+
+# The model's indexes, created once on the parent and inherited by every partition
+INDEXES_SQL = [
+    'CREATE INDEX {prefix}salon_idx ON {table} (salon_id)',
+    'CREATE INDEX {prefix}slot_keyset_idx ON {table} (salon_id, date, time_from, id)',
+    'CREATE INDEX {prefix}slot_free_idx ON {table} (salon_id, date, time_from) INCLUDE (id, time_to) WHERE is_available',
+    'CREATE INDEX {prefix}slot_updated_at_idx ON {table} (updated_at)',
+]
+
+COLUMNS = 'id, salon_id, date, time_from, time_to, is_available, updated_at'
+
+# What the foreign key of Appointment.timeslots checked on insert, deferred like Django's
+LINK_CHECK_FUNCTION_SQL = '''
+    CREATE OR REPLACE FUNCTION {function}() RETURNS trigger AS $$
+    BEGIN
+        IF NOT EXISTS (SELECT 1 FROM {table} WHERE id = NEW.{column}) THEN
+            RAISE EXCEPTION 'time slot % does not exist', NEW.{column} USING ERRCODE = 'foreign_key_violation';
+        END IF;
+        RETURN NULL;
+    END
+    $$ LANGUAGE plpgsql
+'''
+
+LINK_CHECK_TRIGGER_SQL = '''
+    CREATE CONSTRAINT TRIGGER {trigger} AFTER INSERT OR UPDATE ON {through}
+    DEFERRABLE INITIALLY DEFERRED FOR EACH ROW EXECUTE FUNCTION {function}()
+'''
+
+ORPHANED_LINKS_SQL = 'DELETE FROM {through} l WHERE NOT EXISTS (SELECT 1 FROM {table} s WHERE s.id = l.{column})'
+
+
+def slot_table():
+    return GeneratedTimeSlots._meta.db_table
+
+
+def _through():
+    # (table, slot column) of Appointment.timeslots
+    field = Appointment._meta.get_field('timeslots')
+    return field.remote_field.through._meta.db_table, field.m2m_reverse_name()
+
+
+def _quote(name):
+    return connection.ops.quote_name(name)
+
+
+def is_partitioned(table=None):
+    with connection.cursor() as cursor:
+        cursor.execute(PARTITIONED_SQL, [_quote(table or slot_table())])
+        return cursor.fetchone()[0]
+
+
+def partition_name(table, day):
+    return f'{table}_p{day:%Y%m%d}'
+
+
+def list_partitions(table=None):
+    # {day: partition name} of the daily partitions, the default one excluded
+    table = table or slot_table()
+    with connection.cursor() as cursor:
+        cursor.execute(PARTITIONS_SQL, [_quote(table)])
+        names = [row[0] for row in cursor.fetchall()]
+    partitions = {}
+    for name in names:
+        match = PARTITION_NAME.search(name)
+        if match:
+            partitions[date(int(match[1][:4]), int(match[1][4:6]), int(match[1][6:]))] = name
+    return partitions
+
+
+def _create_partition(cursor, table, day):
+    parent, partition, default = _quote(table), _quote(partition_name(table, day)), _quote(f'{table}_default')
+    bounds = [day, day + timedelta(days=1)]
+    cursor.execute(f'SELECT EXISTS (SELECT 1 FROM {default} WHERE date >= %s AND date < %s)', bounds)
+    if not cursor.fetchone()[0]:
+        cursor.execute(f'CREATE TABLE {partition} PARTITION OF {parent} FOR VALUES FROM (%s) TO (%s)', bounds)
+        return
+    # Rows of that day already sit in the default partition: move them over
+    cursor.execute(f'ALTER TABLE {parent} DETACH PARTITION {default}')
+    cursor.execute(f'CREATE TABLE {partition} PARTITION OF {parent} FOR VALUES FROM (%s) TO (%s)', bounds)
+    cursor.execute(f'INSERT INTO {partition} ({COLUMNS}) SELECT {COLUMNS} FROM {default} WHERE date >= %s AND date < %s', bounds)
+    cursor.execute(f'DELETE FROM {default} WHERE date >= %s AND date < %s', bounds)
+    cursor.execute(f'ALTER TABLE {parent} ATTACH PARTITION {default} DEFAULT')
+
+
+def ensure_partitions(start_date, end_date, table=None):
+    # Creates the missing daily partitions of [start_date, end_date], returns how many
+    table = table or slot_table()
+    existing = list_partitions(table)
+    created = 0
+    with transaction.atomic(), connection.cursor() as cursor:
+        day = start_date
+        while day <= end_date:
+            if day not in existing:
+                _create_partition(cursor, table, day)
+                created += 1
+            day += timedelta(days=1)
+    return created
+
+
+def drop_partitions_before(before_date, table=None, through=None, detach=False):
+    # Detaches every daily partition older than before_date and drops it (or keeps it
+    # as a standalone table with detach=True). Returns {salon_id: removed slots}.
+    table = table or slot_table()
+    through_table, through_column = through or _through()
+    removed = {}
+    for day, name in sorted(list_partitions(table).items()):
+        if day >= before_date:
+            break
+        partition = _quote(name)
+        with transaction.atomic(), connection.cursor() as cursor:
+            cursor.execute(f'SELECT salon_id, count(*) FROM {partition} GROUP BY salon_id')
+            for salon_id, count in cursor.fetchall():
+                removed[salon_id] = removed.get(salon_id, 0) + count
+            # What ON DELETE CASCADE did for the booked slots of that day
+            cursor.execute(f'DELETE FROM {_quote(through_table)} WHERE {_quote(through_column)} IN (SELECT id FROM {partition})')
+            cursor.execute(f'ALTER TABLE {_quote(table)} DETACH PARTITION {partition}')
+            if not detach:
+                cursor.execute(f'DROP TABLE {partition}')
+    return removed
+
+
+def add_slot_link_check(cursor, table, through, column):
+    function, trigger = _quote(f'{through}_slot_check'), _quote(f'{through}_slot_check_trigger')
+    cursor.execute(LINK_CHECK_FUNCTION_SQL.format(function=function, table=_quote(table), column=_quote(column)))
+    cursor.execute(f'DROP TRIGGER IF EXISTS {trigger} ON {_quote(through)}')
+    cursor.execute(LINK_CHECK_TRIGGER_SQL.format(trigger=trigger, through=_quote(through), function=function))
+
+
+def delete_orphaned_slot_links(table=None, through=None):
+    # Appointment.timeslots rows whose slot is gone, returns how many were deleted
+    table = table or slot_table()
+    through_table, through_column = through or _through()
+    with connection.cursor() as cursor:
+        cursor.execute(ORPHANED_LINKS_SQL.format(through=_quote(through_table), table=_quote(table), column=_quote(through_column)))
+        return cursor.rowcount
+
+## Time slot partitions
+## ------------------------------------------------------->
+
+## ------------------------------------------------------->
+## Conversion
+##
+## One transaction that renames the current table, creates the partitioned one
+## under the original name with partitions for every stored day (and the ahead
+## window), copies the rows, points the id default at a new sequence, replaces
+## the foreign key of Appointment.timeslots with the link check trigger and
+## finally drops the old table. Writes to the slot table wait for it; run it in
+## a maintenance window.
+
+def convert_to_partitioned(end_date):
+    table = slot_table()
+    legacy = f'{table}_legacy'
+    sequence = _quote(f'{table}_id_seq_partitioned')
+    through, through_column = _through()
+
+    with transaction.atomic(), connection.cursor() as cursor:
+        cursor.execute(f'LOCK TABLE {_quote(table)} IN ACCESS EXCLUSIVE MODE')
+        cursor.execute(f'ALTER TABLE {_quote(table)} RENAME TO {_quote(legacy)}')
+        cursor.execute(f'SELECT min(date), max(date), COALESCE(max(id), 0) FROM {_quote(legacy)}')
+        first_date, last_date, last_id = cursor.fetchone()
+
+        cursor.execute(f'CREATE SEQUENCE {sequence}')
+        cursor.execute('SELECT setval(%s, %s, %s)', [sequence, max(last_id, 1), last_id > 0])
+        cursor.execute(CREATE_TABLE_SQL.format(table=_quote(table), sequence=sequence, salons=_quote(Salon._meta.db_table)))
+        cursor.execute(f'ALTER SEQUENCE {sequence} OWNED BY {_quote(table)}.id')
+        cursor.execute(f'CREATE TABLE {_quote(f"{table}_default")} PARTITION OF {_quote(table)} DEFAULT')
+        day = first_date or end_date
+        while day <= max(end_date, last_date or end_date):
+            _create_partition(cursor, table, day)
+            day += timedelta(days=1)
+
+        cursor.execute(f'INSERT INTO {_quote(table)} ({COLUMNS}) SELECT {COLUMNS} FROM {_quote(legacy)}')
+        rows = cursor.rowcount
+        cursor.execute(
+            'SELECT conname FROM pg_constraint WHERE contype = %s AND conrelid = %s::regclass AND confrelid = %s::regclass',
+            ['f', _quote(through), _quote(legacy)])
+        for (constraint,) in cursor.fetchall():
+            cursor.execute(f'ALTER TABLE {_quote(through)} DROP CONSTRAINT {_quote(constraint)}')
+        add_slot_link_check(cursor, table, through, through_column)
+        cursor.execute(f'DROP TABLE {_quote(legacy)}')
+
+        for sql in INDEXES_SQL:
+            cursor.execute(sql.format(prefix='', table=_quote(table)))
+        cursor.execute(f'ANALYZE {_quote(table)}')
+    return {'rows': rows, 'partitions': len(list_partitions(table))}
+
+## Conversion
+## ------------------------------------------------------->
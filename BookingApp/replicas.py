@@ -0,0 +1,142 @@
+import contextvars
+import logging
+import random
+import time
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS, DatabaseError, connections, router
+
+## ------------------------------------------------------->
+## Read replica routing
+##
+## settings.BOOKING_REPLICAS = {
+##     'ALIASES': ['replica_0'],   # DATABASES aliases of the read replicas
+##     'STICKY_SECONDS': 10,       # reads stay on the primary this long after a write
+##     'RETRY_SECONDS': 30,        # an unreachable replica is skipped this long
+## }
+##
+## Only reads of GET / HEAD / OPTIONS requests go to a replica, chosen at
+## random among the reachable ones; everything else (writes, other methods,
+## management commands, reads without a request) uses the primary. A request
+## that writes is pinned to the primary from its first write on, and its
+## response (or the response of any successful POST / PUT / PATCH / DELETE,
+## raw SQL writes bypass the router) sets a cookie that keeps the client's
+## reads on the primary for STICKY_SECONDS, so a client sees its own bookings and salon edits despite
+## replication lag. Writes to UNPINNED_MODELS (caches filled while serving
+## reads, e.g. geocoding during /search/) pin nothing. Raw SQL reads pick their
+## connection with read_connection().
+
+logger = logging.getLogger(__name__)
+
+STICKY_COOKIE = 'booking_primary_until'
+SAFE_METHODS = ('GET', 'HEAD', 'OPTIONS')
+# Written by GETs, never read back by the client that caused the write
+UNPINNED_MODELS = {'BookingApp.GeocodeCacheEntry'}
+
+_routing = contextvars.ContextVar('booking_replica_routing', default=None)
+
+
+def _config():
+    config = getattr(settings, 'BOOKING_REPLICAS', {})
+    return config.get('ALIASES', []), config.get('STICKY_SECONDS', 10), config.get('RETRY_SECONDS', 30)
+
+
+class RequestRouting:
+    def __init__(self, use_replica):
+        self.use_replica = use_replica
+        self.wrote = False
+
+
+class ReplicaRouter:
+    def __init__(self):
+        self._down_until = {}
+
+    def db_for_read(self, model, **hints):
+        routing = _routing.get()
+        if routing is None or not routing.use_replica or routing.wrote:
+            return DEFAULT_DB_ALIAS
+        aliases, _, retry_seconds = _config()
+        now = time.monotonic()
+        candidates = [alias for alias in aliases if self._down_until.get(alias, 0) <= now]
+        random.shuffle(candidates)
+        for alias in candidates:
+            if self._reachable(alias, retry_seconds):
+                return alias
+        return DEFAULT_DB_ALIAS
+
+    def db_for_write(self, model, **hints):
+        routing = _routing.get()
+        if routing is not None and model._meta.label not in UNPINNED_MODELS:
+            routing.wrote = True
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # Replicas hold the same rows as the primary
+        return True
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        # Replicas get their schema through replication
+        return db not in _config()[0]
+
+    def _reachable(self, alias, retry_seconds):
+        # A no-op for an open connection (CONN_HEALTH_CHECKS revalidates it once per request)
+        try:
+            connections[alias].ensure_connection()
+            return True
+        except DatabaseError as error:
+            self._down_until[alias] = time.monotonic() + retry_seconds
+            logger.warning('Replica %s unreachable, reading from the primary for %ss: %s', alias, retry_seconds, error)
+            return False
+
+
+def read_connection(model):
+    # Connection for raw SQL reads of `model`, the one the ORM would use
+    return connections[router.db_for_read(model)]
+
+
+class ReplicaRoutingMiddleware:
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(self.get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        routing, token = self.start(request)
+        try:
+            response = self.get_response(request)
+        finally:
+            _routing.reset(token)
+        return self.finish(request, routing, response)
+
+    async def __acall__(self, request):
+        routing, token = self.start(request)
+        try:
+            response = await self.get_response(request)
+        finally:
+            _routing.reset(token)
+        return self.finish(request, routing, response)
+
+    def start(self, request):
+        aliases, _, _ = _config()
+        try:
+            sticky = float(request.COOKIES.get(STICKY_COOKIE, 0)) > time.time()
+        except ValueError:
+            sticky = False
+        routing = RequestRouting(bool(aliases) and request.method in SAFE_METHODS and not sticky)
+        return routing, _routing.set(routing)
+
+    def finish(self, request, routing, response):
+        aliases, sticky_seconds, _ = _config()
+        wrote = routing.wrote or (request.method not in SAFE_METHODS and response.status_code < 400)
+        if aliases and wrote and sticky_seconds:
+            response.set_cookie(STICKY_COOKIE, str(time.time() + sticky_seconds), max_age=sticky_seconds,
+                                httponly=True, samesite='Lax')
+        return response
+
+## Read replica routing
+## ------------------------------------------------------->
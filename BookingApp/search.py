@@ -1,77 +1,52 @@
-from django.contrib.postgres.search import TrigramSimilarity
-from django.db import connection
-from django.db.models.query import Prefetch
-from geopy.geocoders import Nominatim
+import math
+from django.contrib.postgres.search import SearchQuery, SearchRank, TrigramWordSimilarity
+from django.contrib.gis.db.models import PointField
+from django.contrib.gis.db.models.functions import Distance, GeoFunc
 from django.contrib.gis.geos import Point
-from django.db.models import TextField, Q
-from django.db.models.functions import Cast
-from .models import Salon, Category, Service
+from django.contrib.gis.measure import D
+from django.db.models import F, FloatField, Q
+from django.db.models.functions import Cast, Greatest
+from .models import Salon, GeneratedTimeSlots, SalonSearchDocument, time_slots_on_demand
+from .availability import get_availability
+from .geocoding import get_geocoder
+from .instrumentation import span
+from .replicas import read_connection
 
 ## -------------------------------------------------------> 
 ## By Keywords, address and radius
 
 def search_salons(keywords, address, radius):
-    print("search salon [1]")
-    defaultRadius = 15
+    if address:
+        return search_near_point(keywords, get_point_from_address(address), radius)
+    return keyword_search(Salon.objects.all(), keywords)
 
-    if keywords == '':
-        salons = Salon.objects.all()
+
+def search_near_point(keywords, point, radius):
+    # search_salons once the address is geocoded (point is None when it was not found)
+    if point is None:
+        return Salon.objects.none()
+    return within_radius(keyword_search(Salon.objects.all(), keywords), point, radius)
+
+
+def salon_search_queryset(keywords, address, radius, point=None, min_rating=0, ordering=None):
+    # The /search/ queryset, shared by the sync and async views. The caller geocodes
+    # `address` into `point` (only used with both address and radius).
+    if keywords and not address and not radius:
+        salons = search_by_keywords(keywords)
+    elif address and radius:
+        salons = search_near_point(keywords, point, radius)
     else:
-        salons = Salon.objects.annotate(
-            similarity_name=TrigramSimilarity('name', keywords),
-            similarity_address_city=TrigramSimilarity('address_city', keywords),
-            similarity_about=TrigramSimilarity('about', keywords),
-            similarity_categories=TrigramSimilarity(Cast('categories', TextField()), keywords),
-            similarity_salon_categories=TrigramSimilarity(Cast('salon_categories', TextField()), keywords)
-        ).filter(
-            Q(similarity_name__gte=0.1) |
-            Q(similarity_address_city__gte=0.1) |
-            Q(similarity_about__gte=0.1) |
-            Q(similarity_categories__gte=0.1) |
-            Q(similarity_salon_categories__gte=0.1)
-        ).distinct()  # Dodajemy metodę distinct()
-
-    print(salons)
+        # Without a complete set of parameters every salon is returned
+        salons = Salon.objects.all()
 
-    if address:
-        print("search salon [2]")
-        point = get_point_from_address(address)
-        # Tworzenie zapytania SQL z użyciem kursora
-        cursor = connection.cursor()
-        cursor.execute(
-                '''
-                SELECT id, location, ST_Distance(
-                    location,
-                    ST_SetSRID(ST_MakePoint(%s, %s)::geography, 4326)
-                ) AS distance
-                FROM [yours_postgresql_db]
-                WHERE ST_DWithin(
-                    location,
-                    ST_SetSRID(ST_MakePoint(%s, %s)::geography, 4326),
-                    %s
-                )
-                ''',
-                [point.x, point.y, point.x, point.y, radius]
-        )
-        salon_ids = []
-        salon_distances = {}
-        for row in cursor.fetchall():
-            salon_id = row[0]
-            salon_ids.append(salon_id)
-            distance_m = row[2]
-            salon_distances[salon_id] = distance_m  # Convert back to meters
-
-        salons = salons.filter(id__in=salon_ids).distinct()  # Dodajemy metodę distinct() po raz drugi
-        print("search salon [3]")
-        # Aktualizacja pola distance_from_query dla każdego salonu
-        for salon in salons:
-            salon.distance_from_query = salon_distances[salon.id]
-            salon.save()  # Zapis wartości do modelu
-    print("search salon [4]")
-    return salons.order_by('-similarity_name')
-
-
-# Reszta funkcji pozostaje bez zmian
+    # Rating filter/sort read SalonRatingSummary, never the reviews table
+    if min_rating:
+        salons = salons.filter(rating_summary__rating_average__gte=min_rating)
+    if ordering == 'rating':
+        salons = salons.order_by(F('rating_summary__rating_average').desc(nulls_last=True), 'id')
+    if address and radius:
+        salons = salons[:SEARCH_RESULT_LIMIT]
+    return salons
 
 
 ## By Keywords, address and radius
@@ -80,36 +55,37 @@ def search_salons(keywords, address, radius):
 
 ## By Keywords
 def search_by_keywords(keywords):
+    # Categories and services are prefetched by the caller (ReadOnlySalonSerializer.setup_eager_loading)
+    return keyword_search(Salon.objects.all(), keywords)
+
+
+## By Keywords
+## -------------------------------------------------------> 
+
+## -------------------------------------------------------> 
+## Keyword match
+##
+## Matches the precomputed SalonSearchDocument (name, city, about, category
+## names, service titles) through its trigram and full-text GIN indexes and
+## ranks by the better of word similarity and full-text rank.
 
+def keyword_search(salons, keywords):
     if keywords == '':
-        salons_results = Salon.objects.all()
-    else:
-        salons = Salon.objects.annotate(
-            similarity_name=TrigramSimilarity('name', keywords),
-            similarity_address_city=TrigramSimilarity('address_city', keywords),
-            similarity_about=TrigramSimilarity('about', keywords),
-            similarity_categories=TrigramSimilarity(Cast('categories', TextField()), keywords),
-            similarity_salon_categories=TrigramSimilarity(Cast('salon_categories', TextField()), keywords)
-        ).filter(
-            Q(similarity_name__gte=0.1) |
-            Q(similarity_address_city__gte=0.1) |
-            Q(similarity_about__gte=0.1) |
-            Q(similarity_categories__gte=0.1) |
-            Q(similarity_salon_categories__gte=0.1)
-        ).distinct() 
-
-    salon_results = salons.filter(id__in=salons).distinct()
-    
-    # Pobieranie powiązanych kategorii i usług dla wyników z modelu Salon
-    salon_results = salon_results.prefetch_related(
-        Prefetch('categories', queryset=Category.objects.all()),
-        Prefetch('salon_categories', queryset=Service.objects.all())
-    )
+        return salons
 
-    return salon_results
+    query = SearchQuery(keywords, config='simple', search_type='websearch')
+    return salons.filter(
+        Q(search_document__document__trigram_word_similar=keywords) |
+        Q(search_document__search_vector=query)
+    ).annotate(
+        rank=Greatest(
+            TrigramWordSimilarity(keywords, 'search_document__document'),
+            SearchRank(F('search_document__search_vector'), query),
+        ),
+    ).order_by('-rank')
 
 
-## By Keywords
+## Keyword match
 ## -------------------------------------------------------> 
 
 ## -------------------------------------------------------> 
@@ -117,54 +93,147 @@ def search_by_keywords(keywords):
 ## By Address
 
 def search_by_address_radius(address, radius):
-    if address:
-        point = get_point_from_address(address)
-        # Tworzenie zapytania SQL z użyciem kursora
-        cursor = connection.cursor()
-        cursor.execute(
-                '''
-                SELECT id, location, ST_Distance(
-                    location,
-                    ST_SetSRID(ST_MakePoint(%s, %s)::geography, 4326)
-                ) AS distance
-                FROM [yours_postgresql_db]
-                WHERE ST_DWithin(
-                    location,
-                    ST_SetSRID(ST_MakePoint(%s, %s)::geography, 4326),
-                    %s
-                )
-                ''',
-                [point.x, point.y, point.x, point.y, radius]
-        )
-        salon_ids = []
-        salon_distances = {}
-        for row in cursor.fetchall():
-            salon_id = row[0]
-            salon_ids.append(salon_id)
-            distance_m = row[2]
-            salon_distances[salon_id] = distance_m  # Convert back to meters
-
-        salons = Salon.objects.filter(id__in=salon_ids)
-        print("search salon [3]")
-        # Aktualizacja pola distance_from_query dla każdego salonu
-        for salon in salons:
-            salon.distance_from_query = salon_distances[salon.id]
-            salon.save()  # Zapis wartości do modelu
+    point = get_point_from_address(address) if address else None
+    return search_near_point('', point, radius)
 
-    return salons
 
+## -------------------------------------------------------> 
 
 ## -------------------------------------------------------> 
+## Radius filter
+##
+## Distance is a read-only annotation (meters, on location::geography) and
+## results are ordered by KNN (<->) so the GiST index on the geography cast
+## answers both the radius filter and the top-K ordering. Nothing is written.
+
+# Radius searches return at most this many salons, nearest first
+SEARCH_RESULT_LIMIT = 100
+
+SALON_GEOGRAPHY_FIELD = PointField(geography=True, srid=4326)
+
+class KNNDistance(GeoFunc):
+    arg_joiner = ' <-> '
+    template = '%(expressions)s'
+    output_field = FloatField()
+
+def within_radius(salons, point, radius):
+    return salons.annotate(
+        geography=Cast('location', SALON_GEOGRAPHY_FIELD),
+    ).filter(
+        geography__dwithin=(point, D(m=float(radius))),
+    ).annotate(
+        distance=Distance('geography', point),
+    ).order_by(KNNDistance('geography', point))
+
+def parse_radius(value):
+    # The radius query parameter: None when empty, else meters, finite and above 0
+    value = value.strip()
+    if not value:
+        return None
+    radius = float(value)
+    if not math.isfinite(radius) or radius <= 0:
+        raise ValueError(f'invalid radius {value!r}')
+    return radius
+
 
 ## -------------------------------------------------------> 
 ## Get point from address
 
 def get_point_from_address(address):
-    geolocator = Nominatim(user_agent='[yours_geolocator_id]')
-    location = geolocator.geocode(address)
+    # Cached, see geocoding.Geocoder. Points are (longitude, latitude) like Salon.location.
+    location = get_geocoder().geocode(address)
     if location:
-        point = Point(float(location.latitude), float(location.longitude), srid=4326)
-        print(point)
-        return point
+        return Point(location[1], location[0], srid=4326)
     return None
 
+
+async def aget_point_from_address(address):
+    location = await get_geocoder().ageocode(address)
+    if location:
+        return Point(location[1], location[0], srid=4326)
+    return None
+
+
+
+## -------------------------------------------------------> 
+## Free slot near me
+##
+## Salons within the radius having `duration` consecutive free minutes on a date.
+## Consecutive available slots are grouped into islands (a slot starts a new
+## island unless it begins where the previous one ended), islands long enough
+## for the service are kept and the earliest one per salon is returned.
+
+SALON_GEOGRAPHY = 'location::geography(POINT,4326)'
+
+FREE_SLOT_CANDIDATES_SQL = '''
+    SELECT s.id, ST_Distance({geography}, ST_SetSRID(ST_MakePoint(%s, %s), 4326)::geography) AS distance
+    FROM {salons} s
+    WHERE ST_DWithin({geography}, ST_SetSRID(ST_MakePoint(%s, %s), 4326)::geography, %s)
+'''
+
+FREE_SLOT_SQL = '''
+    WITH candidates AS ({candidates}),
+    free AS (
+        SELECT t.salon_id, t.time_from, t.time_to,
+               CASE WHEN lag(t.time_to) OVER w = t.time_from THEN 0 ELSE 1 END AS island_start
+        FROM {slots} t
+        JOIN candidates c ON c.id = t.salon_id
+        WHERE t.date = %s AND t.is_available
+        WINDOW w AS (PARTITION BY t.salon_id ORDER BY t.time_from)
+    ),
+    islands AS (
+        SELECT salon_id, time_from, time_to,
+               SUM(island_start) OVER (PARTITION BY salon_id ORDER BY time_from) AS island
+        FROM free
+    ),
+    runs AS (
+        SELECT salon_id, MIN(time_from) AS run_start, MAX(time_to) AS run_end
+        FROM islands
+        GROUP BY salon_id, island
+    )
+    SELECT r.salon_id, MIN(r.run_start) AS earliest_start, c.distance
+    FROM runs r
+    JOIN candidates c ON c.id = r.salon_id
+    WHERE r.run_end - r.run_start >= make_interval(mins => %s)
+    GROUP BY r.salon_id, c.distance
+    ORDER BY c.distance
+'''
+
+def _free_slot_candidates(point, radius, keywords, flutter_category):
+    sql = FREE_SLOT_CANDIDATES_SQL.format(geography=SALON_GEOGRAPHY, salons=Salon._meta.db_table)
+    params = [point.x, point.y, point.x, point.y, radius]
+    if flutter_category:
+        sql += ' AND s.flutter_category = %s'
+        params.append(flutter_category)
+    if keywords:
+        sql += (
+            ' AND s.id IN (SELECT d.salon_id FROM {documents} d'
+            " WHERE d.document %%> %s OR d.search_vector @@ websearch_to_tsquery('simple', %s))"
+        ).format(documents=SalonSearchDocument._meta.db_table)
+        params.extend([keywords, keywords])
+    return sql, params
+
+
+@span('search_sql')
+def search_free_slots(point, radius, date, duration, keywords='', flutter_category=''):
+    # Returns [(salon_id, earliest_start, distance_m)] ordered by distance
+    candidates_sql, params = _free_slot_candidates(point, radius, keywords, flutter_category)
+
+    if time_slots_on_demand():
+        with read_connection(Salon).cursor() as cursor:
+            cursor.execute(candidates_sql, params)
+            distances = dict(cursor.fetchall())
+        results = []
+        for (salon_id, _), day in get_availability(list(distances), date, date).items():
+            index = day.first_free_run(-(-duration // day.slot_length)) if day.slot_length > 0 else None
+            if index is not None:
+                results.append((salon_id, day.slot_times(index)[0], distances[salon_id]))
+        return sorted(results, key=lambda row: row[2])
+
+    sql = FREE_SLOT_SQL.format(candidates=candidates_sql, slots=GeneratedTimeSlots._meta.db_table)
+    with read_connection(GeneratedTimeSlots).cursor() as cursor:
+        cursor.execute(sql, params + [date, duration])
+        return cursor.fetchall()
+
+## Free slot near me
+## -------------------------------------------------------> 
@@ -0,0 +1,222 @@
+import asyncio
+import hashlib
+import json
+import threading
+import time
+from django.conf import settings
+from django.core.cache import caches
+from django.core.signals import setting_changed
+from django.db import transaction
+from django.dispatch import receiver
+
+## ------------------------------------------------------->
+## Search result cache
+##
+## SalonSearchAPIView responses are cached as rendered JSON under the
+## normalized query plus a generation number. Writes that change search
+## results bump the generation, which orphans every cached result at once
+## (they expire on their own). On a miss one request per key computes the
+## result while holding a short lock in the cache; the others wait for it
+## instead of running the same search. aget_or_compute() is the same protocol
+## for async views, on the cache backend's async methods.
+##
+## settings.BOOKING_SEARCH_CACHE = {
+##     'CACHE': 'default',   # alias in settings.CACHES, local memory unless configured
+##     'TIMEOUT': 60,        # seconds a result is kept
+##     'LOCK_TIMEOUT': 10,   # seconds a computing request holds its key
+##     'WAIT': 2,            # seconds the others wait for it before computing themselves
+## }
+
+GENERATION_KEY = 'salon-search:generation'
+WAIT_INTERVAL = 0.02
+
+
+def _words(value):
+    # Keyword search and geocoding are both case and whitespace insensitive
+    return ' '.join(value.lower().split())
+
+
+def normalize_search_query(params, min_rating=0):
+    radius = params.get('radius', '').strip()
+    try:
+        radius = repr(float(radius))
+    except ValueError:
+        pass
+    return {
+        'keywords': _words(params.get('keywords', '')),
+        'address': _words(params.get('address', '')),
+        'radius': radius,
+        'min_rating': min_rating,
+        'ordering': params.get('ordering', ''),
+    }
+
+
+class SearchCache:
+    def __init__(self, alias='default', timeout=60, lock_timeout=10, wait=2):
+        self.alias = alias
+        self.timeout = timeout
+        self.lock_timeout = lock_timeout
+        self.wait = wait
+        self._lock = threading.Lock()
+        self._counters = dict.fromkeys(('hits', 'misses', 'coalesced', 'wait_timeouts', 'invalidations'), 0)
+        self._seconds = dict.fromkeys(('hits', 'misses'), 0.0)
+
+    @property
+    def cache(self):
+        return caches[self.alias]
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._counters)
+            seconds = dict(self._seconds)
+        served = stats['hits'] + stats['coalesced']
+        lookups = served + stats['misses']
+        stats['hit_ratio'] = served / lookups if lookups else None
+        stats['avg_hit_ms'] = round(seconds['hits'] / served * 1000, 3) if served else None
+        stats['avg_miss_ms'] = round(seconds['misses'] / stats['misses'] * 1000, 3) if stats['misses'] else None
+        return stats
+
+    def _count(self, counter, seconds=None, timer=None):
+        with self._lock:
+            self._counters[counter] += 1
+            if timer is not None:
+                self._seconds[timer] += seconds
+
+    def generation(self):
+        generation = self.cache.get(GENERATION_KEY)
+        if generation is None:
+            # A fresh start value, so an evicted counter never reuses an old generation
+            self.cache.add(GENERATION_KEY, time.time_ns(), None)
+            generation = self.cache.get(GENERATION_KEY)
+        return generation
+
+    def invalidate(self):
+        try:
+            self.cache.incr(GENERATION_KEY)
+        except ValueError:
+            self.cache.add(GENERATION_KEY, time.time_ns(), None)
+        self._count('invalidations')
+
+    async def ageneration(self):
+        generation = await self.cache.aget(GENERATION_KEY)
+        if generation is None:
+            await self.cache.aadd(GENERATION_KEY, time.time_ns(), None)
+            generation = await self.cache.aget(GENERATION_KEY)
+        return generation
+
+    def key(self, query, generation=None):
+        digest = hashlib.sha1(json.dumps(query, sort_keys=True).encode()).hexdigest()
+        if generation is None:
+            generation = self.generation()
+        return f'salon-search:{generation}:{digest}'
+
+    def get_or_compute(self, query, compute):
+        # compute() returns the rendered bytes
+        start = time.perf_counter()
+        key = self.key(query)
+        content = self.cache.get(key)
+        if content is not None:
+            self._count('hits', time.perf_counter() - start, 'hits')
+            return content
+
+        lock_key = f'{key}:lock'
+        if not self.cache.add(lock_key, 1, self.lock_timeout):
+            deadline = time.monotonic() + self.wait
+            while time.monotonic() < deadline:
+                time.sleep(WAIT_INTERVAL)
+                content = self.cache.get(key)
+                if content is not None:
+                    self._count('coalesced', time.perf_counter() - start, 'hits')
+                    return content
+            self._count('wait_timeouts')
+            lock_key = None
+
+        try:
+            content = compute()
+            self.cache.set(key, content, self.timeout)
+        finally:
+            if lock_key is not None:
+                self.cache.delete(lock_key)
+        self._count('misses', time.perf_counter() - start, 'misses')
+        return content
+
+    async def aget_or_compute(self, query, acompute):
+        # acompute() is a coroutine function returning the rendered bytes
+        start = time.perf_counter()
+        key = self.key(query, await self.ageneration())
+        content = await self.cache.aget(key)
+        if content is not None:
+            self._count('hits', time.perf_counter() - start, 'hits')
+            return content
+
+        lock_key = f'{key}:lock'
+        if not await self.cache.aadd(lock_key, 1, self.lock_timeout):
+            deadline = time.monotonic() + self.wait
+            while time.monotonic() < deadline:
+                await asyncio.sleep(WAIT_INTERVAL)
+                content = await self.cache.aget(key)
+                if content is not None:
+                    self._count('coalesced', time.perf_counter() - start, 'hits')
+                    return content
+            self._count('wait_timeouts')
+            lock_key = None
+
+        try:
+            content = await acompute()
+            await self.cache.aset(key, content, self.timeout)
+        finally:
+            if lock_key is not None:
+                await self.cache.adelete(lock_key)
+        self._count('misses', time.perf_counter() - start, 'misses')
+        return content
+
+## Search result cache
+## ------------------------------------------------------->
+
+## ------------------------------------------------------->
+## Configured cache
+
+_search_cache = None
+_search_cache_lock = threading.Lock()
+
+def get_search_cache():
+    global _search_cache
+    with _search_cache_lock:
+        if _search_cache is None:
+            config = getattr(settings, 'BOOKING_SEARCH_CACHE', {})
+            _search_cache = SearchCache(
+                alias=config.get('CACHE', 'default'),
+                timeout=config.get('TIMEOUT', 60),
+                lock_timeout=config.get('LOCK_TIMEOUT', 10),
+                wait=config.get('WAIT', 2),
+            )
+        return _search_cache
+
+
+@receiver(setting_changed)
+def reset_search_cache(setting, **kwargs):
+    global _search_cache
+    if setting == 'BOOKING_SEARCH_CACHE':
+        with _search_cache_lock:
+            _search_cache = None
+
+
+def invalidate_search_cache():
+    get_search_cache().invalidate()
+
+
+_pending = threading.local()
+
+def schedule_search_cache_invalidation():
+    # Once per transaction, after it commits
+    _pending.invalidate = True
+    transaction.on_commit(_flush_search_cache_invalidation)
+
+
+def _flush_search_cache_invalidation():
+    if getattr(_pending, 'invalidate', False):
+        _pending.invalidate = False
+        invalidate_search_cache()
+
+## Configured cache
+## ------------------------------------------------------->
@@ -0,0 +1,89 @@
+import threading
+from django.db import connection, transaction
+from .models import Salon, Category, Service, SalonSearchDocument
+from .search_cache import schedule_search_cache_invalidation
+
+## ------------------------------------------------------->
+## Search documents
+##
+## One statement (re)builds the SalonSearchDocument of many salons: name,
+## city, about, category names and service titles concatenated for the
+## trigram index, and a weighted tsvector (name > categories/services > city
+## > about) for the full-text index.
+
+# Salons rebuilt per statement by rebuild_all_search_documents
+SEARCH_DOCUMENT_BATCH_SIZE = 5000
+
+REBUILD_SQL = '''
+    INSERT INTO {documents} (salon_id, document, search_vector)
+    SELECT s.id,
+           concat_ws(' ', s.name, s.address_city, s.about, catalog.categories, catalog.services),
+           setweight(to_tsvector('simple', coalesce(s.name, '')), 'A') ||
+           setweight(to_tsvector('simple', concat_ws(' ', catalog.categories, catalog.services)), 'B') ||
+           setweight(to_tsvector('simple', coalesce(s.address_city, '')), 'C') ||
+           setweight(to_tsvector('simple', coalesce(s.about, '')), 'D')
+    FROM {salons} s
+    CROSS JOIN LATERAL (
+        SELECT (SELECT string_agg(c.name, ' ') FROM {categories} c WHERE c.salon_id = s.id) AS categories,
+               (SELECT string_agg(sv.title, ' ') FROM {services} sv
+                WHERE sv.salon_id = s.id
+                   OR sv.category_id IN (SELECT c.id FROM {categories} c WHERE c.salon_id = s.id)) AS services
+    ) catalog
+    WHERE s.id = ANY(%s)
+    ON CONFLICT (salon_id) DO UPDATE
+    SET document = EXCLUDED.document, search_vector = EXCLUDED.search_vector
+'''
+
+def rebuild_search_documents(salon_ids):
+    salon_ids = [salon_id for salon_id in set(salon_ids) if salon_id is not None]
+    if not salon_ids:
+        return 0
+    sql = REBUILD_SQL.format(
+        documents=SalonSearchDocument._meta.db_table,
+        salons=Salon._meta.db_table,
+        categories=Category._meta.db_table,
+        services=Service._meta.db_table,
+    )
+    with connection.cursor() as cursor:
+        cursor.execute(sql, [salon_ids])
+        rebuilt = cursor.rowcount
+    # Every catalog change passes through here, cached search results are stale once it commits
+    schedule_search_cache_invalidation()
+    return rebuilt
+
+
+def rebuild_all_search_documents(batch_size=SEARCH_DOCUMENT_BATCH_SIZE):
+    rebuilt = 0
+    last_id = 0
+    while True:
+        salon_ids = list(Salon.objects.filter(id__gt=last_id).order_by('id').values_list('id', flat=True)[:batch_size])
+        if not salon_ids:
+            return rebuilt
+        rebuilt += rebuild_search_documents(salon_ids)
+        last_id = salon_ids[-1]
+
+## Search documents
+## ------------------------------------------------------->
+
+## ------------------------------------------------------->
+## Deferred refresh
+##
+## Writes inside a transaction only collect salon ids; the first commit
+## callback rebuilds all of them in one statement, the others find nothing left.
+
+_pending = threading.local()
+
+def schedule_search_document_refresh(salon_id):
+    if not hasattr(_pending, 'salon_ids'):
+        _pending.salon_ids = set()
+    _pending.salon_ids.add(salon_id)
+    transaction.on_commit(_flush_search_document_refresh)
+
+
+def _flush_search_document_refresh():
+    salon_ids = getattr(_pending, 'salon_ids', set())
+    _pending.salon_ids = set()
+    rebuild_search_documents(salon_ids)
+
+## Deferred refresh
+## ------------------------------------------------------->
@@ -1,6 +1,14 @@
+import logging
 from datetime import timedelta
+from django.db import transaction
 from rest_framework import serializers
-from .models import Salon, Category, Service, Review, GeneratedTimeSlots, FixedOperatingHours, UnFixedOperatingHours, Appointment
+from .booking import claim_time_slots, run_reservation
+from .versioning import schedule_salon_version_bump, schedule_catalog_version_bump
+from .search_index import schedule_search_document_refresh
+from .availability import day_time_slots
+from .models import Salon, Category, Service, Review, SalonRatingSummary, GeneratedTimeSlots, FixedOperatingHours, UnFixedOperatingHours, Appointment, bulk_insert_time_slots, time_slots_on_demand
+
+logger = logging.getLogger(__name__)
 
 class ServiceSerializer(serializers.ModelSerializer):
     class Meta:
@@ -23,8 +31,22 @@ class CategorySerializer(serializers.ModelSerializer):
 
         return category_instance
 
+class SalonServiceWriteSerializer(ServiceSerializer):
+    # Nested under SalonSerializer: id picks the service to update, salon and category come from the parents
+    id = serializers.IntegerField(required=False)
+
+    class Meta(ServiceSerializer.Meta):
+        read_only_fields = ('salon', 'category')
+
+class SalonCategoryWriteSerializer(CategorySerializer):
+    id = serializers.IntegerField(required=False)
+    services = SalonServiceWriteSerializer(many=True, required=False)
+
+    class Meta(CategorySerializer.Meta):
+        read_only_fields = ('salon',)
+
 class SalonSerializer(serializers.ModelSerializer):
-    categories = CategorySerializer(many=True, required=False)
+    categories = SalonCategoryWriteSerializer(many=True, required=False)
 
     class Meta:
         model = Salon
@@ -36,74 +58,114 @@ class SalonSerializer(serializers.ModelSerializer):
         salon = Salon.objects.create(**validated_data)
 
         for category_data in categories_data:
+            category_data.pop('id', None)
             services_data = category_data.pop('services', [])
             category = Category.objects.create(salon=salon, **category_data)
 
             for service_data in services_data:
+                service_data.pop('id', None)
                 Service.objects.create(salon=salon, category=category, **service_data)
 
         return salon
-    # ... reszta kodu (funkcja update itp.)
-
 
     def update(self, instance, validated_data):
-        categories_data = validated_data.pop('categories', [])  # Default to empty list if 'categories' is missing
-        instance.name = validated_data.get('name', instance.name)
-        instance.address_city = validated_data.get('address_city', instance.address_city)
-        instance.address_postal_code = validated_data.get('address_postal_code', instance.address_postal_code)
-        instance.address_street = validated_data.get('address_street', instance.address_street)
-        instance.address_number = validated_data.get('address_number', instance.address_number)
-        instance.location = validated_data.get('location', instance.location)
-        instance.about = validated_data.get('about', instance.about)
-        instance.avatar = validated_data.get('avatar', instance.avatar)
-        instance.phone_number = validated_data.get('phone_number', instance.phone_number)
-        instance.distance_from_query = validated_data.get('distance_from_query', instance.distance_from_query)
-        instance.error_code = validated_data.get('error_code', instance.error_code)
-        instance.flutter_category = validated_data.get('flutter_category', instance.flutter_category)
-        instance.save()
+        # The nested catalog is reconciled in a fixed number of queries: one fetch of the existing
+        # categories and services, an in-memory diff, then bulk updates and bulk inserts. Items with
+        # an id update the salon's category / service, items without one are created, ids of other
+        # salons are skipped and categories or services left out are kept.
+        categories_data = validated_data.pop('categories', [])
 
+        with transaction.atomic():
+            for attr, value in validated_data.items():
+                setattr(instance, attr, value)
+            # Never the version loaded with the instance, the bump below changes it
+            instance.save(update_fields=list(validated_data))
+
+            if categories_data:
+                self.update_catalog(instance, categories_data)
+                schedule_catalog_version_bump()
+            # bulk_create / bulk_update send no signals
+            schedule_search_document_refresh(instance.pk)
+            schedule_salon_version_bump(instance.pk)
+
+        # The view drops the prefetches of the instance it passed in, so the response is rendered from
+        # a fresh copy: salon, categories and services in three queries
+        return Salon.objects.prefetch_related('categories__services').get(pk=instance.pk)
+
+    def update_catalog(self, salon, categories_data):
+        categories = {category.pk: category for category in Category.objects.filter(salon=salon)}
+        services = {service.pk: service for service in Service.objects.filter(category__in=categories)}
+
+        changed_categories, changed_services = [], []
+        new_categories, new_services = [], []
         for category_data in categories_data:
-            category_id = category_data.get('id', None)
+            services_data = category_data.pop('services', [])
+            category_id = category_data.pop('id', None)
             if category_id is None:
-                services_data = category_data.pop('services', [])  # Default to empty list if 'services' is missing
-                salon_instance = instance
-                category = Category.objects.create(salon=salon_instance, **category_data)
+                new_categories.append((Category(salon=salon, **category_data), services_data))
+                continue
+            category = categories.get(category_id)
+            if category is None:
+                continue
+            if self.assign(category, category_data):
+                changed_categories.append(category)
 
-                for service_data in services_data:
-                    Service.objects.create(salon=instance, category=category, **service_data)
-            else:
-                try:
-                    category = Category.objects.get(id=category_id, salon=instance)
-                except Category.DoesNotExist:
+            for service_data in services_data:
+                service_id = service_data.pop('id', None)
+                if service_id is None:
+                    new_services.append(Service(salon=salon, category=category, **service_data))
                     continue
+                service = services.get(service_id)
+                if service is None or service.category_id != category.pk:
+                    continue
+                if self.assign(service, service_data):
+                    changed_services.append(service)
 
-                category.name = category_data.get('name', category.name)
-                category.save()
-
-                for service_data in category_data.get('services', []):
-                    service_id = service_data.get('id', None)
-                    if service_id is None:
-                        Service.objects.create(salon=instance, category=category, **service_data)
-                    else:
-                        try:
-                            service = Service.objects.get(id=service_id, category=category)
-                        except Service.DoesNotExist:
-                            continue
-
-                        service.title = service_data.get('title', service.title)
-                        service.description = service_data.get('description', service.description)
-                        service.price = service_data.get('price', service.price)
-                        service.duration_minutes = service_data.get('duration_minutes', service.duration_minutes)
-                        service.save()
+        if new_categories:
+            # PostgreSQL returns the primary keys of bulk inserted rows
+            Category.objects.bulk_create([category for category, _ in new_categories])
+            for category, services_data in new_categories:
+                for service_data in services_data:
+                    service_data.pop('id', None)
+                    new_services.append(Service(salon=salon, category=category, **service_data))
+
+        # Bookings add up duration_temp, it has to follow duration_minutes as in importer.py
+        for service in changed_services + new_services:
+            service.duration_temp = timedelta(minutes=service.duration_minutes)
+
+        if changed_categories:
+            Category.objects.bulk_update(changed_categories, ['name'])
+        if changed_services:
+            Service.objects.bulk_update(changed_services, ['title', 'description', 'price', 'duration_minutes', 'duration_temp'])
+        if new_services:
+            Service.objects.bulk_create(new_services)
+
+    @staticmethod
+    def assign(obj, data):
+        # Sets the given fields, True when any of them changed
+        changed = False
+        for attr, value in data.items():
+            if getattr(obj, attr) != value:
+                setattr(obj, attr, value)
+                changed = True
+        return changed
+
+class SalonRatingSummarySerializer(serializers.ModelSerializer):
+    histogram = serializers.ListField(child=serializers.IntegerField(), read_only=True)
 
-        return instance
+    class Meta:
+        model = SalonRatingSummary
+        fields = ('review_count', 'rating_average', 'histogram', 'last_review_at')
 
 class ReadOnlySalonSerializer(serializers.ModelSerializer):
     categories = CategorySerializer(many=True, read_only=True)
+    distance_from_query = serializers.SerializerMethodField()
+    rating = SalonRatingSummarySerializer(source='rating_summary', read_only=True)  # null until the first review
+
     class Meta:
         model = Salon
         fields = ('id','name', 'address_city', 'address_postal_code', 'address_street', 'address_number', 'location',
-                  'about','avatar', 'phone_number', 'distance_from_query', 'error_code', 'flutter_category', 'categories')
+                  'about','avatar', 'phone_number', 'distance_from_query', 'error_code', 'flutter_category', 'categories', 'rating')
 
     def create(self, validated_data):
         categories_data = validated_data.pop('categories')
@@ -117,21 +179,44 @@ class ReadOnlySalonSerializer(serializers.ModelSerializer):
                 Service.objects.create(salon=salon, category=category, **service_data)
 
         return salon
+
+    @staticmethod
+    def setup_eager_loading(queryset):
+        # categories -> services in two extra queries, whatever the number of salons
+        return queryset.select_related('rating_summary').prefetch_related('categories__services')
+
+    def get_distance_from_query(self, obj):
+        # Meters from the searched point, annotated by radius searches (see search.within_radius)
+        distance = getattr(obj, 'distance', None)
+        return distance.m if distance is not None else None
     
 class ReviewSerializer(serializers.ModelSerializer):
     class Meta:
         model = Review
         fields = ('id', 'salon', 'user_id', 'rating', 'comment', 'image_url', 'created_at', 'updated_at')
         
+class OperatingHoursListSerializer(serializers.ListSerializer):
+    # Bulk POST: insert all operating hours, then materialize their slots in batched inserts
+    def create(self, validated_data):
+        model = self.child.Meta.model
+        with transaction.atomic():
+            instances = model.objects.bulk_create([model(**attrs) for attrs in validated_data])
+            if not time_slots_on_demand():
+                bulk_insert_time_slots(slot for instance in instances for slot in instance.build_time_slots())
+            schedule_salon_version_bump(*{instance.salon_id for instance in instances})
+        return instances
+
 class FixedOperatingHoursSerializer(serializers.ModelSerializer):
     class Meta:
         model = FixedOperatingHours
         fields = '__all__'
+        list_serializer_class = OperatingHoursListSerializer
 
 class UnFixedOperatingHoursSerializer(serializers.ModelSerializer):
     class Meta:
         model = UnFixedOperatingHours
         fields = '__all__'
+        list_serializer_class = OperatingHoursListSerializer
 
 class GeneratedTimeSlotsSerializer(serializers.ModelSerializer):
     class Meta:
@@ -139,19 +224,41 @@ class GeneratedTimeSlotsSerializer(serializers.ModelSerializer):
         fields = ['salon', 'date', 'time_from', 'time_to', 'is_available']
 
 
+class FreeTimeSlotSerializer(serializers.ModelSerializer):
+    # id is null for computed slots in on-demand mode
+    class Meta:
+        model = GeneratedTimeSlots
+        fields = ['id', 'date', 'time_from', 'time_to']
+
+
+class GeneratedTimeSlotsExportSerializer(GeneratedTimeSlotsSerializer):
+    class Meta(GeneratedTimeSlotsSerializer.Meta):
+        fields = ['id'] + GeneratedTimeSlotsSerializer.Meta.fields + ['updated_at']
+
 class AppointmentSerializer(serializers.ModelSerializer):
     services = serializers.PrimaryKeyRelatedField(many=True, queryset=Service.objects.all())
-    timeslots = serializers.PrimaryKeyRelatedField(many=True, queryset=GeneratedTimeSlots.objects.all())
+    timeslots = serializers.PrimaryKeyRelatedField(many=True, queryset=GeneratedTimeSlots.objects.all(), required=False)
+    # Instead of timeslots: the first slot of the appointment, resolved (and in on-demand
+    # mode materialized) when it is created
+    date = serializers.DateField(write_only=True, required=False)
+    time_from = serializers.TimeField(write_only=True, required=False)
     total_amount = serializers.DecimalField(max_digits=6, decimal_places=2, read_only=True)
     status = serializers.CharField(default='P', read_only=True)
 
     class Meta:
         model = Appointment
-        fields = ['id', 'salon', 'customer', 'services', 'total_amount','comment', 'status', 'created_at', 'timeslots']
+        fields = ['id', 'salon', 'customer', 'services', 'total_amount','comment', 'status', 'created_at', 'timeslots', 'date', 'time_from']
+
+    def validate(self, data):
+        if ('date' in data) != ('time_from' in data):
+            raise serializers.ValidationError("date and time_from must be given together.")
+        return data
 
     def create(self, validated_data):
         services = validated_data.pop('services')
-        timeslots = validated_data.pop('timeslots')
+        timeslots = validated_data.pop('timeslots', [])
+        booked_date = validated_data.pop('date', None)
+        time_from = validated_data.pop('time_from', None)
         
         salon = validated_data.get('salon')
         customer = validated_data.get('customer')
@@ -165,14 +272,6 @@ class AppointmentSerializer(serializers.ModelSerializer):
         if not all(service.salon.id == salon.id for service in services):
             raise serializers.ValidationError("One or more services do not belong to the specified salon.")
 
-        # Checking if the timeslots correspond to the correct salon
-        if not all(timeslot.salon.id == salon.id for timeslot in timeslots):
-            raise serializers.ValidationError("One or more timeslots do not belong to the specified salon.")
-
-        # Checking if all timeslots are available
-        if not all(timeslot.is_available for timeslot in timeslots):
-            raise serializers.ValidationError("One or more of the specified timeslots are not available.")
-
         # Calculate total duration and price
         total_duration = timedelta()
         total_amount = 0
@@ -180,25 +279,45 @@ class AppointmentSerializer(serializers.ModelSerializer):
             total_duration += service.duration_temp
             total_amount += service.price
         
-        print('total_duration', total_duration)
+        logger.debug('total duration %s', total_duration)
 
         # total_duration = sum(service.duration_temp for service in services)
         # total_amount = sum(service.price for service in services)
 
-        # Get the slot length from FixedOperatingHours or UnFixedOperatingHours
+        if not timeslots and booked_date is None:
+            raise serializers.ValidationError("At least one timeslot is required.")
+
+        # Get the slot length from FixedOperatingHours or UnFixedOperatingHours of the booked day
+        # (a salon has fixed hours per weekday)
+        booked_date = timeslots[0].date if timeslots else booked_date
         try:
-            slot_length = FixedOperatingHours.objects.get(salon=salon).time_slot_length
+            slot_length = FixedOperatingHours.objects.get(salon=salon, day_of_week=booked_date.weekday()).time_slot_length
         except FixedOperatingHours.DoesNotExist:
-            slot_length = UnFixedOperatingHours.objects.get(salon=salon).time_slot_length
+            try:
+                slot_length = UnFixedOperatingHours.objects.get(salon=salon, date=booked_date).time_slot_length
+            except UnFixedOperatingHours.DoesNotExist:
+                raise serializers.ValidationError("The salon is closed on the specified date.")
 
         # Calculate how many time slots are needed
         total_timeslots_needed = int(total_duration.total_seconds() / 60) // slot_length
-        print('total timeslots needed',total_timeslots_needed)
-        print('len timeslots',len(timeslots))
-        print('timeslots', timeslots)
+        logger.debug('timeslots needed %s, given %s', total_timeslots_needed, len(timeslots))
         if total_duration % timedelta(minutes=slot_length):
             total_timeslots_needed += 1
 
+        if not timeslots:
+            timeslots = day_time_slots(salon.id, booked_date, time_from, total_timeslots_needed)
+            if not timeslots or timeslots[0].time_from != time_from or any(
+                    previous.time_to != timeslot.time_from for previous, timeslot in zip(timeslots, timeslots[1:])):
+                raise serializers.ValidationError("No consecutive timeslots start at the specified time.")
+
+        # Checking if the timeslots correspond to the correct salon
+        if not all(timeslot.salon_id == salon.id for timeslot in timeslots):
+            raise serializers.ValidationError("One or more timeslots do not belong to the specified salon.")
+
+        # Checking if all timeslots are available
+        if not all(timeslot.is_available for timeslot in timeslots):
+            raise serializers.ValidationError("One or more of the specified timeslots are not available.")
+
         # Checking if calculated amount of timeslots corresponds to given timeslots in request
         if total_timeslots_needed != len(timeslots):
             raise serializers.ValidationError("The number of timeslots does not match the total duration of the services.")
@@ -217,21 +336,94 @@ class AppointmentSerializer(serializers.ModelSerializer):
         if last_timeslot_end_time > closing_time:
             raise serializers.ValidationError("The end time of the appointment exceeds the operating hours of the salon.")
 
-        # At this point, all the checks are passed, we can now create the appointment
-        appointment = Appointment.objects.create(
-            salon=salon,
-            customer=customer,
-            comment=comment,
-            total_amount=total_amount,
-            status='P',  # 'P' for Pending
-        )
+        # At this point, all the checks are passed, we can now claim the timeslots and create the appointment
+        def reserve():
+            claim_time_slots(salon.id, [timeslot.id for timeslot in timeslots])
+            appointment = Appointment.objects.create(
+                salon=salon,
+                customer=customer,
+                comment=comment,
+                total_amount=total_amount,
+                status='P',  # 'P' for Pending
+            )
 
-        # Attach the services and timeslots to the appointment
-        for service in services:
-            appointment.services.add(service)
-        for timeslot in timeslots:
-            timeslot.is_available = False
-            timeslot.save()
-            appointment.timeslots.add(timeslot)
+            # Attach the services and timeslots to the appointment
+            appointment.services.add(*services)
+            appointment.timeslots.add(*timeslots)
+            return appointment
+
+        return run_reservation(reserve)
+
+class AppointmentExportSerializer(AppointmentSerializer):
+    class Meta(AppointmentSerializer.Meta):
+        fields = AppointmentSerializer.Meta.fields + ['updated_at']
+
+
+class SalonExportSerializer(ReadOnlySalonSerializer):
+    class Meta(ReadOnlySalonSerializer.Meta):
+        fields = ReadOnlySalonSerializer.Meta.fields + ('version', 'modified_at')
+
+
+class AppointmentOperationSerializer(serializers.Serializer):
+    ACTIONS = ('cancel', 'status', 'reschedule')
+
+    id = serializers.IntegerField()
+    action = serializers.ChoiceField(choices=ACTIONS)
+    status = serializers.ChoiceField(choices=Appointment.STATUS_CHOICES, required=False)
+    timeslots = serializers.ListField(child=serializers.IntegerField(), required=False, allow_empty=False)
+
+    def validate(self, data):
+        if data['action'] == 'status' and 'status' not in data:
+            raise serializers.ValidationError({'status': 'This field is required for the status action.'})
+        if data['action'] == 'reschedule' and 'timeslots' not in data:
+            raise serializers.ValidationError({'timeslots': 'This field is required for the reschedule action.'})
+        return data
+
+
+class AppointmentBulkSerializer(serializers.Serializer):
+    operations = serializers.ListField(child=AppointmentOperationSerializer(), allow_empty=False, max_length=1000)
 
-        return appointment
\ No newline at end of file
+
+class SalonImportServiceSerializer(serializers.ModelSerializer):
+    # The model default of duration_minutes is '', which no import can store
+    duration_minutes = serializers.IntegerField(min_value=1)
+
+    class Meta:
+        model = Service
+        fields = ('title', 'description', 'price', 'duration_minutes')
+
+class SalonImportCategorySerializer(serializers.ModelSerializer):
+    services = SalonImportServiceSerializer(many=True, required=False)
+
+    class Meta:
+        model = Category
+        fields = ('name', 'services')
+
+class SalonImportOperatingHoursSerializer(serializers.ModelSerializer):
+    day_of_week = serializers.IntegerField(min_value=0, max_value=6)
+    time_slot_length = serializers.IntegerField(min_value=5, required=False)
+
+    class Meta:
+        model = FixedOperatingHours
+        fields = ('day_of_week', 'open_time', 'close_time', 'time_slot_length')
+
+    def validate(self, data):
+        if data['open_time'] >= data['close_time']:
+            raise serializers.ValidationError('open_time must be before close_time.')
+        return data
+
+class SalonImportSerializer(serializers.ModelSerializer):
+    # One record of a bulk import (see importer.py). Validation runs no queries.
+    categories = SalonImportCategorySerializer(many=True, required=False)
+    operating_hours = SalonImportOperatingHoursSerializer(many=True, required=False)
+
+    class Meta:
+        model = Salon
+        fields = ('name', 'address_city', 'address_postal_code', 'address_street', 'address_number', 'about', 'avatar',
+                  'phone_number', 'flutter_category', 'categories', 'operating_hours')
+
+    def validate_operating_hours(self, value):
+        days = [hours['day_of_week'] for hours in value]
+        if len(days) != len(set(days)):
+            raise serializers.ValidationError('Each day_of_week can appear once.')
+        return value
\ No newline at end of file
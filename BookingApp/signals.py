@@ -0,0 +1,54 @@
+from django.db.models.signals import post_save, post_delete
+from django.dispatch import receiver
+from .models import Salon, Category, Service, Review, FixedOperatingHours, UnFixedOperatingHours, GeneratedTimeSlots
+from .search_index import schedule_search_document_refresh
+from .versioning import schedule_salon_version_bump, schedule_catalog_version_bump
+from .search_cache import schedule_search_cache_invalidation
+
+## ------------------------------------------------------->
+## Catalog: search documents, salon versions and the catalog version
+
+@receiver([post_save, post_delete], sender=Salon)
+def salon_changed(sender, instance, **kwargs):
+    schedule_search_document_refresh(instance.pk)
+    schedule_salon_version_bump(instance.pk)
+
+@receiver([post_save, post_delete], sender=Category)
+def category_changed(sender, instance, **kwargs):
+    schedule_search_document_refresh(instance.salon_id)
+    schedule_salon_version_bump(instance.salon_id)
+    schedule_catalog_version_bump()
+
+@receiver([post_save, post_delete], sender=Service)
+def service_changed(sender, instance, **kwargs):
+    # Services created through CategorySerializer only have a category
+    salon_id = instance.salon_id
+    if salon_id is None and instance.category_id is not None:
+        salon_id = Category.objects.filter(pk=instance.category_id).values_list('salon_id', flat=True).first()
+    schedule_search_document_refresh(salon_id)
+    schedule_salon_version_bump(salon_id)
+    schedule_catalog_version_bump()
+
+## Catalog: search documents, salon versions and the catalog version
+## ------------------------------------------------------->
+
+## ------------------------------------------------------->
+## Salon content
+##
+## Everything else shown under a salon bumps its version too. Bulk writes (bulk_create, queryset
+## updates, raw SQL) send no signals and schedule their bumps themselves.
+
+@receiver([post_save, post_delete], sender=Review)
+def review_changed(sender, instance, **kwargs):
+    # Search results show and filter on the rating summary
+    schedule_salon_version_bump(instance.salon_id)
+    schedule_search_cache_invalidation()
+
+@receiver([post_save, post_delete], sender=FixedOperatingHours)
+@receiver([post_save, post_delete], sender=UnFixedOperatingHours)
+@receiver([post_save, post_delete], sender=GeneratedTimeSlots)
+def salon_content_changed(sender, instance, **kwargs):
+    schedule_salon_version_bump(instance.salon_id)
+
+## Salon content
+## ------------------------------------------------------->
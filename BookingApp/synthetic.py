@@ -0,0 +1,170 @@
+import math
+import random
+from datetime import time as dtime, timedelta
+from decimal import Decimal
+from django.contrib.gis.geos import Point
+from django.db import connection, transaction
+from django.utils import timezone
+from .models import Salon, Category, Service, Review, SalonRatingSummary, FixedOperatingHours, GeneratedTimeSlots, Appointment, time_slots_on_demand
+from .maintenance import materialize_time_slots
+from .search_index import rebuild_search_documents
+from .versioning import schedule_catalog_version_bump
+
+## ------------------------------------------------------->
+## Synthetic data
+##
+## Seeded, reproducible data for load tests and benchmarks: salons spread
+## around a city centre, categories and services, Mon-Sat operating hours,
+## materialized slots, reviews (with rating summaries) and single-slot
+## appointments. Everything is written with bulk inserts and set-based SQL.
+## Synthetic salons are recognised by their name prefix.
+
+SYNTHETIC_PREFIX = 'Synthetic'
+# Warsaw centre, (latitude, longitude)
+CENTER = (52.2297, 21.0122)
+SYNTHETIC_ADDRESS = 'Marszałkowska 1, 00-001 Warszawa'
+
+NAME_WORDS = ['Studio', 'Salon', 'Fryzjer', 'Barber', 'Beauty', 'Nails', 'Spa', 'Look', 'Style', 'Glamour', 'Hair', 'Relax']
+CATALOG = {
+    'Fryzjer': ['Strzyżenie damskie', 'Strzyżenie męskie', 'Koloryzacja', 'Modelowanie'],
+    'Paznokcie': ['Manicure hybrydowy', 'Pedicure', 'Przedłużanie paznokci'],
+    'Kosmetyka': ['Henna brwi', 'Makijaż', 'Oczyszczanie twarzy'],
+    'Masaż': ['Masaż klasyczny', 'Masaż relaksacyjny'],
+}
+STREETS = ['Marszałkowska', 'Puławska', 'Grójecka', 'Targowa', 'Nowy Świat', 'Żelazna', 'Wolska', 'Mokotowska']
+RATINGS = [1, 2, 3, 4, 5]
+RATING_WEIGHTS = [1, 2, 5, 12, 20]
+
+BATCH_SIZE = 5000
+
+
+def _spread_point(rng, spread_km):
+    # Uniform over a disc of spread_km around CENTER
+    distance = spread_km * math.sqrt(rng.random())
+    bearing = rng.random() * 2 * math.pi
+    latitude = CENTER[0] + distance / 111.32 * math.cos(bearing)
+    longitude = CENTER[1] + distance / (111.32 * math.cos(math.radians(CENTER[0]))) * math.sin(bearing)
+    return Point(longitude, latitude, srid=4326)
+
+
+SAMPLE_APPOINTMENT_SLOTS_SQL = '''
+    UPDATE {slots} SET is_available = false, updated_at = now()
+    WHERE id IN (
+        SELECT id FROM (
+            SELECT id, row_number() OVER (PARTITION BY salon_id ORDER BY random()) AS n
+            FROM {slots}
+            WHERE salon_id = ANY(%s) AND is_available AND date >= %s
+        ) sampled
+        WHERE n <= %s
+    )
+    RETURNING id, salon_id
+'''
+
+def generate_synthetic_data(salons=1000, days=30, reviews=5, appointments=10, seed=1, spread_km=15):
+    rng = random.Random(seed)
+    today = timezone.now().date()
+    choices = [choice for choice, _ in Salon.FLUTTER_CATEGORY_CHOICES]
+
+    with transaction.atomic():
+        # bulk_create skips Salon.save(): the salons are placed already, nothing to geocode
+        salon_objects = Salon.objects.bulk_create([
+            Salon(
+                name=f'{SYNTHETIC_PREFIX} {rng.choice(NAME_WORDS)} {rng.choice(NAME_WORDS)} {i}',
+                address_city='Warszawa',
+                address_postal_code=f'0{rng.randint(0, 4)}-{rng.randint(1, 999):03d}',
+                address_street=rng.choice(STREETS),
+                address_number=str(rng.randint(1, 200)),
+                location=_spread_point(rng, spread_km),
+                about='Salon testowy',
+                phone_number=f'+48 {rng.randint(500000000, 899999999)}',
+                distance_from_query=None,
+                error_code=0,
+                flutter_category=rng.choice(choices),
+            )
+            for i in range(salons)
+        ], batch_size=BATCH_SIZE)
+        salon_ids = [salon.pk for salon in salon_objects]
+
+        slot_lengths = {salon_id: rng.choice([20, 30]) for salon_id in salon_ids}
+        hours = []
+        for salon_id in salon_ids:
+            open_hour = rng.randint(8, 10)
+            close_hour = rng.randint(16, 20)
+            hours.extend(
+                FixedOperatingHours(salon_id=salon_id, day_of_week=day, open_time=dtime(open_hour), close_time=dtime(close_hour),
+                                    time_slot_length=slot_lengths[salon_id])
+                for day in range(6)
+            )
+        FixedOperatingHours.objects.bulk_create(hours, batch_size=BATCH_SIZE)
+
+        categories = Category.objects.bulk_create([
+            Category(salon_id=salon_id, name=name)
+            for salon_id in salon_ids for name in rng.sample(sorted(CATALOG), 2)
+        ], batch_size=BATCH_SIZE)
+        services = []
+        single_slot_services = {}
+        for category in categories:
+            for title in CATALOG[category.name]:
+                # Whole slots; the first service of every salon takes exactly one (booked below)
+                slot_length = slot_lengths[category.salon_id]
+                minutes = slot_length * rng.randint(1, 3) if category.salon_id in single_slot_services else slot_length
+                services.append(Service(salon_id=category.salon_id, category=category, title=title, description='',
+                                        price=Decimal(rng.randint(5, 40) * 10), duration_minutes=minutes,
+                                        duration_temp=timedelta(minutes=minutes)))
+                single_slot_services.setdefault(category.salon_id, services[-1])
+        Service.objects.bulk_create(services, batch_size=BATCH_SIZE)
+
+        review_objects = Review.objects.bulk_create([
+            Review(salon_id=salon_id, user_id=f'synthetic-{rng.randint(1, 100000)}',
+                   rating=rng.choices(RATINGS, RATING_WEIGHTS)[0], comment='')
+            for salon_id in salon_ids for _ in range(rng.randint(0, reviews * 2))
+        ], batch_size=BATCH_SIZE)
+        # Review.save() keeps the summaries up to date, bulk_create does not
+        SalonRatingSummary.rebuild()
+
+        slots = 0
+        booked = []
+        # On-demand mode stores slots only when a salon-day is browsed
+        if not time_slots_on_demand():
+            slots = materialize_time_slots(today, today + timedelta(days=days - 1))
+            with connection.cursor() as cursor:
+                # Seeds random() so the sampled slots are reproducible too
+                cursor.execute('SELECT setseed(%s)', [rng.random()])
+                cursor.execute(SAMPLE_APPOINTMENT_SLOTS_SQL.format(slots=GeneratedTimeSlots._meta.db_table),
+                               [salon_ids, today, appointments])
+                booked = cursor.fetchall()
+
+        appointment_objects = Appointment.objects.bulk_create([
+            Appointment(salon_id=salon_id, customer=f'synthetic-{rng.randint(1, 100000)}',
+                        total_amount=single_slot_services[salon_id].price, status=rng.choice('PPCF'))
+            for _, salon_id in booked
+        ], batch_size=BATCH_SIZE)
+        Appointment.timeslots.through.objects.bulk_create([
+            Appointment.timeslots.through(appointment_id=appointment.pk, generatedtimeslots_id=slot_id)
+            for appointment, (slot_id, _) in zip(appointment_objects, booked)
+        ], batch_size=BATCH_SIZE)
+        Appointment.services.through.objects.bulk_create([
+            Appointment.services.through(appointment_id=appointment.pk, service_id=single_slot_services[salon_id].pk)
+            for appointment, (_, salon_id) in zip(appointment_objects, booked)
+        ], batch_size=BATCH_SIZE)
+
+        rebuild_search_documents(salon_ids)
+        schedule_catalog_version_bump()
+
+    return {
+        'salons': len(salon_ids),
+        'categories': len(categories),
+        'services': len(services),
+        'operating_hours': len(hours),
+        'reviews': len(review_objects),
+        'slots': slots,
+        'appointments': len(appointment_objects),
+    }
+
+
+def delete_synthetic_data():
+    deleted, _ = Salon.objects.filter(name__startswith=f'{SYNTHETIC_PREFIX} ').delete()
+    return deleted
+
+## Synthetic data
+## ------------------------------------------------------->
@@ -1,3 +1,1229 @@
-from django.test import TestCase
+import asyncio
+import base64
+import csv
+import io
+import json
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date, time, timedelta
+from types import SimpleNamespace
+from urllib.parse import parse_qs, urlparse
+from unittest.mock import Mock, patch
+from asgiref.sync import async_to_sync
+from django.db import DatabaseError, IntegrityError, OperationalError, connection, transaction
+from django.contrib.gis.geos import Point
+from django.core.cache import caches
+from django.core.management import call_command
+from django.http import HttpResponse, StreamingHttpResponse
+from django.test import AsyncClient, RequestFactory, SimpleTestCase, TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+from rest_framework.exceptions import NotFound
+from rest_framework.request import Request
+from rest_framework.test import APITestCase
+from .models import (Salon, Category, Service, Review, SalonRatingSummary, FixedOperatingHours, UnFixedOperatingHours,
+                     GeneratedTimeSlots, Appointment, GeocodeCacheEntry, bulk_insert_time_slots, iter_time_slots)
+from .booking import RESERVATION_ATTEMPTS, SlotConflict, claim_time_slots, run_reservation
+from .geocoding import (GEOCODE_BACKOFF, GEOCODE_MAX_ATTEMPTS, GEOCODE_PENDING, Geocoder, StubUpstream, _lease_salons,
+                        geocode_pending_salons, get_geocoder, normalize_address, reset_geocoder)
+from .export import export_salons, export_time_slots
+from .importer import import_salons
+from .availability import AvailableSlots, iter_available_slots
+from .maintenance import SLOT_HORIZON_DAYS, materialize_time_slots, run_daily_maintenance
+from .partitioning import (CREATE_TABLE_SQL, add_slot_link_check, delete_orphaned_slot_links, drop_partitions_before,
+                           ensure_partitions, list_partitions, partition_name)
+from .search import get_point_from_address, salon_search_queryset
+from .search_cache import SearchCache, get_search_cache, normalize_search_query
+from .serializers import GeneratedTimeSlotsExportSerializer, SalonExportSerializer, SalonSerializer
+from .versioning import bump_salon_versions
+from .benchmarks import compare_with_baseline
+from .synthetic import delete_synthetic_data, generate_synthetic_data
+from .search_index import rebuild_all_search_documents, rebuild_search_documents
+from .pagination import KeysetPagination
+from .views import SalonSearchAPIView
+from .replicas import STICKY_COOKIE, ReplicaRouter, ReplicaRoutingMiddleware
+from .instrumentation import RequestInstrumentationMiddleware, span
 
-# Create your tests here.
+SEARCH_ADDRESS = 'Marszałkowska 1, 00-001 Warszawa'
+
+# Maximum queries per request, whatever the number of salons returned
+QUERY_BUDGETS = {
+    'salons-list': 3,       # salons, categories, services
+    'salons-detail': 4,     # salon version (ETag), salon, categories, services
+    'category-list': 3,     # catalog version (ETag), categories, services
+    'salon-search': 3,      # search, categories, services (geocoding served from memory)
+    'generatedtimeslots-next-available': 1,     # free slots (slot_free_idx)
+    'generatedtimeslots-free-per-day': 1,       # free slots (slot_free_idx)
+    # salon, savepoint, salon update, categories, services, category update, service update,
+    # category insert, service insert, release savepoint, response salon / categories / services
+    'salons-update': 13,
+}
+
+
+def create_salons(count):
+    # bulk_create skips Salon.save() (no geocoding queue) and the search document signals
+    salons = Salon.objects.bulk_create([
+        Salon(name=f'Studio {i}', address_city='Warszawa', address_postal_code='00-001',
+              address_street='Marszałkowska', address_number=str(i), about='Fryzjer',
+              location=Point(21.01, 52.23, srid=4326), distance_from_query=None)
+        for i in range(count)
+    ])
+    categories = Category.objects.bulk_create(
+        [Category(salon=salon, name=name) for salon in salons for name in ('Hair', 'Nails')])
+    Service.objects.bulk_create([
+        Service(salon_id=category.salon_id, category=category, title=f'{category.name} {i}',
+                description='', price=50, duration_minutes=30)
+        for category in categories for i in range(2)
+    ])
+    rebuild_all_search_documents()
+    return salons
+
+
+def add_operating_hours(salon, weekdays, close_time=time(10)):
+    # 30 minute slots from 9:00 on each of the weekdays
+    FixedOperatingHours.objects.bulk_create([
+        FixedOperatingHours(salon=salon, day_of_week=day, open_time=time(9), close_time=close_time, time_slot_length=30)
+        for day in weekdays
+    ])
+
+
+def create_bookable_salon(day, slots=6):
+    # A salon with `slots` free 30 minute slots on day, from 9:00
+    salon = create_salons(1)[0]
+    add_operating_hours(salon, [day.weekday()], close_time=time(9 + slots // 2))
+    materialize_time_slots(day, day)
+    return salon, list(GeneratedTimeSlots.objects.filter(salon=salon, date=day).order_by('time_from'))
+
+
+@override_settings(BOOKING_GEOCODER={
+    'UPSTREAM': 'BookingApp.geocoding.StubUpstream',
+    'UPSTREAM_OPTIONS': {'results': {SEARCH_ADDRESS: (52.23, 21.01)}},
+})
+class QueryBudgetTests(APITestCase):
+    def assertQueryBudget(self, name, url):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        self.assertLessEqual(len(queries), QUERY_BUDGETS[name], '\n'.join(query['sql'] for query in queries))
+        return response
+
+    def test_read_paths_stay_within_budget(self):
+        get_geocoder().geocode(SEARCH_ADDRESS)
+        total = 0
+        for count in (1, 10, 1000):
+            with self.subTest(salons=count):
+                salons = create_salons(count - total)
+                total = count
+                self.assertQueryBudget('salons-list', reverse('salons-list') + '?page_size=1000')
+                self.assertQueryBudget('salons-detail', reverse('salons-detail', args=[salons[0].pk]))
+                self.assertQueryBudget('category-list', reverse('category-list'))
+                self.assertQueryBudget('salon-search', reverse('salon-search') + '?keywords=studio')
+                self.assertQueryBudget('salon-search', reverse('salon-search') + f'?address={SEARCH_ADDRESS}&radius=5000')
+                self.assertQueryBudget('salon-search', reverse('salon-search') + f'?keywords=studio&address={SEARCH_ADDRESS}&radius=5000')
+                self.assertQueryBudget('generatedtimeslots-next-available',
+                                       reverse('generatedtimeslots-next-available') + f'?salon={salons[0].pk}')
+                self.assertQueryBudget('generatedtimeslots-free-per-day',
+                                       reverse('generatedtimeslots-free-per-day') + f'?salon={salons[0].pk}')
+
+
+    def test_nested_update_stays_within_budget(self):
+        for categories, services in ((1, 2), (10, 8), (50, 20)):
+            with self.subTest(categories=categories, services=services):
+                salon = create_salons(1)[0]
+                Category.objects.filter(salon=salon).delete()
+                for i in range(categories):
+                    category = Category.objects.create(salon=salon, name=f'Category {i}')
+                    Service.objects.bulk_create([
+                        Service(salon=salon, category=category, title=f'Service {j}', description='', price=50, duration_minutes=30)
+                        for j in range(services)
+                    ])
+
+                payload = {'categories': [
+                    {'id': category.pk, 'name': f'{category.name} (edited)', 'services': [
+                        {'id': service.pk, 'title': service.title, 'description': '', 'price': '60.00', 'duration_minutes': 45}
+                        for service in category.services.all()
+                    ] + [{'title': 'New service', 'description': '', 'price': '10.00', 'duration_minutes': 15}]}
+                    for category in Category.objects.filter(salon=salon).prefetch_related('services')
+                ] + [{'name': 'New category', 'services': [
+                    {'title': 'New service', 'description': '', 'price': '10.00', 'duration_minutes': 15}]}]}
+
+                url = reverse('salons-detail', args=[salon.pk])
+                with CaptureQueriesContext(connection) as queries:
+                    response = self.client.patch(url, payload, format='json')
+                self.assertEqual(response.status_code, 200, response.data)
+                self.assertLessEqual(len(queries), QUERY_BUDGETS['salons-update'], '\n'.join(query['sql'] for query in queries))
+
+                self.assertEqual(Category.objects.filter(salon=salon).count(), categories + 1)
+                self.assertEqual(Service.objects.filter(category__salon=salon).count(), categories * (services + 1) + 1)
+                self.assertEqual(Service.objects.filter(category__salon=salon, price=60, duration_minutes=45,
+                                                        duration_temp=timedelta(minutes=45)).count(), categories * services)
+                self.assertEqual(Service.objects.filter(category__salon=salon, title='New service',
+                                                        duration_temp=timedelta(minutes=15)).count(), categories + 1)
+                self.assertEqual(len(response.data['categories']), categories + 1)
+
+
+@override_settings(BOOKING_GEOCODER={
+    'UPSTREAM': 'BookingApp.geocoding.StubUpstream',
+    'UPSTREAM_OPTIONS': {'results': {SEARCH_ADDRESS: (52.23, 21.01)}},
+})
+class RadiusSearchTests(TestCase):
+    def test_distances_are_meters_on_longitude_first_points(self):
+        near, north, far_east = create_salons(3)
+        # 0.01 degree of latitude is about 1112 m; a longitude beyond 90 must not break the geography cast
+        Salon.objects.filter(pk=north.pk).update(location=Point(21.01, 52.24, srid=4326))
+        Salon.objects.filter(pk=far_east.pk).update(location=Point(151.2, -33.87, srid=4326))
+
+        point = get_point_from_address(SEARCH_ADDRESS)
+        self.assertEqual((point.x, point.y), (21.01, 52.23))
+        salons = list(salon_search_queryset('', SEARCH_ADDRESS, '5000', point))
+        self.assertEqual([salon.pk for salon in salons], [near.pk, north.pk])
+        self.assertLess(salons[0].distance.m, 1)
+        self.assertAlmostEqual(salons[1].distance.m, 1112, delta=5)
+
+    def test_invalid_radius_is_rejected_before_the_cache(self):
+        create_salons(1)
+        misses = get_search_cache().stats()['misses']
+        for radius in ('abc', '-5', '0', 'nan', 'inf'):
+            response = self.client.get(reverse('salon-search'), {'address': SEARCH_ADDRESS, 'radius': radius})
+            self.assertEqual(response.status_code, 400, radius)
+        self.assertEqual(get_search_cache().stats()['misses'], misses)
+        self.assertEqual(self.client.get(reverse('salon-search'), {'address': SEARCH_ADDRESS, 'radius': ' 5000 '}).status_code, 200)
+
+
+class FreeSlotSearchTests(APITestCase):
+    def setUp(self):
+        self.day = date.today() + timedelta(days=7)
+        # Free from 9:00 to 12:00 but for the slots taken below; far is about 11 km north
+        (self.near, near_slots), (self.north, north_slots), (far, _) = (create_bookable_salon(self.day) for _ in range(3))
+        Salon.objects.filter(pk=self.north.pk).update(location=Point(21.01, 52.24, srid=4326))
+        Salon.objects.filter(pk=far.pk).update(location=Point(21.01, 52.33, srid=4326))
+        # near: 9:00 | 10:00-11:00 | 11:30, north: 9:00-10:00 | 10:30-12:00
+        taken = [near_slots[1], near_slots[4], north_slots[2]]
+        GeneratedTimeSlots.objects.filter(pk__in=[slot.pk for slot in taken]).update(is_available=False)
+
+    def search(self, duration, radius=5000):
+        response = self.client.get(reverse('salon-free-slot-search'), {
+            'lat': 52.23, 'lon': 21.01, 'radius': radius, 'duration': duration, 'date': self.day.isoformat()})
+        self.assertEqual(response.status_code, 200)
+        return [(salon['id'], salon['earliest_start']) for salon in response.json()]
+
+    def assertFreeRuns(self):
+        near, north = self.near.pk, self.north.pk
+        self.assertEqual(self.search(30), [(near, '09:00:00'), (north, '09:00:00')])
+        # A run is long enough when its slots add up to the duration, rounded up to whole slots
+        self.assertEqual(self.search(45), [(near, '10:00:00'), (north, '09:00:00')])
+        self.assertEqual(self.search(60), [(near, '10:00:00'), (north, '09:00:00')])
+        self.assertEqual(self.search(90), [(north, '10:30:00')])
+        self.assertEqual(self.search(120), [])
+        self.assertEqual(len(self.search(30, radius=20000)), 3)
+
+    def test_salons_with_a_long_enough_free_run(self):
+        self.assertFreeRuns()
+
+    @override_settings(BOOKING_SLOT_MODE='on_demand')
+    def test_on_demand_runs_are_computed_from_the_operating_hours(self):
+        # Only the taken slots are stored
+        GeneratedTimeSlots.objects.filter(is_available=True).delete()
+        self.assertFreeRuns()
+
+    def test_invalid_parameters(self):
+        url = reverse('salon-free-slot-search')
+        for params in ({'lat': 52.23, 'lon': 21.01, 'duration': 30}, {'lat': 52.23, 'radius': 5000, 'duration': 30},
+                       {'lat': 52.23, 'lon': 21.01, 'radius': 0, 'duration': 30},
+                       {'lat': 52.23, 'lon': 21.01, 'radius': 'nan', 'duration': 30},
+                       {'lat': 52.23, 'lon': 21.01, 'radius': 5000, 'duration': 'long'}):
+            self.assertEqual(self.client.get(url, params).status_code, 400, params)
+
+
+class GeocoderTests(TestCase):
+    def setUp(self):
+        self.upstream = StubUpstream({SEARCH_ADDRESS: (52.23, 21.01), 'Puławska 1, Warszawa': (52.2, 21.02)})
+
+    def test_lookups_go_through_memory_then_the_table(self):
+        geocoder = Geocoder(self.upstream)
+        self.assertEqual(geocoder.geocode(SEARCH_ADDRESS), (52.23, 21.01))
+        # Spelled differently, same normalized key
+        self.assertEqual(geocoder.geocode(f'  {SEARCH_ADDRESS.upper()}.'), (52.23, 21.01))
+        self.assertEqual(self.upstream.calls, 1)
+        self.assertTrue(GeocodeCacheEntry.objects.filter(key=normalize_address(SEARCH_ADDRESS)).exists())
+
+        # Another process (empty memory) reads the table
+        other = Geocoder(self.upstream)
+        self.assertEqual(other.geocode(SEARCH_ADDRESS), (52.23, 21.01))
+        self.assertEqual(self.upstream.calls, 1)
+        self.assertEqual((geocoder.stats()['misses'], geocoder.stats()['memory_hits']), (1, 1))
+        self.assertEqual(other.stats()['db_hits'], 1)
+
+    def test_memory_keeps_the_most_recently_used(self):
+        geocoder = Geocoder(self.upstream, lru_size=2)
+        for address in (SEARCH_ADDRESS, 'Puławska 1, Warszawa', SEARCH_ADDRESS, 'Nowhere 1'):
+            geocoder.geocode(address)
+        self.assertEqual(geocoder.stats()['memory_entries'], 2)
+
+        geocoder.geocode(SEARCH_ADDRESS)
+        geocoder.geocode('Puławska 1, Warszawa')
+        stats = geocoder.stats()
+        self.assertEqual((stats['memory_hits'], stats['db_hits'], stats['misses']), (2, 1, 3))
+
+    def test_not_found_is_cached_for_the_negative_ttl(self):
+        geocoder = Geocoder(self.upstream, negative_ttl=timedelta(hours=1))
+        self.assertIsNone(geocoder.geocode('Nowhere 1'))
+        self.assertIsNone(geocoder.geocode('Nowhere 1'))
+        self.assertIsNone(Geocoder(self.upstream).geocode('Nowhere 1'))
+        self.assertEqual(self.upstream.calls, 1)
+        entry = GeocodeCacheEntry.objects.get(key='nowhere 1')
+        self.assertIsNone(entry.latitude)
+        self.assertLess(entry.expires_at, timezone.now() + timedelta(hours=1, minutes=1))
+
+        # Once expired the upstream is asked again
+        GeocodeCacheEntry.objects.filter(pk=entry.pk).update(expires_at=timezone.now() - timedelta(seconds=1))
+        self.assertIsNone(Geocoder(self.upstream).geocode('Nowhere 1'))
+        self.assertEqual(self.upstream.calls, 2)
+
+    def test_concurrent_async_lookups_share_one_upstream_call(self):
+        geocoder = Geocoder(StubUpstream({SEARCH_ADDRESS: (52.23, 21.01)}, delay=0.1))
+
+        async def lookups():
+            return await asyncio.gather(*(geocoder.ageocode(SEARCH_ADDRESS) for _ in range(4)))
+
+        self.assertEqual(async_to_sync(lookups)(), [(52.23, 21.01)] * 4)
+        self.assertEqual(geocoder.upstream.calls, 1)
+        self.assertEqual(geocoder.stats()['coalesced'], 3)
+
+
+class GeocoderCoalescingTests(TransactionTestCase):
+    def test_concurrent_lookups_share_one_upstream_call(self):
+        geocoder = Geocoder(StubUpstream({SEARCH_ADDRESS: (52.23, 21.01)}, delay=0.2))
+
+        def lookup(_):
+            try:
+                return geocoder.geocode(SEARCH_ADDRESS)
+            finally:
+                connection.close()
+
+        with ThreadPoolExecutor(4) as pool:
+            self.assertEqual(list(pool.map(lookup, range(4))), [(52.23, 21.01)] * 4)
+        self.assertEqual(geocoder.upstream.calls, 1)
+        self.assertEqual(geocoder.stats()['coalesced'], 3)
+
+
+@override_settings(BOOKING_GEOCODER={
+    'UPSTREAM': 'BookingApp.geocoding.StubUpstream',
+    'UPSTREAM_OPTIONS': {'results': {SEARCH_ADDRESS: (52.23, 21.01)}},
+})
+class GeocodeQueueTests(TestCase):
+    def setUp(self):
+        # A fresh geocoder (empty memory, no upstream calls) per test
+        reset_geocoder('BOOKING_GEOCODER')
+
+    @patch('BookingApp.geocoding.time.sleep')
+    def test_only_upstream_calls_are_rate_limited(self, sleep):
+        salons = create_salons(4)
+        # The third salon has the address of the second one (SEARCH_ADDRESS)
+        Salon.objects.filter(pk=salons[2].pk).update(address_number='1')
+        Salon.objects.update(error_code=GEOCODE_PENDING, geocode_retry_at=timezone.now())
+        self.assertEqual(geocode_pending_salons(rate=1), {0: 2, 1: 2})
+        self.assertEqual(get_geocoder().upstream.calls, 3)
+        self.assertEqual(sleep.call_count, 2)
+
+        # Answered from the cache: no waiting
+        self.assertEqual(geocode_pending_salons(rate=1, salon_ids=[salon.pk for salon in salons]), {0: 2, 1: 2})
+        self.assertEqual((get_geocoder().upstream.calls, sleep.call_count), (3, 2))
+
+    def test_failed_lookups_are_retried_with_backoff(self):
+        salon = create_salons(1)[0]
+        Salon.objects.update(error_code=GEOCODE_PENDING, geocode_retry_at=timezone.now())
+        for attempt, error_code in enumerate((2, 3, 4), 1):
+            with patch.object(Salon, 'geocode_address', return_value=(None, None, error_code)):
+                self.assertEqual(geocode_pending_salons(rate=0), {error_code: 1})
+                # Not due again until the backoff has passed
+                self.assertEqual(geocode_pending_salons(rate=0), {})
+            salon.refresh_from_db()
+            self.assertEqual((salon.error_code, salon.geocode_attempts), (error_code, attempt))
+            backoff = GEOCODE_BACKOFF * 2 ** (attempt - 1)
+            self.assertTrue(backoff - timedelta(seconds=10) < salon.geocode_retry_at - timezone.now() <= backoff)
+            Salon.objects.update(geocode_retry_at=timezone.now())
+
+        Salon.objects.update(geocode_attempts=GEOCODE_MAX_ATTEMPTS)
+        self.assertEqual(geocode_pending_salons(rate=0), {})
+
+        Salon.objects.update(geocode_attempts=3, address_number='1')
+        self.assertEqual(geocode_pending_salons(rate=0), {0: 1})
+        salon.refresh_from_db()
+        self.assertEqual((salon.geocode_attempts, salon.geocode_retry_at), (0, None))
+        self.assertEqual((salon.location.x, salon.location.y), (21.01, 52.23))
+
+    def test_all_geocodes_every_salon_not_placed_once(self):
+        not_found, placed, failed = create_salons(3)
+        Salon.objects.filter(pk=not_found.pk).update(error_code=1)
+        # Out of attempts, still included
+        Salon.objects.filter(pk=failed.pk).update(error_code=4, geocode_attempts=GEOCODE_MAX_ATTEMPTS, address_number='1')
+        output = io.StringIO()
+        call_command('geocode_salons', '--all', '--batch-size', '1', '--rate', '0', stdout=output)
+        self.assertIn('Geocoded 2 salons', output.getvalue())
+        self.assertEqual(dict(Salon.objects.values_list('pk', 'error_code')), {placed.pk: 0, not_found.pk: 1, failed.pk: 0})
+        self.assertEqual(get_geocoder().upstream.calls, 2)
+
+
+class GeocodeLeaseTests(TransactionTestCase):
+    def test_workers_skip_salons_leased_or_locked_by_others(self):
+        first, second, third = create_salons(3)
+        Salon.objects.update(error_code=GEOCODE_PENDING, geocode_retry_at=timezone.now())
+
+        def lease():
+            try:
+                return [salon.pk for salon in _lease_salons(10, None)]
+            finally:
+                connection.close()
+
+        with ThreadPoolExecutor(1) as pool:
+            with transaction.atomic():
+                # Another worker holds the first salon
+                Salon.objects.select_for_update().get(pk=first.pk)
+                self.assertEqual(pool.submit(lease).result(), [second.pk, third.pk])
+            # Leased salons are not due until their lease runs out
+            self.assertEqual(pool.submit(lease).result(), [first.pk])
+            self.assertEqual(pool.submit(lease).result(), [])
+
+
+@override_settings(BOOKING_SEARCH_CACHE={'CACHE': 'default', 'TIMEOUT': 60})
+class SearchCacheTests(APITestCase):
+    def setUp(self):
+        caches['default'].clear()
+
+    def search(self, query):
+        response = self.client.get(reverse('salon-search') + query)
+        self.assertEqual(response.status_code, 200)
+        return sorted(salon['name'] for salon in json.loads(response.content))
+
+    def test_salon_writes_change_the_next_search(self):
+        salon = create_salons(2)[0]
+        before = get_search_cache().stats()
+        self.assertEqual(self.search('?keywords=studio'), ['Studio 0', 'Studio 1'])
+        # The same normalized query is served from the cache
+        self.assertEqual(self.search('?keywords=%20STUDIO%20'), ['Studio 0', 'Studio 1'])
+        self.assertEqual(get_search_cache().stats()['hits'], before['hits'] + 1)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            salon.name = 'Renamed'
+            salon.save(update_fields=['name'])
+        self.assertEqual(self.search('?keywords=studio'), ['Studio 1'])
+        self.assertEqual(self.search('?keywords=renamed'), ['Renamed'])
+        self.assertEqual(get_search_cache().stats()['misses'], before['misses'] + 3)
+
+    def test_rebuilt_documents_invalidate_once_committed(self):
+        salon = create_salons(1)[0]
+        invalidations = get_search_cache().stats()['invalidations']
+        with self.captureOnCommitCallbacks(execute=True):
+            rebuild_search_documents([salon.pk])
+            import_salons([json.dumps(IMPORT_RECORD)])
+            # Searches until the commit may still cache the old rows, under the old generation
+            self.assertEqual(get_search_cache().stats()['invalidations'], invalidations)
+        self.assertEqual(get_search_cache().stats()['invalidations'], invalidations + 1)
+
+
+@override_settings(BOOKING_GEOCODER={
+    'UPSTREAM': 'BookingApp.geocoding.StubUpstream',
+    'UPSTREAM_OPTIONS': {'results': {SEARCH_ADDRESS: (52.23, 21.01)}},
+})
+class AsyncSalonSearchTests(TestCase):
+    def setUp(self):
+        caches['default'].clear()
+
+    def test_async_view_shares_the_cache_and_bytes_of_the_sync_view(self):
+        create_salons(2)
+        client = AsyncClient()
+        for fast in (False, True):
+            with self.subTest(fast=fast), self.settings(BOOKING_FAST_SERIALIZATION=fast):
+                caches['default'].clear()
+                before = get_search_cache().stats()
+                query = {'keywords': 'studio', 'address': SEARCH_ADDRESS, 'radius': '5000'}
+                # Sync ORM calls on the event loop raise SynchronousOnlyOperation
+                response = async_to_sync(client.get)(reverse('salon-search-async'), query)
+                self.assertEqual(response.status_code, 200)
+                self.assertEqual(sorted(salon['name'] for salon in json.loads(response.content)), ['Studio 0', 'Studio 1'])
+
+                # The sync view is served the bytes the async one cached
+                cached = self.client.get(reverse('salon-search'), dict(query, keywords=' STUDIO '))
+                self.assertEqual(cached.content, response.content)
+                stats = get_search_cache().stats()
+                self.assertEqual((stats['misses'], stats['hits']), (before['misses'] + 1, before['hits'] + 1))
+
+    def test_invalid_radius_is_rejected(self):
+        response = async_to_sync(AsyncClient().get)(reverse('salon-search-async'), {'address': SEARCH_ADDRESS, 'radius': '-5'})
+        self.assertEqual(response.status_code, 400)
+
+
+@override_settings(CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache', 'LOCATION': 'search-cache-tests'}})
+class SearchCacheLockTests(SimpleTestCase):
+    query = normalize_search_query({'keywords': 'studio'})
+
+    def search_cache(self, wait):
+        search_cache = SearchCache(wait=wait)
+        search_cache.cache.clear()
+        return search_cache, search_cache.key(self.query)
+
+    def test_a_miss_computes_once_and_releases_its_lock(self):
+        search_cache, key = self.search_cache(wait=1)
+        compute = Mock(return_value=b'[]')
+        self.assertEqual(search_cache.get_or_compute(self.query, compute), b'[]')
+        self.assertEqual(search_cache.get_or_compute(self.query, compute), b'[]')
+        compute.assert_called_once()
+        self.assertIsNone(search_cache.cache.get(f'{key}:lock'))
+
+    def test_waiters_get_the_result_of_the_computing_request(self):
+        search_cache, key = self.search_cache(wait=1)
+        # Another request holds the lock and stores its result while this one waits
+        search_cache.cache.add(f'{key}:lock', 1, 10)
+        compute = Mock(return_value=b'[]')
+        with patch('BookingApp.search_cache.time.sleep', side_effect=lambda seconds: search_cache.cache.set(key, b'["other"]')):
+            self.assertEqual(search_cache.get_or_compute(self.query, compute), b'["other"]')
+        compute.assert_not_called()
+        self.assertEqual(search_cache.stats()['coalesced'], 1)
+
+    def test_waiters_compute_themselves_when_the_wait_runs_out(self):
+        search_cache, key = self.search_cache(wait=0)
+        search_cache.cache.add(f'{key}:lock', 1, 10)
+        compute = Mock(return_value=b'[]')
+        self.assertEqual(search_cache.get_or_compute(self.query, compute), b'[]')
+        compute.assert_called_once()
+        self.assertEqual(search_cache.stats()['wait_timeouts'], 1)
+        # The lock is the other request's to release
+        self.assertEqual(search_cache.cache.get(f'{key}:lock'), 1)
+
+
+class RatingSummaryTests(TestCase):
+    def summary(self, salon):
+        summary = SalonRatingSummary.objects.get(salon=salon)
+        return summary.review_count, summary.rating_average, summary.histogram
+
+    def test_reviews_keep_the_summary_up_to_date(self):
+        first, second = create_salons(2)
+        review = Review.objects.create(salon=first, user_id='a', rating=5)
+        Review.objects.create(salon=first, user_id='b', rating=2)
+        self.assertEqual(self.summary(first), (2, 3.5, [0, 1, 0, 0, 1]))
+
+        review.rating = 4
+        review.save()
+        self.assertEqual(self.summary(first), (2, 3.0, [0, 1, 0, 1, 0]))
+
+        # Moving a review takes it out of one summary and into the other
+        review.salon = second
+        review.save()
+        self.assertEqual(self.summary(first), (1, 2.0, [0, 1, 0, 0, 0]))
+        self.assertEqual(self.summary(second), (1, 4.0, [0, 0, 0, 1, 0]))
+        self.assertEqual(SalonRatingSummary.objects.get(salon=second).last_review_at, review.created_at)
+
+        review.delete()
+        self.assertEqual(self.summary(second), (0, None, [0, 0, 0, 0, 0]))
+        self.assertIsNone(SalonRatingSummary.objects.get(salon=second).last_review_at)
+
+    def test_rebuild_matches_the_incremental_summary(self):
+        salon = create_salons(1)[0]
+        for rating in (1, 3, 5, 5):
+            Review.objects.create(salon=salon, user_id='a', rating=rating)
+        incremental = self.summary(salon)
+        SalonRatingSummary.objects.all().delete()
+        SalonRatingSummary.rebuild()
+        self.assertEqual(self.summary(salon), incremental)
+
+
+class FastRenderTests(TestCase):
+    def test_fast_path_matches_the_serializer(self):
+        rated, unrated, never_reviewed = create_salons(3)
+        Review.objects.create(salon=rated, user_id='a', rating=5)
+        Review.objects.create(salon=rated, user_id='b', rating=2)
+        # Leaves a summary with no reviews: NULL average and last review
+        Review.objects.create(salon=unrated, user_id='c', rating=4).delete()
+
+        salons = salon_search_queryset('studio', '', '', ordering='rating')
+        with override_settings(BOOKING_FAST_SERIALIZATION=False):
+            expected = SalonSearchAPIView.render(salons.all())
+        with override_settings(BOOKING_FAST_SERIALIZATION=True):
+            self.assertEqual(SalonSearchAPIView.render(salons.all()), expected)
+
+        ratings = {salon['id']: salon['rating'] for salon in json.loads(expected)}
+        self.assertEqual(ratings[unrated.pk], {'review_count': 0, 'rating_average': None, 'histogram': [0] * 5, 'last_review_at': None})
+        self.assertIsNone(ratings[never_reviewed.pk])
+
+
+class ConditionalGetTests(APITestCase):
+    def assertNotModified(self, url, etag, modified=False):
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200 if modified else 304)
+        return response
+
+    def test_salon_detail_changes_with_the_salon(self):
+        salon = create_salons(1)[0]
+        url = reverse('salons-detail', args=[salon.pk])
+        etag = self.client.get(url)['ETag']
+        self.assertNotModified(url, etag)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.patch(url, {'name': 'Renamed'}, format='json')
+        response = self.assertNotModified(url, etag, modified=True)
+        self.assertEqual(response.data['name'], 'Renamed')
+        self.assertNotModified(url, response['ETag'])
+
+    def test_saves_keep_concurrent_version_bumps(self):
+        salon = create_salons(1)[0]
+        loaded, stale = Salon.objects.get(pk=salon.pk), Salon.objects.get(pk=salon.pk)
+        # Committed by another request after both were loaded
+        bump_salon_versions([salon.pk])
+
+        with self.captureOnCommitCallbacks(execute=True):
+            serializer = SalonSerializer(loaded, data={'name': 'Renamed'}, partial=True)
+            serializer.is_valid(raise_exception=True)
+            serializer.save()
+        salon.refresh_from_db()
+        self.assertEqual((salon.name, salon.version), ('Renamed', 3))
+
+        stale.about = 'Barber'
+        with self.captureOnCommitCallbacks(execute=True):
+            stale.save()
+        salon.refresh_from_db()
+        self.assertEqual((salon.name, salon.about, salon.version), ('Renamed', 'Barber', 4))
+
+    def test_categories_change_with_categories_of_no_salon(self):
+        create_salons(1)
+        with self.captureOnCommitCallbacks(execute=True):
+            category = Category.objects.create(salon=None, name='Loose')
+        url = reverse('category-list')
+        etag = self.client.get(url)['ETag']
+        self.assertNotModified(url, etag)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.patch(reverse('category-detail', args=[category.pk]), {'name': 'Renamed'}, format='json')
+        self.assertNotModified(url, etag, modified=True)
+
+
+class BookingTestMixin:
+    def setUp(self):
+        self.salon, self.slots = create_bookable_salon(date.today() + timedelta(days=7))
+        self.service = Service.objects.filter(salon=self.salon).first()
+
+    def book(self, *slots):
+        return self.client.post(reverse('appointment-list'), {
+            'salon': self.salon.pk, 'customer': 'customer', 'services': [self.service.pk],
+            'timeslots': [slot.pk for slot in slots],
+        }, format='json')
+
+    def available(self, *slots):
+        return list(GeneratedTimeSlots.objects.filter(pk__in=[slot.pk for slot in slots]).order_by('time_from').values_list(
+            'is_available', flat=True))
+
+
+class SlotReservationTests(BookingTestMixin, APITestCase):
+    def test_second_claim_of_a_slot_conflicts(self):
+        self.assertEqual(self.book(self.slots[0]).status_code, 201)
+        with self.assertRaises(SlotConflict) as raised:
+            claim_time_slots(self.salon.pk, [self.slots[0].pk])
+        self.assertEqual(raised.exception.status_code, 409)
+
+        # Another request claims the slot between this one's validation and its claim
+        def claimed_concurrently(salon_id, slot_ids):
+            claim_time_slots(salon_id, slot_ids)
+            return claim_time_slots(salon_id, slot_ids)
+
+        with patch('BookingApp.serializers.claim_time_slots', side_effect=claimed_concurrently):
+            response = self.book(self.slots[1])
+        self.assertEqual(response.status_code, 409)
+        self.assertEqual(response.json()['unavailable_timeslots'], [str(self.slots[1].pk)])
+        self.assertEqual(Appointment.objects.count(), 1)
+
+    def test_partial_claim_is_rolled_back(self):
+        claim_time_slots(self.salon.pk, [self.slots[1].pk])
+        with self.assertRaises(SlotConflict) as raised:
+            run_reservation(lambda: claim_time_slots(self.salon.pk, [self.slots[0].pk, self.slots[1].pk]))
+        self.assertEqual(raised.exception.detail['unavailable_timeslots'], [str(self.slots[1].pk)])
+        self.assertEqual(self.available(self.slots[0], self.slots[1]), [True, False])
+
+
+class BulkAppointmentTests(BookingTestMixin, APITestCase):
+    def bulk(self, *operations):
+        response = self.client.post(reverse('appointment-bulk'), {'operations': list(operations)}, format='json')
+        self.assertEqual(response.status_code, 200, response.data)
+        return response.data
+
+    def test_results_per_item(self):
+        cancelled, finished, moved = (self.book(slot).data['id'] for slot in self.slots[:3])
+        response = self.bulk(
+            {'id': cancelled, 'action': 'cancel'},
+            {'id': finished, 'action': 'status', 'status': 'F'},
+            {'id': moved, 'action': 'reschedule', 'timeslots': [self.slots[4].pk]},
+            {'id': 0, 'action': 'cancel'},
+        )
+        self.assertEqual((response['succeeded'], response['failed']), (2, 2))
+        results = response['results']
+        self.assertEqual((results[0]['success'], results[0]['status']), (True, 'X'))
+        self.assertEqual(results[1], {'id': finished, 'action': 'status', 'success': False,
+                                      'error': 'Cannot change status from P to F.'})
+        self.assertEqual((results[2]['success'], results[2]['timeslots']), (True, [self.slots[4].pk]))
+        self.assertEqual(results[3]['error'], 'Appointment does not exist.')
+
+        # The cancelled and the left slot are free again, the new one is taken
+        self.assertEqual(self.available(*self.slots[:5]), [True, False, True, True, False])
+        self.assertEqual(Appointment.objects.get(pk=finished).status, 'P')
+        self.assertEqual(list(Appointment.objects.get(pk=moved).timeslots.values_list('pk', flat=True)), [self.slots[4].pk])
+
+    def test_rejected_transitions_and_taken_slots_change_nothing(self):
+        first, second = (self.book(slot).data['id'] for slot in self.slots[:2])
+        self.bulk({'id': first, 'action': 'cancel'})
+
+        results = self.bulk(
+            {'id': first, 'action': 'status', 'status': 'C'},
+            {'id': second, 'action': 'reschedule', 'timeslots': [self.slots[0].pk]},
+        )['results']
+        self.assertEqual(results[0]['error'], 'Cannot change status from X to C.')
+        self.assertTrue(results[1]['success'])
+
+        third = self.book(self.slots[2]).data['id']
+        results = self.bulk({'id': third, 'action': 'reschedule', 'timeslots': [self.slots[0].pk]})['results']
+        self.assertEqual(results[0]['error'], SlotConflict.default_detail)
+        self.assertEqual(list(Appointment.objects.get(pk=third).timeslots.values_list('pk', flat=True)), [self.slots[2].pk])
+        self.assertEqual(self.available(*self.slots[:3]), [False, True, False])
+
+
+class ReservationRetryTests(TransactionTestCase):
+    @patch('BookingApp.booking.time.sleep')
+    def test_lock_failures_are_retried(self, sleep):
+        attempts = []
+
+        def reserve():
+            attempts.append(len(attempts))
+            if len(attempts) < RESERVATION_ATTEMPTS:
+                raise OperationalError('deadlock detected')
+            return 'reserved'
+
+        self.assertEqual(run_reservation(reserve), 'reserved')
+        self.assertEqual(len(attempts), RESERVATION_ATTEMPTS)
+        self.assertEqual(sleep.call_count, RESERVATION_ATTEMPTS - 1)
+
+        failing = Mock(side_effect=OperationalError('deadlock detected'))
+        with self.assertRaises(OperationalError):
+            run_reservation(failing)
+        self.assertEqual(failing.call_count, RESERVATION_ATTEMPTS)
+
+        # A conflict is an answer, not a transient failure
+        conflicting = Mock(side_effect=SlotConflict([1]))
+        with self.assertRaises(SlotConflict):
+            run_reservation(conflicting)
+        self.assertEqual(conflicting.call_count, 1)
+
+    def test_overlapping_claims_wait_instead_of_deadlocking(self):
+        salon, slots = create_bookable_salon(date.today() + timedelta(days=7))
+        ids = [slot.pk for slot in slots]
+        start = threading.Barrier(2)
+
+        def claim(slot_ids):
+            try:
+                start.wait()
+                return sorted(run_reservation(lambda: claim_time_slots(salon.pk, slot_ids)))
+            except SlotConflict as conflict:
+                return [int(slot_id) for slot_id in conflict.detail['unavailable_timeslots']]
+            finally:
+                connection.close()
+
+        with ThreadPoolExecutor(2) as pool:
+            results = sorted(pool.map(claim, [ids[:4], ids[4:0:-1]]), key=len)
+        # One claim gets all of its slots, the other conflicts on the shared ones and claims nothing
+        self.assertEqual(results[0], ids[1:4])
+        self.assertIn(results[1], (ids[:4], ids[1:5]))
+        self.assertEqual(GeneratedTimeSlots.objects.filter(pk__in=ids, is_available=False).count(), 4)
+
+
+@override_settings(BOOKING_SLOT_MODE='materialized')
+class TimeSlotGenerationTests(TestCase):
+    def times(self, slots):
+        return [(slot.time_from.strftime('%H:%M'), slot.time_to.strftime('%H:%M')) for slot in slots]
+
+    def test_slots_end_by_the_closing_time(self):
+        day = date(2026, 3, 2)
+        self.assertEqual(self.times(iter_time_slots(1, day, time(9), time(10), 30)), [('09:00', '09:30'), ('09:30', '10:00')])
+        # A slot that would run past closing is not generated
+        self.assertEqual(self.times(iter_time_slots(1, day, time(9), time(10, 10), 20)),
+                         [('09:00', '09:20'), ('09:20', '09:40'), ('09:40', '10:00')])
+        self.assertEqual(list(iter_time_slots(1, day, time(9), time(9, 20), 30)), [])
+        self.assertEqual(list(iter_time_slots(1, day, time(9), time(10), 0)), [])
+
+    def test_slots_are_inserted_in_batches_and_reruns_skip_existing_ones(self):
+        salon = create_salons(1)[0]
+        day = date.today() + timedelta(days=1)
+        hours = UnFixedOperatingHours(salon=salon, date=day, open_time=time(9), close_time=time(11, 30), time_slot_length=30)
+        with patch('BookingApp.models.SLOT_BATCH_SIZE', 2), CaptureQueriesContext(connection) as queries:
+            self.assertEqual(bulk_insert_time_slots(hours.build_time_slots()), 5)
+        self.assertEqual(len([query for query in queries if query['sql'].startswith('INSERT')]), 3)
+
+        # Saving the hours generates the same slots again; the existing rows are kept
+        ids = set(GeneratedTimeSlots.objects.values_list('pk', flat=True))
+        hours.save()
+        FixedOperatingHours.objects.create(salon=salon, day_of_week=day.weekday(), open_time=time(9), close_time=time(12),
+                                           time_slot_length=30)
+        slots = GeneratedTimeSlots.objects.filter(salon=salon, date=day).order_by('time_from')
+        self.assertEqual(len(slots), 6)
+        self.assertTrue(ids < {slot.pk for slot in slots})
+        self.assertEqual(self.times(slots[5:]), [('11:30', '12:00')])
+
+
+@override_settings(BOOKING_SLOT_MODE='on_demand')
+class OnDemandSlotTests(APITestCase):
+    def test_listing_is_computed_page_by_page_without_writes(self):
+        salon = create_salons(1)[0]
+        day = date.today() + timedelta(days=1)
+        add_operating_hours(salon, [day.weekday()], close_time=time(11))
+        url = reverse('generatedtimeslots-list')
+        self.assertEqual(self.client.get(url).status_code, 400)
+
+        times, next_url = [], f'{url}?salon={salon.pk}&date={day.isoformat()}&page_size=3'
+        while next_url:
+            response = self.client.get(next_url)
+            self.assertEqual(response.status_code, 200)
+            times += [(slot['date'], slot['time_from']) for slot in response.data['results']]
+            next_url = response.data['next']
+        self.assertEqual(times, [(day.isoformat(), f'{hour:02d}:{minute:02d}:00') for hour in (9, 10) for minute in (0, 30)])
+        self.assertFalse(GeneratedTimeSlots.objects.exists())
+
+        response = self.client.post(reverse('generatedtimeslots-materialize'), {'salon': salon.pk, 'date': day.isoformat()}, format='json')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([slot['id'] for slot in response.data['slots']],
+                         list(GeneratedTimeSlots.objects.filter(salon=salon).order_by('time_from').values_list('pk', flat=True)))
+
+    def test_appointments_are_booked_by_their_start_time(self):
+        salon = create_salons(1)[0]
+        day = date.today() + timedelta(days=1)
+        add_operating_hours(salon, [day.weekday()], close_time=time(11))
+        services = list(Service.objects.filter(salon=salon).values_list('pk', flat=True)[:2])
+
+        def book(time_from):
+            return self.client.post(reverse('appointment-list'), {
+                'salon': salon.pk, 'customer': 'customer', 'services': services, 'date': day.isoformat(), 'time_from': time_from,
+            }, format='json')
+
+        # Two 30 minute services: the day is stored and the slots at 9:30 and 10:00 claimed
+        response = book('09:30')
+        self.assertEqual(response.status_code, 201, response.data)
+        booked = GeneratedTimeSlots.objects.filter(salon=salon, date=day, time_from__in=(time(9, 30), time(10)))
+        self.assertEqual(sorted(response.data['timeslots']), sorted(slot.pk for slot in booked))
+        self.assertEqual([slot.is_available for slot in booked], [False, False])
+        self.assertEqual(GeneratedTimeSlots.objects.filter(salon=salon, date=day).count(), 4)
+
+        # Overlapping a booking, off the slot grid, running past closing
+        for time_from in ('09:00', '09:15', '10:30'):
+            self.assertEqual(book(time_from).status_code, 400, time_from)
+        self.assertEqual(Appointment.objects.count(), 1)
+
+
+class KeysetPaginationTests(TestCase):
+    ordering = ('date', 'time_from', 'id')
+
+    def setUp(self):
+        # Two salons with the same slot times: ties on (date, time_from) are broken by id
+        self.day = date.today() + timedelta(days=7)
+        self.salons = [create_bookable_salon(self.day, slots=4)[0] for _ in range(2)]
+
+    def paginate(self, source, query, ordering=ordering):
+        paginator = KeysetPagination()
+        request = Request(RequestFactory().get('/timeslots/', query))
+        rows = paginator.paginate_queryset(source, request, view=SimpleNamespace(keyset_ordering=ordering))
+        return rows, paginator.get_paginated_data([])
+
+    def cursor(self, link):
+        return parse_qs(urlparse(link).query)['cursor'][0]
+
+    def walk(self, source, ordering=ordering, page_size=3):
+        # Every row page by page forwards, then again backwards from the last page
+        pages, query = [], {'page_size': page_size}
+        while True:
+            rows, links = self.paginate(source, query, ordering)
+            pages.append(rows)
+            if not links['next']:
+                break
+            query = {'page_size': page_size, 'cursor': self.cursor(links['next'])}
+        forward = [row for rows in pages for row in rows]
+
+        backward = []
+        while links['previous']:
+            rows, links = self.paginate(source, {'page_size': page_size, 'cursor': self.cursor(links['previous'])}, ordering)
+            backward = rows + backward
+        key = lambda row: tuple(getattr(row, name) for name in ordering)
+        self.assertEqual([key(row) for row in backward + pages[-1]], [key(row) for row in forward])
+        return forward
+
+    def test_pages_follow_the_ordering_with_ties_broken_by_id(self):
+        expected = list(GeneratedTimeSlots.objects.order_by(*self.ordering))
+        # Page ends fall between two slots with the same time
+        self.assertEqual(self.walk(GeneratedTimeSlots.objects.all()), expected)
+        self.assertEqual(self.walk(GeneratedTimeSlots.objects.all(), page_size=1), expected)
+
+    def test_cursors_encode_the_boundary_rows(self):
+        first, second, third = GeneratedTimeSlots.objects.order_by(*self.ordering)[:3]
+        rows, links = self.paginate(GeneratedTimeSlots.objects.all(), {'page_size': 2})
+        self.assertEqual(rows, [first, second])
+        self.assertIsNone(links['previous'])
+        cursor = json.loads(base64.urlsafe_b64decode(self.cursor(links['next'])))
+        self.assertEqual(cursor, {'v': [self.day.isoformat(), '09:00:00', str(second.pk)], 'r': 0})
+
+        rows, links = self.paginate(GeneratedTimeSlots.objects.all(), {'page_size': 2, 'cursor': self.cursor(links['next'])})
+        self.assertEqual(rows[0], third)
+        cursor = json.loads(base64.urlsafe_b64decode(self.cursor(links['previous'])))
+        self.assertEqual(cursor, {'v': [self.day.isoformat(), '09:30:00', str(third.pk)], 'r': 1})
+
+    def test_tampered_cursors_are_rejected(self):
+        def encode(cursor):
+            return base64.urlsafe_b64encode(json.dumps(cursor).encode()).decode()
+
+        for cursor in ('not a cursor', encode([1, 2, 3]), encode({'v': ['2026-01-01', '09:00:00'], 'r': 0}),
+                       encode({'v': ['yesterday', '09:00:00', '1'], 'r': 0}), encode({'v': ['2026-01-01', '09:00:00', '1']})):
+            with self.assertRaises(NotFound, msg=cursor):
+                self.paginate(GeneratedTimeSlots.objects.all(), {'cursor': cursor})
+        response = self.client.get(reverse('generatedtimeslots-list'), {'cursor': 'not a cursor'})
+        self.assertEqual(response.status_code, 404)
+
+    def test_lists_of_instances(self):
+        slots = list(GeneratedTimeSlots.objects.order_by('-id'))
+        self.assertEqual(self.walk(slots), sorted(slots, key=lambda slot: (slot.date, slot.time_from, slot.pk)))
+        self.assertEqual(self.paginate([], {}), ([], {'next': None, 'previous': None, 'results': []}))
+
+    @override_settings(BOOKING_SLOT_MODE='on_demand')
+    def test_computed_slots_are_expanded_from_the_cursor(self):
+        GeneratedTimeSlots.objects.all().delete()
+        source = AvailableSlots(None, self.day, self.day + timedelta(days=1))
+        times = [(slot.salon_id, slot.date, slot.time_from) for slot in self.walk(source, ('salon', 'date', 'time_from', 'id'))]
+        expected = [(slot.salon_id, slot.date, slot.time_from) for slot in iter_available_slots(None, self.day, self.day + timedelta(days=1))]
+        self.assertEqual(times, expected)
+        self.assertEqual(len(times), 8)
+
+
+@override_settings(BOOKING_SLOT_MODE='materialized')
+class DailyMaintenanceTests(TestCase):
+    def test_missed_days_are_caught_up_past_far_future_slots(self):
+        salon = create_salons(1)[0]
+        add_operating_hours(salon, range(7))
+        today = date(2026, 3, 2)
+        # The job last ran four days ago; a single day was opened far ahead since then
+        materialize_time_slots(today, today + timedelta(days=SLOT_HORIZON_DAYS - 4))
+        UnFixedOperatingHours.objects.create(salon=salon, date=today + timedelta(days=90), open_time=time(9),
+                                             close_time=time(10), time_slot_length=30)
+
+        result = run_daily_maintenance(today=today)
+        self.assertEqual(result['start_date'], today + timedelta(days=SLOT_HORIZON_DAYS - 3))
+        self.assertEqual(result['inserted'], 3 * 2)
+        days = GeneratedTimeSlots.objects.filter(salon=salon, date__lte=result['end_date']).values('date').distinct()
+        self.assertEqual(days.count(), SLOT_HORIZON_DAYS + 1)
+
+        # Nothing missing: only the last day is looked at
+        self.assertEqual(run_daily_maintenance(today=today)['start_date'], result['end_date'])
+
+
+class PartitionTests(TestCase):
+    # Scratch tables shaped like the partitioned slot table and Appointment.timeslots
+    table = 'scratch_slots'
+    through = ('scratch_slot_links', 'slot_id')
+    day = date(2026, 3, 2)
+
+    def setUp(self):
+        self.salon = create_salons(1)[0]
+        with connection.cursor() as cursor:
+            cursor.execute('CREATE SEQUENCE scratch_slots_seq')
+            cursor.execute(CREATE_TABLE_SQL.format(table=self.table, sequence='scratch_slots_seq', salons=Salon._meta.db_table))
+            cursor.execute('CREATE TABLE scratch_slots_default PARTITION OF scratch_slots DEFAULT')
+            cursor.execute('CREATE TABLE scratch_slot_links (id serial PRIMARY KEY, slot_id bigint NOT NULL)')
+            add_slot_link_check(cursor, self.table, *self.through)
+
+    def execute(self, sql, params=None):
+        with connection.cursor() as cursor:
+            cursor.execute(sql, params)
+            return [row[0] for row in cursor.fetchall()] if cursor.description else None
+
+    def add_slot(self, day):
+        return self.execute(
+            "INSERT INTO scratch_slots (salon_id, date, time_from, time_to, is_available, updated_at) "
+            "VALUES (%s, %s, '09:00', '09:30', TRUE, now()) RETURNING id", [self.salon.pk, day])[0]
+
+    def link(self, slot_id):
+        self.execute('INSERT INTO scratch_slot_links (slot_id) VALUES (%s)', [slot_id])
+
+    def test_ensure_partitions_moves_rows_out_of_the_default_partition(self):
+        stray = self.add_slot(self.day + timedelta(days=1))
+
+        self.assertEqual(ensure_partitions(self.day, self.day + timedelta(days=2), table=self.table), 3)
+        self.assertEqual(sorted(list_partitions(self.table)), [self.day + timedelta(days=i) for i in range(3)])
+        self.assertEqual(self.execute(f'SELECT id FROM {partition_name(self.table, self.day + timedelta(days=1))}'), [stray])
+        self.assertEqual(self.execute('SELECT id FROM scratch_slots_default'), [])
+        self.assertEqual(ensure_partitions(self.day, self.day + timedelta(days=2), table=self.table), 0)
+
+    def test_dropped_partitions_take_their_links(self):
+        ensure_partitions(self.day, self.day + timedelta(days=2), table=self.table)
+        old, detached, kept = [self.add_slot(self.day + timedelta(days=i)) for i in range(3)]
+        for slot_id in (old, detached, kept):
+            self.link(slot_id)
+
+        self.assertEqual(drop_partitions_before(self.day + timedelta(days=1), table=self.table, through=self.through),
+                         {self.salon.pk: 1})
+        self.assertEqual(drop_partitions_before(self.day + timedelta(days=2), table=self.table, through=self.through,
+                                                detach=True), {self.salon.pk: 1})
+        self.assertEqual(sorted(list_partitions(self.table)), [self.day + timedelta(days=2)])
+        self.assertEqual(self.execute('SELECT slot_id FROM scratch_slot_links'), [kept])
+        # Dropped, and detached but kept as a table
+        self.assertEqual(self.execute('SELECT to_regclass(%s)', [partition_name(self.table, self.day)]), [None])
+        self.assertEqual(self.execute('SELECT to_regclass(%s)::text', [partition_name(self.table, self.day + timedelta(days=1))]),
+                         [partition_name(self.table, self.day + timedelta(days=1))])
+
+    def test_links_to_missing_slots(self):
+        ensure_partitions(self.day, self.day, table=self.table)
+        slot_id = self.add_slot(self.day)
+        self.link(slot_id)
+        with self.assertRaises(IntegrityError), transaction.atomic():
+            self.execute('SET CONSTRAINTS ALL IMMEDIATE')
+            self.link(slot_id + 1)
+
+        # Raw deletes leave links behind, the daily maintenance clears them
+        self.execute('DELETE FROM scratch_slots WHERE id = %s', [slot_id])
+        self.assertEqual(delete_orphaned_slot_links(table=self.table, through=self.through), 1)
+        self.assertEqual(self.execute('SELECT slot_id FROM scratch_slot_links'), [])
+
+
+class ExportTests(APITestCase):
+    def lines(self, chunks):
+        return [json.loads(line) for chunk in chunks for line in chunk.decode().splitlines()]
+
+    def test_time_slots_stream_in_chunks(self):
+        salon, slots = create_bookable_salon(date.today() + timedelta(days=7), slots=6)
+        create_bookable_salon(date.today() + timedelta(days=7))
+
+        chunks = list(export_time_slots({'salon': salon.pk}, chunk_size=4))
+        self.assertEqual(len(chunks), 2)
+        self.assertTrue(all(chunk.endswith(b'\n') for chunk in chunks))
+        rows = self.lines(chunks)
+        self.assertEqual([row['id'] for row in rows], sorted(slot.pk for slot in slots))
+        self.assertEqual(list(rows[0]), list(GeneratedTimeSlotsExportSerializer.Meta.fields))
+        # Two full chunks, no empty third one
+        self.assertEqual(len(list(export_time_slots({'salon': salon.pk}, chunk_size=3))), 2)
+
+        response = self.client.get(reverse('export-timeslots') + f'?salon={salon.pk}')
+        self.assertEqual(response['Content-Type'], 'application/x-ndjson')
+        self.assertEqual(self.lines(response.streaming_content), rows)
+
+    def test_salons_stream_in_chunks(self):
+        salons = create_salons(5)
+        rows = self.lines(export_salons({}, chunk_size=2))
+        self.assertEqual([row['id'] for row in rows], [salon.pk for salon in salons])
+        self.assertEqual(list(rows[0]), list(SalonExportSerializer.Meta.fields))
+        self.assertEqual(len(rows[0]['categories']), 2)
+
+
+IMPORT_RECORD = {
+    'name': 'Imported', 'address_city': 'Warszawa', 'address_postal_code': '00-001', 'address_street': 'Puławska',
+    'address_number': '1', 'about': 'Fryzjer',
+    'categories': [{'name': 'Hair', 'services': [{'title': 'Cut', 'description': '', 'price': '50.00', 'duration_minutes': 30}]}],
+    'operating_hours': [{'day_of_week': 0, 'open_time': '09:00', 'close_time': '17:00'}],
+}
+
+
+class SalonImportTests(TestCase):
+    def record(self, number, **changes):
+        return dict(IMPORT_RECORD, name=f'Imported {number}', **changes)
+
+    def test_ndjson_reports_rejected_lines(self):
+        no_duration = [{'name': 'Hair', 'services': [{'title': 'Cut', 'description': '', 'price': '50.00'}]}]
+        lines = [json.dumps(self.record(1)), '{"name": ', '', json.dumps(self.record(4, categories=no_duration)),
+                 json.dumps(self.record(5))]
+
+        report = import_salons(lines, 'ndjson', chunk_size=2)
+        self.assertEqual((report['imported'], report['failed']), (2, 2))
+        self.assertEqual([error['line'] for error in report['errors']], [2, 4])
+        self.assertIn('duration_minutes', json.dumps(report['errors'][1]['errors']))
+
+        salons = Salon.objects.filter(name__startswith='Imported')
+        self.assertEqual(sorted(salons.values_list('name', flat=True)), ['Imported 1', 'Imported 5'])
+        self.assertTrue(all(salon.error_code == 5 for salon in salons))
+        self.assertEqual(Service.objects.filter(salon__in=salons, duration_minutes=30).count(), 2)
+
+    @override_settings(BOOKING_SLOT_MODE='materialized')
+    def test_csv_rolls_back_only_the_failing_chunk(self):
+        lines = io.StringIO()
+        writer = csv.DictWriter(lines, fieldnames=list(IMPORT_RECORD))
+        writer.writeheader()
+        for number in range(1, 5):
+            record = self.record(number)
+            writer.writerow({key: json.dumps(value) if key in ('categories', 'operating_hours') else value
+                             for key, value in record.items()})
+        lines.seek(0)
+
+        # The slot insert of the second chunk fails
+        with patch('BookingApp.importer.bulk_insert_time_slots', side_effect=[0, DatabaseError('slot insert failed')]):
+            report = import_salons(lines, 'csv', chunk_size=2)
+        self.assertEqual((report['imported'], report['failed']), (2, 2))
+        # CSV line numbers count the header
+        self.assertEqual([error['line'] for error in report['errors']], [4, 5])
+        self.assertEqual(sorted(Salon.objects.filter(name__startswith='Imported').values_list('name', flat=True)),
+                         ['Imported 1', 'Imported 2'])
+        self.assertEqual(FixedOperatingHours.objects.filter(salon__name__startswith='Imported').count(), 2)
+
+    def test_imported_salons_are_versioned_once_committed(self):
+        invalidations = get_search_cache().stats()['invalidations']
+        with self.captureOnCommitCallbacks(execute=True):
+            import_salons([json.dumps(self.record(1)), json.dumps(self.record(2))])
+            self.assertEqual(set(Salon.objects.filter(name__startswith='Imported').values_list('version', flat=True)), {1})
+        self.assertEqual(set(Salon.objects.filter(name__startswith='Imported').values_list('version', flat=True)), {2})
+        self.assertEqual(get_search_cache().stats()['invalidations'], invalidations + 1)
+
+
+@override_settings(BOOKING_REPLICAS={'ALIASES': ['replica_0'], 'STICKY_SECONDS': 10, 'RETRY_SECONDS': 30})
+class ReplicaRoutingTests(SimpleTestCase):
+    def route(self, method, cookies=None, write=None, router=None):
+        # The alias a read would use inside a request (after writing to the `write` model), and the response
+        router = router or ReplicaRouter()
+        reads = []
+
+        def view(request):
+            if write:
+                router.db_for_write(write)
+            reads.append(router.db_for_read(Salon))
+            return HttpResponse(status=201 if method == 'POST' else 200)
+
+        request = RequestFactory().generic(method, '/salons/')
+        request.COOKIES = dict(cookies or {})
+        response = ReplicaRoutingMiddleware(view)(request)
+        return reads[0], response
+
+    @patch.object(ReplicaRouter, '_reachable', return_value=True)
+    def test_safe_reads_use_a_replica(self, reachable):
+        alias, response = self.route('GET')
+        self.assertEqual(alias, 'replica_0')
+        self.assertNotIn(STICKY_COOKIE, response.cookies)
+        self.assertEqual(ReplicaRouter().db_for_read(Salon), 'default')  # outside a request
+
+    @patch.object(ReplicaRouter, '_reachable', return_value=True)
+    def test_writes_keep_the_client_on_the_primary(self, reachable):
+        alias, response = self.route('POST')
+        self.assertEqual(alias, 'default')
+        cookie = response.cookies[STICKY_COOKIE].value
+        self.assertEqual(self.route('GET', {STICKY_COOKIE: cookie})[0], 'default')
+
+        # A GET that writes reads its own writes
+        alias, response = self.route('GET', write=Salon)
+        self.assertEqual(alias, 'default')
+        self.assertIn(STICKY_COOKIE, response.cookies)
+
+    @patch.object(ReplicaRouter, '_reachable', return_value=True)
+    def test_geocode_cache_writes_pin_nothing(self, reachable):
+        alias, response = self.route('GET', write=GeocodeCacheEntry)
+        self.assertEqual(alias, 'replica_0')
+        self.assertNotIn(STICKY_COOKIE, response.cookies)
+
+    def test_unreachable_replica_falls_back_to_the_primary(self):
+        replica = Mock(ensure_connection=Mock(side_effect=OperationalError('replica down')))
+        router = ReplicaRouter()
+        with patch('BookingApp.replicas.connections', {'replica_0': replica}):
+            self.assertEqual(self.route('GET', router=router)[0], 'default')
+            self.assertEqual(self.route('GET', router=router)[0], 'default')
+        # Not retried until RETRY_SECONDS have passed
+        self.assertEqual(replica.ensure_connection.call_count, 1)
+
+
+class RequestInstrumentationTests(SimpleTestCase):
+    def respond(self, view=lambda request: HttpResponse(), **config):
+        with override_settings(BOOKING_INSTRUMENTATION=config):
+            middleware = RequestInstrumentationMiddleware(view)
+        return middleware(RequestFactory().get('/salons/'))
+
+    def test_requests_are_logged_at_debug(self):
+        with self.assertNoLogs('BookingApp.requests', 'INFO'):
+            self.respond()
+        with self.assertLogs('BookingApp.requests', 'DEBUG') as logs:
+            self.respond()
+        self.assertEqual(json.loads(logs.records[0].getMessage())['path'], '/salons/')
+
+    def test_slow_requests_are_always_logged(self):
+        with self.assertNoLogs('BookingApp.requests', 'INFO'), self.assertLogs('BookingApp.slow_requests', 'WARNING') as logs:
+            self.respond(SLOW_REQUEST_MS=0)
+        self.assertIn('top_queries', json.loads(logs.records[0].getMessage()))
+
+    def test_streamed_bodies_are_logged_once_sent(self):
+        def export():
+            with span('export'):
+                yield b'{}\n'
+
+        response = self.respond(lambda request: StreamingHttpResponse(export()))
+        with self.assertLogs('BookingApp.requests', 'DEBUG') as logs:
+            self.assertEqual(b''.join(response.streaming_content), b'{}\n')
+        self.assertEqual(len(logs.records), 1)
+        self.assertIn('export', json.loads(logs.records[0].getMessage())['spans'])
+
+
+@override_settings(BOOKING_SLOT_MODE='materialized')
+class SyntheticDataTests(TestCase):
+    def generate(self, seed):
+        counts = generate_synthetic_data(salons=5, days=3, reviews=2, appointments=2, seed=seed)
+        # Ids differ between runs, salon names carry their index
+        salons = [(name, street, number, location.coords, category) for name, street, number, location, category in
+                  Salon.objects.order_by('name').values_list('name', 'address_street', 'address_number', 'location', 'flutter_category')]
+        services = list(Service.objects.order_by('salon__name', 'title').values_list('salon__name', 'title', 'price', 'duration_minutes'))
+        reviews = list(Review.objects.order_by('salon__name', 'id').values_list('salon__name', 'rating'))
+        booked = list(GeneratedTimeSlots.objects.filter(is_available=False).order_by('salon__name', 'date', 'time_from').values_list(
+            'salon__name', 'date', 'time_from'))
+        delete_synthetic_data()
+        return counts, salons, services, reviews, booked
+
+    def test_a_seed_always_gives_the_same_data(self):
+        first = self.generate(seed=7)
+        self.assertEqual((first[0]['salons'], first[0]['appointments']), (5, 10))
+        self.assertEqual(len(first[4]), 10)
+        self.assertEqual(self.generate(seed=7), first)
+        self.assertNotEqual(self.generate(seed=8)[1], first[1])
+        self.assertFalse(Salon.objects.exists())
+
+
+class BenchmarkBaselineTests(SimpleTestCase):
+    def test_only_worse_metrics_beyond_the_tolerance_are_regressions(self):
+        baseline = {'search_ms': 10, 'search_queries': 3, 'slots_per_second': 1000, 'list_ms': 10, 'salons': 50, 'label': 'a'}
+        results = {'search_ms': 12.5, 'search_queries': 4, 'slots_per_second': 700, 'list_ms': 5, 'salons': 500, 'label': 'b',
+                   'new_ms': 100}
+        self.assertEqual(compare_with_baseline(results, baseline), [
+            'search_ms: 10 -> 12.5', 'search_queries: 3 -> 4', 'slots_per_second: 1000 -> 700'])
+        self.assertEqual(compare_with_baseline(results, baseline, tolerance=0.5), [])
+        self.assertEqual(compare_with_baseline(baseline, baseline, tolerance=0), [])
+
+
+class FreeSlotLookupTests(APITestCase):
+    def setUp(self):
+        # Free from 9:00 to 12:00 but 9:30
+        self.day = date.today() + timedelta(days=7)
+        self.salon, self.slots = create_bookable_salon(self.day)
+        GeneratedTimeSlots.objects.filter(pk=self.slots[1].pk).update(is_available=False)
+
+    def get(self, name, **params):
+        return self.client.get(reverse(f'generatedtimeslots-{name}'), {'salon': self.salon.pk, **params})
+
+    def assertLookups(self, with_ids):
+        response = self.get('next-available', after=f'{self.day.isoformat()}T09:15', limit=2)
+        self.assertEqual(response.status_code, 200)
+        expected = [{'id': slot.pk if with_ids else None, 'date': self.day.isoformat(),
+                     'time_from': slot.time_from.isoformat(), 'time_to': slot.time_to.isoformat()} for slot in self.slots[2:4]]
+        self.assertEqual(response.json()['slots'], expected)
+
+        response = self.get('free-per-day', date_from=(self.day - timedelta(days=1)).isoformat(),
+                            date_to=(self.day + timedelta(days=1)).isoformat())
+        self.assertEqual(response.status_code, 200)
+        days = response.json()['days']
+        self.assertEqual([(day['date'], day['count']) for day in days], [
+            ((self.day + timedelta(days=offset)).isoformat(), 5 if offset == 0 else 0) for offset in (-1, 0, 1)])
+        self.assertEqual([slot['time_from'] for slot in days[1]['slots']], ['09:00:00', '10:00:00', '10:30:00', '11:00:00', '11:30:00'])
+
+    def test_free_slots_from_the_index(self):
+        self.assertLookups(with_ids=True)
+
+    @override_settings(BOOKING_SLOT_MODE='on_demand')
+    def test_on_demand_free_slots_are_computed(self):
+        GeneratedTimeSlots.objects.filter(is_available=True).delete()
+        self.assertLookups(with_ids=False)
+
+    def test_invalid_parameters(self):
+        self.assertEqual(self.client.get(reverse('generatedtimeslots-next-available')).status_code, 400)
+        self.assertEqual(self.get('next-available', limit=0).status_code, 400)
+        self.assertEqual(self.get('next-available', after='tomorrow').status_code, 400)
+        self.assertEqual(self.get('free-per-day', date_from=self.day.isoformat(),
+                                  date_to=(self.day - timedelta(days=1)).isoformat()).status_code, 400)
+        self.assertEqual(self.get('free-per-day', date_to=(self.day + timedelta(days=365)).isoformat()).status_code, 400)
@@ -1,5 +1,6 @@
+from django.conf import settings
 from django.urls import path, include
-from .views import SalonViewSet, CategoryViewSet, ServiceViewSet, GeneratedTimeSlotsViewSet, SalonSearchAPIView, ReviewViewSet, SalonReviews, FixedOperatingHoursViewSet, UnFixedOperatingHoursViewSet, GeneratedTimeSlotsViewSet, AppointmentViewSet
+from .views import SalonViewSet, CategoryViewSet, ServiceViewSet, GeneratedTimeSlotsViewSet, SalonSearchAPIView, AsyncSalonSearchView, FreeSlotSearchAPIView, GeocoderStatsAPIView, SearchCacheStatsAPIView, TimeSlotExportAPIView, AppointmentExportAPIView, SalonExportAPIView, SalonImportAPIView, ReviewViewSet, SalonReviews, FixedOperatingHoursViewSet, UnFixedOperatingHoursViewSet, GeneratedTimeSlotsViewSet, AppointmentViewSet
 from rest_framework.routers import DefaultRouter
 
 router = DefaultRouter()
@@ -15,7 +16,16 @@ router.register(r'appointments', AppointmentViewSet)
 urlpatterns = [
     path('', include(router.urls)),
     path('salons/', SalonViewSet.as_view({'get': 'list', 'post': 'create'}), name='salons-list'),
+    path('salons/import/', SalonImportAPIView.as_view(), name='salons-import'),
     path('salons/<int:pk>/', SalonViewSet.as_view({'get': 'retrieve', 'put': 'update', 'patch': 'partial_update', 'delete': 'destroy'}), name='salons-detail'),
-    path('search/', SalonSearchAPIView.as_view(), name='salon-search'),
+    # BOOKING_ASYNC_SEARCH serves /search/ with the async view (ASGI deployments)
+    path('search/', (AsyncSalonSearchView if getattr(settings, 'BOOKING_ASYNC_SEARCH', False) else SalonSearchAPIView).as_view(), name='salon-search'),
+    path('search/async/', AsyncSalonSearchView.as_view(), name='salon-search-async'),
+    path('search/free-slots/', FreeSlotSearchAPIView.as_view(), name='salon-free-slot-search'),
+    path('geocoding/stats/', GeocoderStatsAPIView.as_view(), name='geocoder-stats'),
+    path('search/cache/stats/', SearchCacheStatsAPIView.as_view(), name='search-cache-stats'),
     path('salons/<int:pk>/reviews/', SalonReviews.as_view(), name='salon-reviews'),
+    path('export/timeslots/', TimeSlotExportAPIView.as_view(), name='export-timeslots'),
+    path('export/appointments/', AppointmentExportAPIView.as_view(), name='export-appointments'),
+    path('export/salons/', SalonExportAPIView.as_view(), name='export-salons'),
 ]
\ No newline at end of file
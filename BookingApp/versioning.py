@@ -0,0 +1,152 @@
+import threading
+from datetime import datetime, time as dtime
+from django.db import transaction
+from django.db.models import Count, F, Max, Sum
+from django.utils import timezone
+from .models import Salon, CatalogVersion, time_slots_on_demand
+
+## ------------------------------------------------------->
+## Salon versions
+##
+## Salon.version / Salon.modified_at change whenever anything shown under the
+## salon changes: the salon itself, its categories, services, reviews,
+## operating hours or time slots. Writes inside a transaction only collect
+## salon ids; the first commit callback bumps all of them in one UPDATE.
+
+_pending = threading.local()
+
+def bump_salon_versions(salon_ids=None):
+    # salon_ids=None bumps every salon
+    salons = Salon.objects.all()
+    if salon_ids is not None:
+        salon_ids = {salon_id for salon_id in salon_ids if salon_id is not None}
+        if not salon_ids:
+            return 0
+        salons = salons.filter(pk__in=salon_ids)
+    return salons.update(version=F('version') + 1, modified_at=timezone.now())
+
+
+def schedule_salon_version_bump(*salon_ids):
+    if not hasattr(_pending, 'salon_ids'):
+        _pending.salon_ids = set()
+    _pending.salon_ids.update(salon_ids)
+    transaction.on_commit(_flush_salon_version_bump)
+
+
+def _flush_salon_version_bump():
+    salon_ids = getattr(_pending, 'salon_ids', set())
+    _pending.salon_ids = set()
+    bump_salon_versions(salon_ids)
+
+## Salon versions
+## ------------------------------------------------------->
+
+## ------------------------------------------------------->
+## Catalog version
+##
+## /categories/ lists every category and service, also those of no salon, so
+## it is versioned on its own: one CatalogVersion row, bumped once per
+## transaction that wrote categories or services. Its ETag is a primary key
+## lookup instead of an aggregate over every salon.
+
+CATALOG_VERSION_PK = 1
+
+def bump_catalog_version():
+    CatalogVersion.objects.bulk_create([CatalogVersion(pk=CATALOG_VERSION_PK)], ignore_conflicts=True)
+    return CatalogVersion.objects.filter(pk=CATALOG_VERSION_PK).update(version=F('version') + 1, modified_at=timezone.now())
+
+
+def schedule_catalog_version_bump():
+    _pending.catalog = True
+    transaction.on_commit(_flush_catalog_version_bump)
+
+
+def _flush_catalog_version_bump():
+    # The first callback of the transaction bumps, the others find nothing pending
+    if getattr(_pending, 'catalog', False):
+        _pending.catalog = False
+        bump_catalog_version()
+
+## Catalog version
+## ------------------------------------------------------->
+
+## ------------------------------------------------------->
+## Conditional GET
+##
+## ETag / Last-Modified callbacks for django.views.decorators.http.condition.
+## One aggregate query per request answers both; a matching If-None-Match or
+## If-Modified-Since returns 304 before the queryset or serializer runs.
+
+def _salon_state(request, salon_id=None):
+    states = getattr(request, '_salon_states', None)
+    if states is None:
+        states = request._salon_states = {}
+    if salon_id not in states:
+        salons = Salon.objects.all() if salon_id is None else Salon.objects.filter(pk=salon_id)
+        states[salon_id] = salons.aggregate(
+            count=Count('id'), max_id=Max('id'), version=Sum('version'), modified_at=Max('modified_at'))
+    return states[salon_id]
+
+
+def _etag(prefix, state):
+    return f'{prefix}-{state["count"]}-{state["max_id"]}-{state["version"]}'
+
+
+def salon_etag(request, pk=None, **kwargs):
+    try:
+        state = _salon_state(request, int(pk))
+    except (TypeError, ValueError):
+        return None
+    return _etag('salon', state) if state['count'] else None
+
+
+def salon_last_modified(request, pk=None, **kwargs):
+    try:
+        return _salon_state(request, int(pk))['modified_at']
+    except (TypeError, ValueError):
+        return None
+
+
+def _catalog_state(request):
+    state = getattr(request, '_catalog_state', None)
+    if state is None:
+        state = request._catalog_state = CatalogVersion.objects.filter(pk=CATALOG_VERSION_PK).values(
+            'version', 'modified_at').first() or {'version': 0, 'modified_at': None}
+    return state
+
+
+def catalog_etag(request, *args, **kwargs):
+    return f'catalog-{_catalog_state(request)["version"]}'
+
+
+def catalog_last_modified(request, *args, **kwargs):
+    return _catalog_state(request)['modified_at']
+
+
+def _slot_list_salon(request):
+    # None lists every salon, a malformed ?salon= raises ValueError
+    salon = request.GET.get('salon')
+    return int(salon) if salon else None
+
+
+def time_slots_etag(request, *args, **kwargs):
+    try:
+        salon_id = _slot_list_salon(request)
+    except ValueError:
+        return None
+    # Computed (on-demand) listings without a date start today
+    return _etag(f'slots-{timezone.now().date()}', _salon_state(request, salon_id))
+
+
+def time_slots_last_modified(request, *args, **kwargs):
+    try:
+        modified_at = _salon_state(request, _slot_list_salon(request))['modified_at']
+    except ValueError:
+        return None
+    if modified_at is not None and time_slots_on_demand() and not request.GET.get('date'):
+        today = timezone.make_aware(datetime.combine(timezone.now().date(), dtime.min))
+        modified_at = max(modified_at, today)
+    return modified_at
+
+## Conditional GET
+## ------------------------------------------------------->
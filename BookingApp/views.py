@@ -1,14 +1,51 @@
+import codecs
+import json
+import math
+from asgiref.sync import sync_to_async
+from datetime import date, datetime, timedelta
+from django.db import transaction
+from django.db.models import QuerySet
+from django.utils import timezone
 from rest_framework.response import Response
-from rest_framework import viewsets, status, filters
+from rest_framework import viewsets, status
+from rest_framework.decorators import action
 from rest_framework.views import APIView
 from django_filters.rest_framework import DjangoFilterBackend
-from django.http import Http404, JsonResponse
-from .models import Salon, Category, Service, Review, FixedOperatingHours, UnFixedOperatingHours, GeneratedTimeSlots, Appointment
-from .serializers import SalonSerializer, ReadOnlySalonSerializer, ServiceSerializer, CategorySerializer, ReviewSerializer, FixedOperatingHoursSerializer, GeneratedTimeSlotsSerializer, UnFixedOperatingHoursSerializer, AppointmentSerializer
-from .search import search_salons, search_by_keywords, search_by_address_radius
+from django.core.serializers.json import DjangoJSONEncoder
+from django.http import Http404, HttpResponse, JsonResponse, StreamingHttpResponse
+from django.utils.decorators import method_decorator
+from django.views import View
+from django.views.decorators.http import condition
+from .models import Salon, Category, Service, Review, FixedOperatingHours, UnFixedOperatingHours, GeneratedTimeSlots, Appointment, time_slots_on_demand
+from .serializers import SalonSerializer, ReadOnlySalonSerializer, ServiceSerializer, CategorySerializer, ReviewSerializer, FixedOperatingHoursSerializer, GeneratedTimeSlotsSerializer, FreeTimeSlotSerializer, UnFixedOperatingHoursSerializer, AppointmentSerializer, AppointmentBulkSerializer
+from django.contrib.gis.geos import Point
+from django.contrib.gis.measure import D
+from .search import parse_radius, salon_search_queryset, search_free_slots, get_point_from_address, aget_point_from_address
+from .availability import FREE_SLOT_FIELDS, AvailableSlots, materialize_day, next_free_slots, free_slots_by_day
+from .geocoding import get_geocoder
+from .search_cache import get_search_cache, normalize_search_query
+from .pagination import KeysetPagination
+from .instrumentation import span
+from .fast_render import fast_serialization_enabled, mappers_for, map_rows, values_lookups, render_drf_json, render_django_json, salon_rows, asalon_rows
+from .booking import release_time_slots, apply_appointment_operations
+from .export import ExportFilterError, parse_export_filters, export_time_slots, export_appointments, export_salons
+from .importer import import_salons
+from .maintenance import SLOT_HORIZON_DAYS
+from .versioning import salon_etag, salon_last_modified, catalog_etag, catalog_last_modified, time_slots_etag, time_slots_last_modified
 
 class SalonViewSet(viewsets.ModelViewSet):
     queryset = Salon.objects.all()
+    pagination_class = KeysetPagination
+    keyset_ordering = ('id',)
+
+    @method_decorator(condition(etag_func=salon_etag, last_modified_func=salon_last_modified))
+    def retrieve(self, request, *args, **kwargs):
+        return super().retrieve(request, *args, **kwargs)
+
+    def get_queryset(self):
+        if self.request.method == 'GET':
+            return ReadOnlySalonSerializer.setup_eager_loading(super().get_queryset())
+        return super().get_queryset()
 
     def get_serializer_class(self):
         if self.request.method == 'GET':
@@ -16,39 +53,178 @@ class SalonViewSet(viewsets.ModelViewSet):
         return SalonSerializer
     
 class CategoryViewSet(viewsets.ModelViewSet):
-    queryset = Category.objects.all()
+    queryset = Category.objects.prefetch_related('services')
     serializer_class = CategorySerializer
 
+    @method_decorator(condition(etag_func=catalog_etag, last_modified_func=catalog_last_modified))
+    def list(self, request, *args, **kwargs):
+        return super().list(request, *args, **kwargs)
+
 class ServiceViewSet(viewsets.ModelViewSet):
     queryset = Service.objects.all()
     serializer_class = ServiceSerializer
 
 class SalonSearchAPIView(APIView):
     def get(self, request):
-        keywords = request.query_params.get('keywords', '')
-        address = request.query_params.get('address', '')
-        radius = request.query_params.get('radius', '')
-
-        # Warunek sprawdzający, czy przynajmniej jeden parametr wyszukiwania jest podany
-        if keywords and not address and not radius:
-            salons = search_by_keywords(keywords)
-        elif address and radius and not keywords:
-            salons = search_by_address_radius(address, radius)
-        elif keywords and address and radius:
-            salons = search_salons(keywords, address, radius)
-        else:
-            # Jeżeli nie podano żadnego parametru, zwracamy wszystkie salony
-            salons = Salon.objects.all()
+        keywords = request.query_params.get('keywords', '').strip()
+        address = request.query_params.get('address', '').strip()
+
+        try:
+            radius = parse_radius(request.query_params.get('radius', ''))
+        except ValueError:
+            return Response({'detail': 'radius must be a positive number of meters.'}, status=status.HTTP_400_BAD_REQUEST)
+        try:
+            min_rating = float(request.query_params.get('min_rating') or 0)
+        except ValueError:
+            return Response({'detail': 'min_rating must be a number.'}, status=status.HTTP_400_BAD_REQUEST)
+
+        # Identical queries are answered from the search cache (see search_cache.py)
+        query = normalize_search_query(request.query_params, min_rating)
+        content = get_search_cache().get_or_compute(query, lambda: self.search(keywords, address, radius, min_rating, request.query_params.get('ordering')))
+        return HttpResponse(content, content_type='application/json', charset='utf-8')
+
+    def search(self, keywords, address, radius, min_rating, ordering):
+        point = get_point_from_address(address) if address and radius else None
+        return self.render(salon_search_queryset(keywords, address, radius, point, min_rating, ordering))
+
+    @staticmethod
+    def render(salons):
+        if fast_serialization_enabled():
+            data = salon_rows(salons)
+            with span('serialize'):
+                return render_django_json(data)
 
-        # Używamy JsonResponse, aby zwrócić dane JSON z poprawnym nagłówkiem Content-Type
-        data = ReadOnlySalonSerializer(salons, many=True).data
+        with span('search_sql'):
+            salons = list(ReadOnlySalonSerializer.setup_eager_loading(salons))
+        with span('serialize'):
+            # Same bytes JsonResponse would produce
+            data = ReadOnlySalonSerializer(salons, many=True).data
+            return json.dumps(data, cls=DjangoJSONEncoder).encode('utf-8')
+
+class AsyncSalonSearchView(View):
+    # Native async /search/ for ASGI deployments: same parameters, cache and bytes as
+    # SalonSearchAPIView, but geocoding and the fast path queries are awaited and hold
+    # no thread while the geocoder or the database answers
+    async def get(self, request):
+        keywords = request.GET.get('keywords', '').strip()
+        address = request.GET.get('address', '').strip()
+
+        try:
+            radius = parse_radius(request.GET.get('radius', ''))
+        except ValueError:
+            return JsonResponse({'detail': 'radius must be a positive number of meters.'}, status=status.HTTP_400_BAD_REQUEST)
+        try:
+            min_rating = float(request.GET.get('min_rating') or 0)
+        except ValueError:
+            return JsonResponse({'detail': 'min_rating must be a number.'}, status=status.HTTP_400_BAD_REQUEST)
+
+        query = normalize_search_query(request.GET, min_rating)
+        content = await get_search_cache().aget_or_compute(
+            query, lambda: self.search(keywords, address, radius, min_rating, request.GET.get('ordering')))
+        return HttpResponse(content, content_type='application/json', charset='utf-8')
+
+    async def search(self, keywords, address, radius, min_rating, ordering):
+        point = await aget_point_from_address(address) if address and radius else None
+        salons = salon_search_queryset(keywords, address, radius, point, min_rating, ordering)
+        if fast_serialization_enabled():
+            data = await asalon_rows(salons)
+            with span('serialize'):
+                return render_django_json(data)
+        # Prefetching querysets cannot be iterated asynchronously
+        return await sync_to_async(SalonSearchAPIView.render)(salons)
+
+class FreeSlotSearchAPIView(APIView):
+    # Salons near a location with `duration` consecutive free minutes on `date`
+    def get(self, request):
+        params = request.query_params
+        address = params.get('address', '')
+        try:
+            radius = float(params.get('radius', ''))
+            duration = int(params.get('duration', ''))
+            day = date.fromisoformat(params['date']) if params.get('date') else timezone.now().date()
+            if address:
+                point = get_point_from_address(address)
+            else:
+                point = Point(float(params['lon']), float(params['lat']), srid=4326)
+        except (KeyError, ValueError):
+            return Response({'detail': 'radius, duration and either address or lat/lon are required.'}, status=status.HTTP_400_BAD_REQUEST)
+        if point is None:
+            return Response({'detail': 'Address could not be geocoded.'}, status=status.HTTP_400_BAD_REQUEST)
+        if not math.isfinite(radius) or radius <= 0 or duration <= 0:
+            return Response({'detail': 'radius and duration must be positive.'}, status=status.HTTP_400_BAD_REQUEST)
+
+        rows = search_free_slots(point, radius, day, duration, params.get('keywords', ''), params.get('flutter_category', ''))
+        salons = ReadOnlySalonSerializer.setup_eager_loading(Salon.objects.all()).in_bulk([salon_id for salon_id, _, _ in rows])
+
+        data = []
+        for salon_id, earliest_start, distance in rows:
+            salon = salons[salon_id]
+            salon.distance = D(m=distance)
+            item = ReadOnlySalonSerializer(salon).data
+            item['earliest_start'] = earliest_start.isoformat()
+            data.append(item)
         return JsonResponse(data, charset='utf-8', safe=False)
 
+class GeocoderStatsAPIView(APIView):
+    # Hit/miss counters of the geocoding cache of this process
+    def get(self, request):
+        return Response(get_geocoder().stats())
+
+class SearchCacheStatsAPIView(APIView):
+    # Hit ratio and latency of the search result cache in this process
+    def get(self, request):
+        return Response(get_search_cache().stats())
+
+class ExportAPIView(APIView):
+    # Streams one JSON object per line, see export.py
+    export = None
+
+    def get(self, request):
+        try:
+            filters = parse_export_filters(request.query_params)
+        except ExportFilterError as error:
+            return Response({'detail': str(error)}, status=status.HTTP_400_BAD_REQUEST)
+        return StreamingHttpResponse(type(self).export(filters), content_type='application/x-ndjson')
+
+class TimeSlotExportAPIView(ExportAPIView):
+    export = export_time_slots
+
+class AppointmentExportAPIView(ExportAPIView):
+    export = export_appointments
+
+class SalonExportAPIView(ExportAPIView):
+    export = export_salons
+
+class SalonImportAPIView(APIView):
+    # POST an NDJSON (application/x-ndjson) or CSV (text/csv) body, see importer.py.
+    # The body is read line by line, never parsed into request.data.
+    formats = {
+        'application/x-ndjson': 'ndjson',
+        'application/jsonl': 'ndjson',
+        'text/csv': 'csv',
+    }
+
+    def post(self, request):
+        media_type = request.content_type.split(';')[0].strip().lower()
+        if media_type not in self.formats:
+            return Response({'detail': f'Content-Type must be one of {", ".join(self.formats)}.'},
+                            status=status.HTTP_415_UNSUPPORTED_MEDIA_TYPE)
+        lines = codecs.iterdecode(request.stream or [], 'utf-8-sig')
+        try:
+            report = import_salons(lines, self.formats[media_type])
+        except UnicodeDecodeError:
+            return Response({'detail': 'The body must be UTF-8.'}, status=status.HTTP_400_BAD_REQUEST)
+        return Response(report)
+
 class ReviewViewSet(viewsets.ModelViewSet):
     queryset = Review.objects.all()
     serializer_class = ReviewSerializer
+    pagination_class = KeysetPagination
+    keyset_ordering = ('salon', 'created_at', 'id')
 
 class SalonReviews(APIView):
+    keyset_ordering = ('salon', 'created_at', 'id')
+
     def get_object(self, pk):
         try:
             return Salon.objects.get(pk=pk)
@@ -58,8 +234,10 @@ class SalonReviews(APIView):
     def get(self, request, pk, format=None):
         salon = self.get_object(pk)
         reviews = Review.objects.filter(salon=salon)
-        serializer = ReviewSerializer(reviews, many=True)
-        return Response(serializer.data)
+        paginator = KeysetPagination()
+        page = paginator.paginate_queryset(reviews, request, view=self)
+        serializer = ReviewSerializer(page, many=True)
+        return paginator.get_paginated_response(serializer.data)
 
 class FixedOperatingHoursViewSet(viewsets.ModelViewSet):
     queryset = FixedOperatingHours.objects.all()
@@ -93,13 +271,116 @@ class UnFixedOperatingHoursViewSet(viewsets.ModelViewSet):
 class GeneratedTimeSlotsViewSet(viewsets.ModelViewSet):
     queryset = GeneratedTimeSlots.objects.all().order_by('salon', 'date', 'time_from')
     serializer_class = GeneratedTimeSlotsSerializer
-    filter_backends = [DjangoFilterBackend, filters.OrderingFilter]
-    filterset_fields = ['salon']
-    ordering_fields = ['salon', 'date', 'time_from']
+    filter_backends = [DjangoFilterBackend]
+    filterset_fields = ['salon', 'date']
+    pagination_class = KeysetPagination
+    keyset_ordering = ('salon', 'date', 'time_from', 'id')
+
+    @method_decorator(condition(etag_func=time_slots_etag, last_modified_func=time_slots_last_modified))
+    def list(self, request, *args, **kwargs):
+        if not time_slots_on_demand():
+            return self.list_slots(self.filter_queryset(self.get_queryset()))
+
+        # Computed and never stored here: GETs stay read-only (see replicas.py). A day is
+        # stored when an appointment is posted with its date and time_from, or by POST
+        # materialize/. One salon over the horizon or one day of every salon; pages are
+        # expanded from their cursor on.
+        salon = request.query_params.get('salon')
+        day = request.query_params.get('date')
+        try:
+            salon_ids = [int(salon)] if salon else None
+            day = date.fromisoformat(day) if day else None
+        except ValueError:
+            return Response({'detail': 'Invalid salon or date.'}, status=status.HTTP_400_BAD_REQUEST)
+        if salon_ids is None and day is None:
+            return Response({'detail': 'salon or date is required.'}, status=status.HTTP_400_BAD_REQUEST)
+
+        start_date = day or timezone.now().date()
+        end_date = day or start_date + timedelta(days=SLOT_HORIZON_DAYS)
+        return self.list_slots(AvailableSlots(salon_ids, start_date, end_date))
+
+    @action(detail=False, methods=['post'], url_path='materialize')
+    def materialize(self, request):
+        # {"salon": <id>, "date": "YYYY-MM-DD"}: stores the slots of one salon-day (on-demand
+        # mode computes them otherwise) and returns its free ones with the ids to book
+        try:
+            salon_id = int(request.data['salon'])
+            day = date.fromisoformat(str(request.data['date']))
+        except (KeyError, TypeError, ValueError):
+            return Response({'detail': 'salon and date are required.'}, status=status.HTTP_400_BAD_REQUEST)
+        slots = materialize_day(salon_id, day).filter(is_available=True).values(*FREE_SLOT_FIELDS)
+        return Response({'salon': salon_id, 'date': day, 'slots': FreeTimeSlotSerializer(slots, many=True).data})
+
+    def list_slots(self, slots):
+        # slots: a queryset, or AvailableSlots in on-demand mode
+        if fast_serialization_enabled(self.request):
+            mappers = mappers_for(self.get_serializer_class())
+            if isinstance(slots, QuerySet):
+                slots = slots.values('id', *values_lookups(mappers))
+            page = self.paginate_queryset(slots)
+            with span('serialize'):
+                content = render_drf_json(self.paginator.get_paginated_data(map_rows(mappers, page)))
+            return HttpResponse(content, content_type='application/json')
+
+        page = self.paginate_queryset(slots)
+        with span('serialize'):
+            data = self.get_serializer(page, many=True).data
+        return self.get_paginated_response(data)
+
+    NEXT_AVAILABLE_LIMIT = 10
+    MAX_NEXT_AVAILABLE_LIMIT = 100
+    MAX_FREE_DAYS = 31
+
+    @action(detail=False, url_path='next-available')
+    def next_available(self, request):
+        # ?salon=<id>[&limit=10][&after=<ISO datetime>]: the salon's next free slots
+        try:
+            salon_id = int(request.query_params['salon'])
+            limit = int(request.query_params.get('limit', self.NEXT_AVAILABLE_LIMIT))
+            after = request.query_params.get('after')
+            after = datetime.fromisoformat(after) if after else timezone.localtime()
+        except (KeyError, ValueError):
+            return Response({'detail': 'salon is required, limit must be a number and after an ISO datetime.'},
+                            status=status.HTTP_400_BAD_REQUEST)
+        if not 0 < limit <= self.MAX_NEXT_AVAILABLE_LIMIT:
+            return Response({'detail': f'limit must be between 1 and {self.MAX_NEXT_AVAILABLE_LIMIT}.'},
+                            status=status.HTTP_400_BAD_REQUEST)
+        if timezone.is_aware(after):
+            after = timezone.localtime(after)
+
+        end_date = timezone.localdate() + timedelta(days=SLOT_HORIZON_DAYS)
+        slots = next_free_slots(salon_id, after, limit, end_date)
+        with span('serialize'):
+            return Response({'salon': salon_id, 'slots': FreeTimeSlotSerializer(slots, many=True).data})
+
+    @action(detail=False, url_path='free-per-day')
+    def free_per_day(self, request):
+        # ?salon=<id>[&date_from=<date>][&date_to=<date>]: free slots of each day, a week from today by default
+        try:
+            salon_id = int(request.query_params['salon'])
+            start_date = request.query_params.get('date_from')
+            start_date = date.fromisoformat(start_date) if start_date else timezone.localdate()
+            end_date = request.query_params.get('date_to')
+            end_date = date.fromisoformat(end_date) if end_date else start_date + timedelta(days=6)
+        except (KeyError, ValueError):
+            return Response({'detail': 'salon is required, date_from and date_to must be ISO dates.'},
+                            status=status.HTTP_400_BAD_REQUEST)
+        if not 0 <= (end_date - start_date).days < self.MAX_FREE_DAYS:
+            return Response({'detail': f'date_to must be within {self.MAX_FREE_DAYS} days from date_from.'},
+                            status=status.HTTP_400_BAD_REQUEST)
+
+        days = free_slots_by_day(salon_id, start_date, end_date)
+        with span('serialize'):
+            return Response({'salon': salon_id, 'days': [
+                {'date': day, 'count': len(slots), 'slots': FreeTimeSlotSerializer(slots, many=True).data}
+                for day, slots in days.items()
+            ]})
 
 class AppointmentViewSet(viewsets.ModelViewSet):
     queryset = Appointment.objects.all()
     serializer_class = AppointmentSerializer
+    pagination_class = KeysetPagination
+    keyset_ordering = ('id',)
 
     def create(self, request, *args, **kwargs):
         serializer = self.get_serializer(data=request.data)
@@ -110,12 +391,25 @@ class AppointmentViewSet(viewsets.ModelViewSet):
 
     def destroy(self, request, *args, **kwargs):
         appointment = self.get_object()
-        print(appointment)
 
-        # Set the is_available field of each timeslot back to True
-        for timeslot in appointment.timeslots.all():
-            timeslot.is_available = True
-            timeslot.save()
+        # Set the is_available field of the timeslots back to True and delete the appointment.
+        # A cancelled appointment released its timeslots already, they may be booked again.
+        with transaction.atomic():
+            if appointment.status != 'X':
+                release_time_slots(appointment.timeslots.values_list('pk', flat=True))
+            self.perform_destroy(appointment)
+        return Response(status=status.HTTP_204_NO_CONTENT)
 
-        # Call the parent class's destroy method to delete the appointment
-        return super().destroy(request, *args, **kwargs)
\ No newline at end of file
+    @action(detail=False, methods=['post'], url_path='bulk')
+    def bulk(self, request):
+        # {"operations": [{"id": 1, "action": "cancel"},
+        #                 {"id": 2, "action": "status", "status": "C"},
+        #                 {"id": 3, "action": "reschedule", "timeslots": [10, 11]}]}
+        serializer = AppointmentBulkSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        results = apply_appointment_operations(serializer.validated_data['operations'])
+        return Response({
+            'succeeded': sum(result['success'] for result in results),
+            'failed': sum(not result['success'] for result in results),
+            'results': results,
+        })
\ No newline at end of file
@@ -10,6 +10,7 @@ For the full list of settings and their values, see
 https://docs.djangoproject.com/en/4.2/ref/settings/
 """
 
+from datetime import timedelta
 from pathlib import Path
 import environ
 
@@ -38,6 +39,7 @@ INSTALLED_APPS = [
     '[yours_Django_app]',
     'rest_framework',
     'django.contrib.gis',
+    'django.contrib.postgres',
     'django.contrib.admin',
     'django.contrib.auth',
     'django.contrib.contenttypes',
@@ -48,6 +50,8 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'BookingApp.instrumentation.RequestInstrumentationMiddleware',
+    'BookingApp.replicas.ReplicaRoutingMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -81,6 +85,8 @@ WSGI_APPLICATION = 'BookingApp.wsgi.application'
 # Database
 # https://docs.djangoproject.com/en/4.2/ref/settings/#databases
 
+DB_PGBOUNCER = env.bool('DB_PGBOUNCER', default=False)
+
 DATABASES = {
     'default': {
         'ENGINE': 'django.contrib.gis.db.backends.postgis',
@@ -89,9 +95,29 @@ DATABASES = {
         'PASSWORD': env("DB_PASSWORD"),
         'HOST': env("DB_HOST"),
         'PORT': env("DB_PORT"),
+        # Persistent connections, checked once per request before reuse. For a shared
+        # pool across processes put PgBouncer (transaction mode) in front: DB_PGBOUNCER=1
+        'CONN_MAX_AGE': env.int('DB_CONN_MAX_AGE', default=0 if DB_PGBOUNCER else 60),
+        'CONN_HEALTH_CHECKS': True,
+        # Server-side cursors (QuerySet.iterator()) do not survive PgBouncer's transaction pooling
+        'DISABLE_SERVER_SIDE_CURSORS': DB_PGBOUNCER,
     }
 }
 
+# Read replicas, see BookingApp/replicas.py. DB_REPLICA_HOSTS=host[:port],... with the
+# primary's credentials; locally a second database can stand in (DB_REPLICA_NAME)
+for index, replica_host in enumerate(env.list('DB_REPLICA_HOSTS', default=[])):
+    replica_host, _, replica_port = replica_host.partition(':')
+    DATABASES[f'replica_{index}'] = dict(
+        DATABASES['default'],
+        HOST=replica_host,
+        PORT=replica_port or DATABASES['default']['PORT'],
+        NAME=env('DB_REPLICA_NAME', default=DATABASES['default']['NAME']),
+        TEST={'MIRROR': 'default'},
+    )
+
+DATABASE_ROUTERS = ['BookingApp.replicas.ReplicaRouter']
+
 
 # Password validation
 # https://docs.djangoproject.com/en/4.2/ref/settings/#auth-password-validators
@@ -135,3 +161,68 @@ STATIC_URL = 'static/'
 # https://docs.djangoproject.com/en/4.2/ref/settings/#default-auto-field
 
 DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
+
+
+# Booking
+
+# 'materialized' stores every slot of the 30 day horizon in GeneratedTimeSlots,
+# 'on_demand' computes availability from operating hours and bookings
+BOOKING_SLOT_MODE = env('BOOKING_SLOT_MODE', default='materialized')
+
+# Render /search/ and /generatedtimeslots/ from .values() rows with precompiled
+# field mappers (and orjson when installed) instead of DRF serializers; same bytes
+BOOKING_FAST_SERIALIZATION = env.bool('BOOKING_FAST_SERIALIZATION', default=False)
+
+# Serve /search/ with the native async view (BookingApp.views.AsyncSalonSearchView).
+# Only worth it under ASGI (BookingAppSettings/asgi.py); under WSGI each request
+# would run it in its own event loop
+BOOKING_ASYNC_SEARCH = env.bool('BOOKING_ASYNC_SEARCH', default=False)
+
+# Keyset pagination of list endpoints (?page_size= is capped at BOOKING_MAX_PAGE_SIZE)
+BOOKING_PAGE_SIZE = 100
+BOOKING_MAX_PAGE_SIZE = 1000
+
+# Geocoding cache, see BookingApp/geocoding.py
+BOOKING_GEOCODER = {
+    'UPSTREAM': 'BookingApp.geocoding.NominatimUpstream',
+    'UPSTREAM_OPTIONS': {'user_agent': env('GEOCODER_USER_AGENT', default='BookingApp')},
+    'LRU_SIZE': 1024,
+    'TTL': timedelta(days=30),
+    'NEGATIVE_TTL': timedelta(hours=1),
+}
+
+# /search/ result cache, see BookingApp/search_cache.py. 'CACHE' is an alias in
+# CACHES; without a CACHES setting Django uses per-process local memory
+BOOKING_SEARCH_CACHE = {
+    'CACHE': 'default',
+    'TIMEOUT': 60,
+    'LOCK_TIMEOUT': 10,
+    'WAIT': 2,
+}
+
+# Read replica routing, see BookingApp/replicas.py
+BOOKING_REPLICAS = {
+    'ALIASES': [alias for alias in DATABASES if alias.startswith('replica_')],
+    'STICKY_SECONDS': env.int('DB_REPLICA_STICKY_SECONDS', default=10),
+    'RETRY_SECONDS': 30,
+}
+
+# Per-request SQL / span timing, see BookingApp/instrumentation.py
+BOOKING_INSTRUMENTATION = {
+    'SERVER_TIMING': env.bool('BOOKING_SERVER_TIMING', default=True),
+    'SLOW_REQUEST_MS': 500,
+    'TOP_QUERIES': 5,
+}
+
+# BOOKING_REQUEST_LOG_LEVEL=DEBUG logs every request (BookingApp/instrumentation.py)
+LOGGING = {
+    'version': 1,
+    'disable_existing_loggers': False,
+    'handlers': {
+        'console': {'class': 'logging.StreamHandler'},
+    },
+    'loggers': {
+        'BookingApp.requests': {'handlers': ['console'], 'level': env('BOOKING_REQUEST_LOG_LEVEL', default='INFO'), 'propagate': False},
+        'BookingApp.slow_requests': {'handlers': ['console'], 'level': 'WARNING', 'propagate': False},
+    },
+}